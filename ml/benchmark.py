@@ -0,0 +1,236 @@
+# ml/benchmark.py
+"""
+Micro-benchmarks for the ML hot paths.
+
+    python ml/benchmark.py run --out /tmp/bench.json
+    python ml/benchmark.py compare ml/benchmark_baseline.json /tmp/bench.json
+    python ml/benchmark.py run --out ml/benchmark_baseline.json   # refresh the baseline
+
+Every benchmark works on the same seeded positions, and the model benchmarks
+use a freshly built train.build_model network with fixed weights. Each
+result is the best of several repeats, reported per item. `compare` exits
+non-zero when any benchmark is slower than the baseline by more than the
+threshold. Baselines are only comparable on the same machine.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import random
+import sys
+import time
+
+import chess
+import numpy as np
+
+from dataset import dense_policy_from_sparse, normalize_labels
+from features import board_to_features
+from fen_utils import canonical_fen
+from policy_map import POLICY_VERSION, index_to_move, move_to_index
+
+BASELINE = pathlib.Path(__file__).resolve().with_name("benchmark_baseline.json")
+SEED = int(os.environ.get("AZ_BENCH_SEED", "1234"))
+POSITIONS = int(os.environ.get("AZ_BENCH_POSITIONS", "64"))
+REPEATS = int(os.environ.get("AZ_BENCH_REPEATS", "5"))
+MIN_SECONDS = float(os.environ.get("AZ_BENCH_MIN_SECONDS", "0.2"))
+THRESHOLD = float(os.environ.get("AZ_BENCH_THRESHOLD", "0.20"))
+MODEL_BATCH_SIZES = (1, 8, 32)
+
+
+def seeded_boards(count: int = POSITIONS, seed: int = SEED) -> list[chess.Board]:
+    """Positions reached by seeded random play, 8 to 60 plies deep, never game-over."""
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = chess.Board()
+        for _ in range(rng.randint(8, 60)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        if not board.is_game_over(claim_draw=True):
+            boards.append(board)
+    return boards
+
+
+def benchmark_model(seed: int = SEED):
+    """Deterministic build_model network; imports TensorFlow on first use."""
+    import tensorflow as tf
+
+    import train
+
+    tf.keras.utils.set_random_seed(seed)
+    return train.build_model()
+
+
+def _sparse_policy(board: chess.Board) -> list[list[float]]:
+    moves = list(board.legal_moves)
+    return [[move_to_index(move), 1.0 / len(moves)] for move in moves]
+
+
+def _setup_primitives(boards):
+    fens = [board.fen() for board in boards]
+    moves = [move for board in boards for move in board.legal_moves]
+    indices = [move_to_index(move) for move in moves]
+    policies = [_sparse_policy(board) for board in boards]
+    labels = [
+        {"fen": fen, "cp": 10.0, "policy_version": POLICY_VERSION, "policy": policy}
+        for fen, policy in zip(fens, policies)
+    ]
+    return {
+        "board_to_features": (lambda: [board_to_features(fen) for fen in fens], len(fens)),
+        "move_to_index": (lambda: [move_to_index(move) for move in moves], len(moves)),
+        "index_to_move": (lambda: [index_to_move(index) for index in indices], len(indices)),
+        "canonical_fen": (lambda: [canonical_fen(fen) for fen in fens], len(fens)),
+        "dense_policy_from_sparse": (
+            lambda: [dense_policy_from_sparse(policy, fen, POLICY_VERSION) for policy, fen in zip(policies, fens)],
+            len(fens),
+        ),
+        "normalize_labels": (lambda: normalize_labels(labels, workers=1), len(labels)),
+    }
+
+
+def _setup_search(boards):
+    import self_play
+
+    model = benchmark_model()
+    cases = {}
+    for size in MODEL_BATCH_SIZES:
+        batch = boards[:size]
+        cases[f"model_policy_value_batch_{size}"] = (
+            lambda batch=batch: self_play.model_policy_value_batch(model, batch),
+            len(batch),
+        )
+
+    priors = [{index: probability for index, probability in _sparse_policy(board)} for board in boards]
+
+    def expand():
+        for board, board_priors in zip(boards, priors):
+            self_play.Node(board).expand(board_priors)
+
+    expanded = []
+    for board, board_priors in zip(boards, priors):
+        node = self_play.Node(board)
+        node.expand(board_priors)
+        node.visit_count = 10
+        for offset, child in enumerate(node.children.values()):
+            child.visit_count = offset % 3
+            child.value_sum = 0.1 * (offset % 5) - 0.2
+        expanded.append(node)
+    cases["node_expand"] = (expand, len(boards))
+    cases["node_select_child"] = (lambda: [node.select_child() for node in expanded], len(expanded))
+
+    search_boards = boards[:8]
+    cases["run_search_batch_8x16"] = (
+        lambda: self_play.run_search_batch(model, search_boards, searches=16, add_noise=False),
+        len(search_boards) * 16,
+    )
+    return cases
+
+
+def time_case(function, repeats: int = REPEATS, min_seconds: float = MIN_SECONDS) -> tuple[float, int]:
+    """Best seconds per call over `repeats`, each repeat looping until it lasts `min_seconds`."""
+    function()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(max(0, repeats - 1)):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best, number
+
+
+def run_benchmarks(names=None, repeats: int = REPEATS, min_seconds: float = MIN_SECONDS) -> dict:
+    boards = seeded_boards()
+    cases = _setup_primitives(boards)
+    if names is None or any(name not in cases for name in names):
+        cases.update(_setup_search(boards))
+    selected = list(cases) if names is None else list(names)
+    unknown = [name for name in selected if name not in cases]
+    if unknown:
+        raise ValueError(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = {}
+    for name in selected:
+        function, items = cases[name]
+        seconds, number = time_case(function, repeats, min_seconds)
+        results[name] = {
+            "seconds_per_call": seconds,
+            "items_per_call": items,
+            "microseconds_per_item": round(seconds / items * 1e6, 3),
+            "calls_per_repeat": number,
+        }
+        print(f"[bench] {name:<32} {results[name]['microseconds_per_item']:12.3f} us/item")
+    return {
+        "meta": {
+            "created_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED,
+            "positions": len(boards),
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = THRESHOLD) -> list[dict]:
+    """Per-benchmark ratios of current to baseline time per item; slower than 1 + threshold is a regression."""
+    rows = []
+    for name, result in current["benchmarks"].items():
+        reference = baseline.get("benchmarks", {}).get(name)
+        if not reference:
+            continue
+        ratio = result["microseconds_per_item"] / reference["microseconds_per_item"]
+        rows.append({"name": name, "ratio": round(ratio, 3), "regression": ratio > 1.0 + threshold})
+    return rows
+
+
+def _read(path: pathlib.Path) -> dict:
+    return json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ML hot paths and compare against a baseline")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run benchmarks and write JSON results")
+    run_parser.add_argument("--out", type=pathlib.Path, help="result path (default: print only)")
+    run_parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline", type=pathlib.Path, nargs="?", default=BASELINE)
+    compare_parser.add_argument("current", type=pathlib.Path)
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown fraction")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_benchmarks(args.only)
+        if args.out:
+            args.out.parent.mkdir(parents=True, exist_ok=True)
+            args.out.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+            print(f"[bench] wrote {args.out}")
+        return
+
+    rows = compare(_read(args.baseline), _read(args.current), args.threshold)
+    for row in rows:
+        marker = "  REGRESSION" if row["regression"] else ""
+        print(f"[bench] {row['name']:<32} {row['ratio']:7.3f}x baseline{marker}")
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"[bench] {len(regressions)} benchmark(s) slower than {1 + args.threshold:.2f}x baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# ml/dataset.py
+"""
+Label normalization and training-sample encoding without TensorFlow.
+
+Featurizing tens of thousands of positions builds a chess.Board per FEN, so the
+work is split into chunks and fanned out over forked worker processes. Workers
+write feature and policy rows straight into preallocated shared-memory arrays
+and return only the small per-row scalars, which keeps the sample order
+identical to a serial run.
+"""
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import chess
+import numpy as np
+
+from features import PLANES, board_to_features
+from fen_utils import canonical_fen
+from policy_map import POLICY_SIZE, POLICY_VERSION, normalize_policy_index
+
+FLAT_SIZE = 8 * 8 * PLANES
+DATA_WORKERS = int(os.environ.get("AZ_DATA_WORKERS", str(os.cpu_count() or 1)))
+DATA_CHUNK_SIZE = int(os.environ.get("AZ_DATA_CHUNK_SIZE", "512"))
+
+
+def normalize_sparse_policy(policy_items, fen: str, policy_version: int) -> list[list[float]]:
+    board = chess.Board(fen)
+    by_index = {}
+    for item in policy_items or []:
+        if not isinstance(item, (list, tuple)) or len(item) != 2:
+            continue
+        try:
+            index = normalize_policy_index(int(item[0]), board, policy_version)
+            probability = float(item[1])
+        except (TypeError, ValueError):
+            continue
+        if probability > 0 and np.isfinite(probability):
+            by_index[index] = by_index.get(index, 0.0) + probability
+
+    total = sum(by_index.values())
+    if total <= 0:
+        return []
+    return [[index, probability / total] for index, probability in sorted(by_index.items())]
+
+
+def _normalize_label_chunk(items: list[dict]) -> list[dict]:
+    normalized = []
+    for item in items:
+        fen = item.get("fen")
+        if not fen:
+            continue
+        try:
+            fen = canonical_fen(fen)
+            cp = float(item.get("cp", 0.0))
+            policy_version = int(item.get("policy_version", 1))
+        except (TypeError, ValueError):
+            continue
+        policy = normalize_sparse_policy(item.get("policy"), fen, policy_version)
+        label = {
+            "fen": fen,
+            "cp": cp,
+            "policy_version": POLICY_VERSION if policy else policy_version,
+            "policy": policy,
+        }
+        # Search limits let the labeler decide whether a cached label is deep enough.
+        for key in ("depth", "multipv"):
+            try:
+                if item.get(key) is not None:
+                    label[key] = int(item[key])
+            except (TypeError, ValueError):
+                pass
+        normalized.append(label)
+    return normalized
+
+
+def normalize_labels(items: list[dict], workers: int | None = None) -> list[dict]:
+    return map_chunks(_normalize_label_chunk, items, workers=workers)
+
+
+def cp_to_value(cp: float) -> float:
+    return float(np.tanh(np.clip(cp, -2000.0, 2000.0) / 600.0))
+
+
+def dense_policy_from_sparse(policy_items, fen: str | None = None, policy_version: int = 1) -> np.ndarray:
+    policy = np.zeros((POLICY_SIZE,), dtype=np.float32)
+    board = chess.Board(fen) if fen else None
+    for item in policy_items or []:
+        if not isinstance(item, (list, tuple)) or len(item) != 2:
+            continue
+        raw_index, probability = item
+        try:
+            index = normalize_policy_index(int(raw_index), board, int(policy_version))
+            probability = float(probability)
+        except (TypeError, ValueError):
+            continue
+        if probability > 0:
+            policy[index] += probability
+    total = float(np.sum(policy))
+    if total > 0:
+        policy /= total
+    return policy
+
+
+def encode_sample(
+    sample: dict,
+    stockfish_policy_weight: float = 1.0,
+    stockfish_value_weight: float = 1.0,
+    require_stockfish_policy: bool = True,
+):
+    """Return (features, policy, value, policy_weight, value_weight) or None for unusable samples."""
+    fen = sample.get("fen")
+    if not fen:
+        return None
+
+    source = sample.get("source")
+    if source == "self_play":
+        policy = dense_policy_from_sparse(
+            sample.get("policy"),
+            fen=fen,
+            policy_version=int(sample.get("policy_version", 1)),
+        )
+        if float(np.sum(policy)) <= 0:
+            return None
+        try:
+            outcome = float(sample.get("z"))
+        except (TypeError, ValueError):
+            return None
+        value_weight = 1.0 if outcome != 0.0 or sample.get("termination") else 0.0
+        return board_to_features(fen), policy, float(np.clip(outcome, -1.0, 1.0)), 1.0, value_weight
+
+    if source == "stockfish":
+        try:
+            cp = float(sample.get("cp", 0.0))
+        except (TypeError, ValueError):
+            return None
+        policy = dense_policy_from_sparse(
+            sample.get("policy"),
+            fen=fen,
+            policy_version=int(sample.get("policy_version", POLICY_VERSION)),
+        )
+        has_policy = float(np.sum(policy)) > 0
+        if require_stockfish_policy and not has_policy:
+            return None
+        policy_weight = stockfish_policy_weight if has_policy else 0.0
+        return board_to_features(fen), policy, cp_to_value(cp), policy_weight, stockfish_value_weight
+
+    return None
+
+
+def _process_context():
+    # Workers inherit the already-imported modules instead of re-running the
+    # entry point, which would import TensorFlow again in every process.
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def _chunks(items: list, chunk_size: int | None) -> list[tuple[int, list]]:
+    size = max(1, DATA_CHUNK_SIZE if chunk_size is None else int(chunk_size))
+    return [(start, items[start:start + size]) for start in range(0, len(items), size)]
+
+
+def _worker_count(workers: int | None, chunk_count: int) -> int:
+    workers = DATA_WORKERS if workers is None else int(workers)
+    return max(1, min(workers, chunk_count))
+
+
+def iter_chunks(function, items: list, workers: int | None = None, chunk_size: int | None = None):
+    """Apply a list-to-list function over chunks of items, yielding results in input order as chunks finish."""
+    items = list(items)
+    chunks = [chunk for _, chunk in _chunks(items, chunk_size)]
+    workers = _worker_count(workers, len(chunks))
+    context = _process_context()
+    if workers <= 1 or context is None:
+        for chunk in chunks:
+            yield from function(chunk)
+        return
+    with context.Pool(workers) as pool:
+        for chunk_results in pool.imap(function, chunks):
+            yield from chunk_results
+
+
+def map_chunks(function, items: list, workers: int | None = None, chunk_size: int | None = None) -> list:
+    """Apply a list-to-list function over chunks of items, concatenating results in input order."""
+    return list(iter_chunks(function, items, workers=workers, chunk_size=chunk_size))
+
+
+def _attach_array(name: str, shape: tuple[int, int]):
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=np.float32, buffer=memory.buf)
+
+
+def _encode_chunk(task):
+    encoder, start, items, x_name, p_name, row_count = task
+    x_memory, X = _attach_array(x_name, (row_count, FLAT_SIZE))
+    p_memory, P = _attach_array(p_name, (row_count, POLICY_SIZE))
+    try:
+        return _encode_rows(encoder, start, items, X, P)
+    finally:
+        del X, P
+        x_memory.close()
+        p_memory.close()
+
+
+def _encode_rows(encoder, start: int, items: list, X: np.ndarray, P: np.ndarray) -> np.ndarray:
+    scalars = np.zeros((len(items), 4), dtype=np.float32)
+    for offset, item in enumerate(items):
+        encoded = encoder(item)
+        if encoded is None:
+            continue
+        features, policy, value, policy_weight, value_weight = encoded
+        X[start + offset] = features
+        P[start + offset] = policy
+        scalars[offset] = (1.0, value, policy_weight, value_weight)
+    return scalars
+
+
+def _select_rows(scalars: list[np.ndarray], shuffle) -> tuple[np.ndarray, np.ndarray]:
+    scalars = np.concatenate(scalars) if scalars else np.zeros((0, 4), dtype=np.float32)
+    rows = np.flatnonzero(scalars[:, 0] > 0)
+    if shuffle is not None:
+        order = list(range(len(rows)))
+        shuffle(order)
+        rows = rows[np.asarray(order, dtype=np.int64)]
+    return scalars, rows
+
+
+def encode_samples(
+    items: list,
+    encoder=encode_sample,
+    shuffle=None,
+    workers: int | None = None,
+    chunk_size: int | None = None,
+):
+    """
+    Encode items into (X, policy, value, policy_weight, value_weight, rows).
+
+    `rows` holds the input index of every returned sample. When `shuffle` is
+    given it is applied to the order of usable samples, so passing
+    `random.shuffle` consumes the global RNG exactly like shuffling the
+    encoded samples themselves.
+    """
+    items = list(items)
+    chunks = _chunks(items, chunk_size)
+    workers = _worker_count(workers, len(chunks))
+    context = _process_context()
+    row_count = len(items)
+
+    if workers <= 1 or context is None:
+        X = np.zeros((row_count, FLAT_SIZE), dtype=np.float32)
+        P = np.zeros((row_count, POLICY_SIZE), dtype=np.float32)
+        scalars, rows = _select_rows([_encode_rows(encoder, start, chunk, X, P) for start, chunk in chunks], shuffle)
+        X, P = X[rows], P[rows]
+    else:
+        x_memory = shared_memory.SharedMemory(create=True, size=row_count * FLAT_SIZE * 4)
+        p_memory = shared_memory.SharedMemory(create=True, size=row_count * POLICY_SIZE * 4)
+        shared_X = shared_P = None
+        try:
+            shared_X = np.ndarray((row_count, FLAT_SIZE), dtype=np.float32, buffer=x_memory.buf)
+            shared_P = np.ndarray((row_count, POLICY_SIZE), dtype=np.float32, buffer=p_memory.buf)
+            tasks = [
+                (encoder, start, chunk, x_memory.name, p_memory.name, row_count)
+                for start, chunk in chunks
+            ]
+            with context.Pool(workers) as pool:
+                scalars, rows = _select_rows(list(pool.imap(_encode_chunk, tasks)), shuffle)
+            X, P = shared_X[rows], shared_P[rows]
+        finally:
+            # Views must be released before the mappings can be closed.
+            shared_X = shared_P = None
+            x_memory.close()
+            p_memory.close()
+            x_memory.unlink()
+            p_memory.unlink()
+
+    return X, P, scalars[rows, 1], scalars[rows, 2], scalars[rows, 3], rows
@@ -0,0 +1,322 @@
+# ml/distributed_self_play.py
+"""
+Self-play spread over any number of worker processes or machines that share a
+work directory.
+
+    python ml/distributed_self_play.py plan --games 256   # coordinator
+    python ml/distributed_self_play.py work               # on each worker machine
+    python ml/distributed_self_play.py merge              # coordinator, afterwards
+
+`plan` writes one work item per game (its own seed, game index, start FEN,
+model digest) and copies the checkpoint next to them. A worker claims items
+by creating lease files with O_EXCL and touches them while it plays. A lease
+not touched for AZ_SELF_PLAY_LEASE_SECONDS counts as expired and may be
+reclaimed by another worker. `work --processes N` (default
+AZ_SELF_PLAY_WORKERS, as recommended by self_play_tuner.py) starts N worker
+processes on this machine. Every game samples moves and root noise from its
+own seeded generator, so it plays the same whichever games share its batch.
+Each finished game is written as its own result shard. `merge` appends the
+shards to the self-play buffer in game-index order, so the buffer does not
+depend on which worker played what.
+"""
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import chess
+import numpy as np
+
+import telemetry
+import self_play
+
+WORK_DIR = pathlib.Path(os.environ.get("AZ_SELF_PLAY_WORK_DIR", "ml/data/self_play_work"))
+LEASE_SECONDS = float(os.environ.get("AZ_SELF_PLAY_LEASE_SECONDS", "300"))
+POLL_SECONDS = float(os.environ.get("AZ_SELF_PLAY_POLL_SECONDS", "5"))
+WORKER_PROCESSES = int(os.environ.get("AZ_SELF_PLAY_WORKERS", "1"))
+UNIFORM_MODEL = self_play.UNIFORM_MODEL
+model_digest = self_play.model_digest
+
+
+def item_name(game_index: int) -> str:
+    return f"game-{game_index:06d}.json"
+
+
+def _write_atomic(path: pathlib.Path, data) -> None:
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temporary.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+    os.replace(temporary, path)
+
+
+def read_plan(work_dir: pathlib.Path) -> dict:
+    return json.loads((work_dir / "plan.json").read_text(encoding="utf-8"))
+
+
+def plan_games(
+    work_dir: pathlib.Path,
+    games: int,
+    seed: int = self_play.SEED,
+    searches: int | None = None,
+    max_plies: int | None = None,
+    start_fens: list[str] | None = None,
+    model_path: pathlib.Path = self_play.CHECKPOINT_MODEL,
+    force: bool = False,
+) -> dict:
+    """Write `games` work items into a fresh work directory."""
+    unmerged = any((work_dir / "results").glob("game-*.json")) and not (work_dir / "merged.json").exists()
+    if unmerged and not force:
+        raise SystemExit(f"[self-play] {work_dir} holds unmerged results; merge them or pass --force")
+    for name in ("items", "leases", "results"):
+        shutil.rmtree(work_dir / name, ignore_errors=True)
+        (work_dir / name).mkdir(parents=True)
+    (work_dir / "merged.json").unlink(missing_ok=True)
+
+    digest = model_digest(model_path)
+    if digest != UNIFORM_MODEL:
+        shutil.copyfile(model_path, work_dir / "model.keras")
+    else:
+        (work_dir / "model.keras").unlink(missing_ok=True)
+    plan = {
+        "games": games,
+        "seed": seed,
+        "searches": self_play.MCTS_SEARCHES if searches is None else searches,
+        "max_plies": self_play.MAX_PLIES if max_plies is None else max_plies,
+        "model_digest": digest,
+        "created_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    for game_index in range(games):
+        board = self_play.board_for_self_play_game(game_index, start_fens or [])
+        _write_atomic(work_dir / "items" / item_name(game_index), {
+            "game_index": game_index,
+            "seed": (seed * 1_000_003 + game_index) % (2**32 - 1),
+            "start_fen": None if board.fen() == chess.STARTING_FEN else board.fen(),
+            "model_digest": digest,
+        })
+    _write_atomic(work_dir / "plan.json", plan)
+    print(f"[self-play] planned {games} games in {work_dir} (model {digest[:12]})")
+    return plan
+
+
+def pending(work_dir: pathlib.Path) -> list[int]:
+    done = {path.name for path in (work_dir / "results").glob("game-*.json")}
+    return sorted(
+        int(path.stem.split("-")[1])
+        for path in (work_dir / "items").glob("game-*.json")
+        if path.name not in done
+    )
+
+
+def take_lease(path: pathlib.Path, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+    """Create the lease, or replace it if its holder stopped heartbeating."""
+    try:
+        descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if age < lease_seconds:
+            return False
+        # Only one reclaimer can rename the expired lease away.
+        stale = path.with_name(f"{path.name}.{worker_id}.stale")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False
+        stale.unlink(missing_ok=True)
+        print(f"[self-play] reclaimed {path.name} after {age:.0f}s without a heartbeat")
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+    with os.fdopen(descriptor, "w", encoding="utf-8") as handle:
+        handle.write(worker_id)
+    return True
+
+
+def release_lease(path: pathlib.Path, worker_id: str) -> None:
+    try:
+        if path.read_text(encoding="utf-8") == worker_id:
+            path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def claim(work_dir: pathlib.Path, limit: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> list[int]:
+    claimed = []
+    for game_index in pending(work_dir):
+        if len(claimed) >= limit:
+            break
+        lease = work_dir / "leases" / f"{item_name(game_index)}.lease"
+        if not take_lease(lease, worker_id, lease_seconds):
+            continue
+        if (work_dir / "results" / item_name(game_index)).exists():
+            # Finished by another worker since pending() looked.
+            release_lease(lease, worker_id)
+            continue
+        claimed.append(game_index)
+    return claimed
+
+
+@contextlib.contextmanager
+def heartbeat(paths: list[pathlib.Path], interval: float):
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(interval):
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(path)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def load_plan_model(work_dir: pathlib.Path, plan: dict):
+    if plan["model_digest"] == UNIFORM_MODEL:
+        return None
+    path = work_dir / "model.keras"
+    if model_digest(path) != plan["model_digest"]:
+        raise SystemExit(f"[self-play] {path} does not match the planned model digest")
+    model = self_play.load_model_or_none(path)
+    if model is None:
+        raise SystemExit(f"[self-play] could not load the planned model from {path}")
+    return model
+
+
+def work(
+    work_dir: pathlib.Path,
+    batch_size: int = self_play.SELF_PLAY_BATCH_SIZE,
+    lease_seconds: float = LEASE_SECONDS,
+    poll_seconds: float = POLL_SECONDS,
+    worker_id: str | None = None,
+) -> int:
+    """Claim and play games until every planned game has a result; returns the number played here."""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    plan = read_plan(work_dir)
+    self_play.MCTS_SEARCHES = int(plan["searches"])
+    self_play.MAX_PLIES = int(plan["max_plies"])
+    model = load_plan_model(work_dir, plan)
+
+    played = 0
+    while True:
+        indices = claim(work_dir, max(1, batch_size), worker_id, lease_seconds)
+        if not indices:
+            if not pending(work_dir):
+                break
+            time.sleep(poll_seconds)
+            continue
+        items = [
+            json.loads((work_dir / "items" / item_name(index)).read_text(encoding="utf-8"))
+            for index in indices
+        ]
+        if any(item["model_digest"] != plan["model_digest"] for item in items):
+            raise SystemExit("[self-play] work item was planned for a different model")
+        leases = [work_dir / "leases" / f"{item_name(index)}.lease" for index in indices]
+        # Each game draws only from its own seed, so it replays identically in any batch.
+        games = [
+            {
+                "board": chess.Board(item["start_fen"]) if item["start_fen"] else chess.Board(),
+                "samples": [],
+                "game_index": item["game_index"],
+                "rng": np.random.RandomState(item["seed"]),
+            }
+            for item in items
+        ]
+        with heartbeat(leases, max(0.1, lease_seconds / 3)):
+            results = self_play.play_out(model, games)
+        for index, samples, lease in zip(indices, results, leases):
+            _write_atomic(work_dir / "results" / item_name(index), {
+                "game_index": index,
+                "worker": worker_id,
+                "model_digest": plan["model_digest"],
+                "samples": samples,
+            })
+            release_lease(lease, worker_id)
+        played += len(indices)
+        telemetry.add_items(sum(len(samples) for samples in results))
+    print(f"[self-play] worker {worker_id} played {played} games")
+    return played
+
+
+def work_processes(work_dir: pathlib.Path, processes: int, batch_size: int = self_play.SELF_PLAY_BATCH_SIZE) -> None:
+    """Run `processes` single-process workers side by side on this machine."""
+    command = [
+        sys.executable, str(pathlib.Path(__file__).resolve()), "--work-dir", str(work_dir),
+        "work", "--batch-size", str(batch_size), "--processes", "1",
+    ]
+    workers = [subprocess.Popen(command) for _ in range(processes)]
+    failed = [worker.args for worker in workers if worker.wait() != 0]
+    if failed:
+        raise SystemExit(f"[self-play] {len(failed)} of {processes} worker processes failed")
+
+
+def merge(
+    work_dir: pathlib.Path,
+    buffer_path: pathlib.Path = self_play.SELF_PLAY_BUFFER,
+    max_buffer: int = self_play.MAX_BUFFER,
+) -> int:
+    """Append finished games to the buffer in game-index order; returns the number of new samples."""
+    marker = work_dir / "merged.json"
+    if marker.exists():
+        print(f"[self-play] {work_dir} was already merged")
+        return 0
+    plan = read_plan(work_dir)
+    new_samples = []
+    games = 0
+    for path in sorted((work_dir / "results").glob("game-*.json")):
+        result = json.loads(path.read_text(encoding="utf-8"))
+        new_samples.extend(result["samples"])
+        games += 1
+    missing = pending(work_dir)
+    if missing:
+        print(f"[self-play] {len(missing)} of {plan['games']} planned games have no result and are skipped")
+
+    merged = self_play.read_json_list(buffer_path) + new_samples
+    if len(merged) > max_buffer:
+        merged = merged[-max_buffer:]
+    self_play.write_json(buffer_path, merged)
+    _write_atomic(marker, {"games": games, "samples": len(new_samples), "missing": missing})
+    telemetry.add_items(len(new_samples))
+    print(f"[self-play] merged {len(new_samples)} samples from {games} games, buffer now {len(merged)}")
+    return len(new_samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed self-play over a shared work directory")
+    parser.add_argument("--work-dir", type=pathlib.Path, default=WORK_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan_parser = commands.add_parser("plan", help="write work items for a generation run")
+    plan_parser.add_argument("--games", type=int, default=self_play.SELF_PLAY_GAMES)
+    plan_parser.add_argument("--force", action="store_true", help="discard unmerged results")
+    work_parser = commands.add_parser("work", help="claim and play games until none are left")
+    work_parser.add_argument("--batch-size", type=int, default=self_play.SELF_PLAY_BATCH_SIZE)
+    work_parser.add_argument("--processes", type=int, default=WORKER_PROCESSES, help="worker processes on this machine")
+    commands.add_parser("merge", help="append finished games to the self-play buffer")
+    args = parser.parse_args()
+
+    with telemetry.span(f"self_play_{args.command}"):
+        if args.command == "plan":
+            plan_games(args.work_dir, args.games, start_fens=self_play.load_balanced_start_fens(), force=args.force)
+        elif args.command == "work" and args.processes > 1:
+            work_processes(args.work_dir, args.processes, args.batch_size)
+        elif args.command == "work":
+            work(args.work_dir, args.batch_size)
+        else:
+            merge(args.work_dir)
+
+
+if __name__ == "__main__":
+    main()
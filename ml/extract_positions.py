@@ -1,14 +1,23 @@
 # ml/extract_positions.py
-"""sample new non-trivial positions from PGN data"""
-import json
+"""sample new non-trivial positions from PGN data or compressed PGN archives"""
+import bz2
+import functools
+import gzip
+import io
+import lzma
 import os
 import pathlib
 import random
+import re
 
 import chess
 import chess.pgn
 
-from fen_utils import canonical_fen
+import telemetry
+from dataset import iter_chunks
+from fen_utils import board_canonical_fen
+from label_store import open_store
+from position_hash import BloomFilter, HashIndex, fen_hash
 
 IN_PGN = pathlib.Path("ml/data/games.pgn")
 OUT_FEN = pathlib.Path("ml/data/positions.fen")
@@ -18,72 +27,293 @@ TARGET_NEW = int(os.environ.get("POSITION_TARGET_NEW", "4000"))
 MIN_NEW = int(os.environ.get("POSITION_MIN_NEW", "1000"))
 MAX_GAMES = int(os.environ.get("POSITION_MAX_GAMES", "4000"))
 PER_GAME = int(os.environ.get("POSITION_PER_GAME", "32"))
+WORKERS = int(os.environ.get("POSITION_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_GAMES = int(os.environ.get("POSITION_CHUNK_GAMES", "64"))
+# Comma-separated .pgn/.pgn.gz/.pgn.bz2/.pgn.xz archives mined instead of games.pgn.
+ARCHIVES = [path.strip() for path in os.environ.get("POSITION_ARCHIVES", "").split(",") if path.strip()]
+MIN_RATING = int(os.environ.get("POSITION_MIN_RATING", "0"))
+MAX_RATING = int(os.environ.get("POSITION_MAX_RATING", "0"))
+TIME_CONTROLS = {value.strip() for value in os.environ.get("POSITION_TIME_CONTROLS", "").split(",") if value.strip()}
+TERMINATIONS = {value.strip() for value in os.environ.get("POSITION_TERMINATIONS", "").split(",") if value.strip()}
+RESERVOIR_SIZE = int(os.environ.get("POSITION_RESERVOIR", str(TARGET_NEW * 4)))
+# A Bloom filter shrinks the seen index further; a false positive only drops one fresh position.
+SEEN_BLOOM = os.environ.get("POSITION_SEEN_BLOOM", "0") == "1"
+SEEN_BLOOM_ERROR = float(os.environ.get("POSITION_SEEN_BLOOM_ERROR", "0.001"))
+_TAG_LINE = re.compile(rb'^(?:\xef\xbb\xbf)?\[[A-Za-z0-9_]+\s+"')
 random.seed(SEED)
 
 
-def sample_positions(pgn_path, max_games=MAX_GAMES, per_game=PER_GAME, min_ply=12, max_ply=100):
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """Keep only the starting board and mainline moves; variations are skipped unparsed."""
+
+    def begin_game(self):
+        self.board = None
+        self.moves = []
+        self.error = None
+
+    def visit_board(self, board):
+        if self.board is None:
+            self.board = board.copy(stack=False)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def handle_error(self, error):
+        # Like GameBuilder, keep the moves before the first error.
+        if self.error is None:
+            self.error = error
+
+    def result(self):
+        return self
+
+
+class ArchiveGameVisitor(MainlineVisitor):
+    """Mainline visitor that skips the movetext of games rejected by accept_headers."""
+
+    def begin_headers(self):
+        self.headers = chess.pgn.Headers()
+        self.skipped = False
+        return self.headers
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def end_headers(self):
+        self.skipped = not accept_headers(self.headers)
+        return chess.pgn.SKIP if self.skipped else None
+
+
+def time_control_category(value: str) -> str:
+    """Lichess speed from a TimeControl header, using base + 40 * increment seconds."""
+    if value in ("-", ""):
+        return "correspondence"
+    try:
+        base, _, increment = value.partition("+")
+        seconds = int(base) + 40 * int(increment or 0)
+    except ValueError:
+        return "unknown"
+    if seconds < 30:
+        return "ultraBullet"
+    if seconds < 180:
+        return "bullet"
+    if seconds < 480:
+        return "blitz"
+    if seconds < 1500:
+        return "rapid"
+    return "classical"
+
+
+def accept_headers(headers) -> bool:
+    try:
+        if headers.variant() is not chess.Board:
+            return False
+    except ValueError:
+        return False
+    if MIN_RATING or MAX_RATING:
+        for key in ("WhiteElo", "BlackElo"):
+            try:
+                rating = int(headers.get(key, ""))
+            except ValueError:
+                return False
+            if rating < MIN_RATING or (MAX_RATING and rating > MAX_RATING):
+                return False
+    if TIME_CONTROLS:
+        time_control = headers.get("TimeControl", "")
+        if time_control not in TIME_CONTROLS and time_control_category(time_control) not in TIME_CONTROLS:
+            return False
+    return not TERMINATIONS or headers.get("Termination", "") in TERMINATIONS
+
+
+def open_pgn(path):
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def index_games(pgn_path) -> list[tuple[int, int]]:
+    """Return the (start, end) byte range of every game: a header block after movetext starts a new game."""
+    ranges = []
+    position = 0
+    in_headers = False
+    with open(pgn_path, "rb") as handle:
+        for line in handle:
+            is_tag = bool(_TAG_LINE.match(line))
+            if is_tag and not in_headers:
+                if ranges:
+                    ranges[-1] = (ranges[-1][0], position)
+                ranges.append((position, None))
+            if line.strip():
+                in_headers = is_tag
+            position += len(line)
+    if ranges:
+        ranges[-1] = (ranges[-1][0], position)
+    return ranges
+
+
+def game_rng(game_number: int) -> random.Random:
+    # String seeds hash with SHA-512, so every worker process derives the same stream.
+    return random.Random(f"{SEED}:{game_number}")
+
+
+def sample_game(game_number: int, game: MainlineVisitor, per_game: int, min_ply: int, max_ply: int) -> list[str]:
+    plies = [ply for ply in range(min(len(game.moves), max_ply)) if ply >= min_ply]
+    game_rng(game_number).shuffle(plies)
+    selected = set(plies[:per_game])
+    if not selected or game.board is None:
+        return []
+    board = game.board.copy(stack=False)
+    fens = []
+    for ply, move in enumerate(game.moves[:max(selected) + 1]):
+        board.push(move)
+        if ply in selected:
+            fens.append(board_canonical_fen(board))
+    return fens
+
+
+def _sample_game_chunk(pgn_path: str, per_game: int, min_ply: int, max_ply: int, games: list) -> list:
+    with open(pgn_path, "rb") as handle:
+        handle.seek(games[0][1])
+        text = handle.read(games[-1][2] - games[0][1]).decode("utf-8", errors="replace")
+    stream = io.StringIO(text)
+    results = []
+    for game_number, _, _ in games:
+        game = chess.pgn.read_game(stream, Visitor=MainlineVisitor)
+        if game is None:
+            break
+        try:
+            fens = sample_game(game_number, game, per_game, min_ply, max_ply)
+        except (AssertionError, ValueError) as exc:
+            results.append((game_number, [], str(exc)))
+            continue
+        results.append((game_number, fens, str(game.error) if game.error else None))
+    return results
+
+
+def sample_positions(pgn_path, max_games=MAX_GAMES, per_game=PER_GAME, min_ply=12, max_ply=100, workers=None):
+    """Yield sampled FENs game by game; chunks of games are parsed in worker processes."""
+    games = [(number, start, end) for number, (start, end) in enumerate(index_games(pgn_path)[:max_games], start=1)]
+    sampler = functools.partial(_sample_game_chunk, str(pgn_path), per_game, min_ply, max_ply)
     count = 0
     skipped = 0
-    with open(pgn_path, "r", encoding="utf-8") as handle:
-        while True:
-            game = chess.pgn.read_game(handle)
-            if game is None:
-                break
-            count += 1
-
-            nodes = list(game.mainline())
-            if not nodes:
-                continue
-
-            plies = [ply for ply in range(min(len(nodes), max_ply)) if ply >= min_ply]
-            random.shuffle(plies)
-            selected = set(plies[:per_game])
-            board = game.board()
-            for ply, node in enumerate(nodes):
-                try:
-                    if node.move is not None:
-                        board.push(node.move)
-                    if ply in selected:
-                        yield canonical_fen(board.fen(en_passant="fen"))
-                except (AssertionError, ValueError, chess.IllegalMoveError) as exc:
-                    skipped += 1
-                    print(f"[extract] skipped malformed position in game {count}, ply {ply}: {exc}")
-                    break
-
-            if count >= max_games:
-                break
+    for game_number, fens, error in iter_chunks(
+        sampler,
+        games,
+        workers=WORKERS if workers is None else workers,
+        chunk_size=CHUNK_GAMES,
+    ):
+        count += 1
+        if error:
+            skipped += 1
+            print(f"[extract] skipped malformed moves in game {game_number}: {error}")
+        yield from fens
 
     print(f"[extract] processed {count} games with seed {SEED}; skipped {skipped}")
 
 
-def read_seen_fens() -> set[str]:
-    if not REPLAY_JSON.exists():
-        return set()
-    try:
-        items = json.loads(REPLAY_JSON.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, OSError):
-        return set()
-
-    seen = set()
-    for item in items if isinstance(items, list) else []:
-        fen = item.get("fen")
-        if not fen:
+def sample_archive_positions(paths, per_game=PER_GAME, min_ply=12, max_ply=100):
+    """Stream games from archives, paying move parsing only for games whose headers pass the filters."""
+    scanned = 0
+    accepted = 0
+    for path in paths:
+        with open_pgn(path) as handle:
+            while True:
+                game = chess.pgn.read_game(handle, Visitor=ArchiveGameVisitor)
+                if game is None:
+                    break
+                scanned += 1
+                if game.skipped:
+                    continue
+                accepted += 1
+                if game.error:
+                    print(f"[extract] malformed moves in {path} game {scanned}: {game.error}")
+                yield from sample_game(scanned, game, per_game, min_ply, max_ply)
+        print(f"[extract] {path}: scanned {scanned} games so far, accepted {accepted}")
+
+
+def reservoir_sample(fens, size: int, excluded, rng: random.Random) -> tuple[list[str], int, int]:
+    """
+    Keep a uniform sample of at most `size` unseen FENs from a stream.
+
+    `excluded` holds position hashes. Duplicates are only detected while they
+    are in the reservoir, which keeps memory bounded by `size`. Returns
+    (sample, unseen candidates, already seen).
+    """
+    reservoir = []
+    reservoir_keys = []
+    members = set()
+    candidates = 0
+    already_seen = 0
+    for fen in fens:
+        key = fen_hash(fen)
+        if key in excluded:
+            already_seen += 1
             continue
-        try:
-            seen.add(canonical_fen(fen))
-        except ValueError:
+        if key in members:
             continue
+        candidates += 1
+        if len(reservoir) < size:
+            reservoir.append(fen)
+            reservoir_keys.append(key)
+            members.add(key)
+            continue
+        slot = rng.randrange(candidates)
+        if slot < size:
+            members.discard(reservoir_keys[slot])
+            reservoir[slot] = fen
+            reservoir_keys[slot] = key
+            members.add(key)
+    return reservoir, candidates, already_seen
+
+
+def read_seen_fens() -> HashIndex | BloomFilter:
+    """Hash index of the positions already in the replay buffer (8 bytes each, no FEN strings)."""
+    with open_store(REPLAY_JSON) as store:
+        hashes = store.hashes()
+    if not SEEN_BLOOM:
+        return HashIndex(hashes)
+    seen = BloomFilter(len(hashes), SEEN_BLOOM_ERROR)
+    seen.add(hashes)
     return seen
 
 
+def collect_unseen(seen) -> tuple[list[str], int, int]:
+    """Return (unseen positions, candidate count, already-seen count) from the archives or games.pgn."""
+    if ARCHIVES:
+        sample, unseen_count, seen_count = reservoir_sample(
+            sample_archive_positions(ARCHIVES),
+            max(1, RESERVOIR_SIZE),
+            seen,
+            random.Random(SEED),
+        )
+        return sample, unseen_count + seen_count, seen_count
+
+    candidates = set()
+    unseen = []
+    for fen in sample_positions(IN_PGN):
+        key = fen_hash(fen)
+        if key in candidates:
+            continue
+        candidates.add(key)
+        if key not in seen:
+            unseen.append(fen)
+    return unseen, len(candidates), len(candidates) - len(unseen)
+
+
+@telemetry.traced("extract_positions")
 def main():
     OUT_FEN.parent.mkdir(parents=True, exist_ok=True)
-    positions = list(dict.fromkeys(sample_positions(IN_PGN)))
-    if not positions:
+    unseen, candidate_count, seen_count = collect_unseen(read_seen_fens())
+    if not candidate_count:
         raise RuntimeError("no positions were extracted from the downloaded PGN")
 
-    seen = read_seen_fens()
-    unseen = [fen for fen in positions if fen not in seen]
     random.shuffle(unseen)
     selected = unseen[:TARGET_NEW]
     if len(selected) < MIN_NEW:
@@ -92,8 +322,9 @@ def main():
         )
 
     OUT_FEN.write_text("\n".join(selected) + "\n", encoding="utf-8")
+    telemetry.add_items(len(selected))
     print(
-        f"[extract] candidates {len(positions)}, already seen {len(positions) - len(unseen)}, "
+        f"[extract] candidates {candidate_count}, already seen {seen_count}, "
         f"wrote {len(selected)} new positions to {OUT_FEN}"
     )
 
@@ -1,7 +1,10 @@
 import chess
 
 
-def canonical_fen(fen: str) -> str:
-    board = chess.Board(fen)
+def board_canonical_fen(board: chess.Board) -> str:
     fields = board.fen(en_passant="fen").split()
     return " ".join((*fields[:4], "0", "1"))
+
+
+def canonical_fen(fen: str) -> str:
+    return board_canonical_fen(chess.Board(fen))
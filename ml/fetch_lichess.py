@@ -1,19 +1,32 @@
 # ml/fetch_lichess.py
-"""download diverse public Lichess games with retries and validation"""
+"""download diverse public Lichess games with retries, validation and per-user cursors"""
+import concurrent.futures
 import datetime as dt
+import json
 import os
 import pathlib
 import random
+import re
+import shutil
+import threading
 import time
 
 import requests
 
+import telemetry
+
 OUT_PGN = pathlib.Path("ml/data/games.pgn")
 OUT_PGN.parent.mkdir(parents=True, exist_ok=True)
+# Games stream into per-user files here before being joined into games.pgn;
+# cursors and the seen-game index persist so later runs only fetch new games.
+STAGING_DIR = pathlib.Path("ml/data/lichess")
+STATE_JSON = STAGING_DIR / "cursors.json"
+SEEN_IDS = STAGING_DIR / "seen_game_ids.txt"
 
 FALLBACK_USERS = "alireza2003,rebeccaharris,crew64"
 USER_OVERRIDE = [user.strip() for user in os.environ.get("LICHESS_USERS", "").split(",") if user.strip()]
-LEADERBOARD_URL = "https://lichess.org/api/player/top/50/blitz"
+API_URL = os.environ.get("LICHESS_API_URL", "https://lichess.org").rstrip("/")
+LEADERBOARD_URL = f"{API_URL}/api/player/top/50/blitz"
 FETCH_SEED = int(os.environ.get("LICHESS_FETCH_SEED", "42"))
 USER_COUNT = int(os.environ.get("LICHESS_USER_COUNT", "10"))
 MAX_GAMES = int(os.environ.get("LICHESS_MAX_GAMES", "300"))
@@ -21,10 +34,18 @@ HISTORY_WINDOWS = int(os.environ.get("LICHESS_HISTORY_WINDOWS", "52"))
 HISTORY_STRIDE_DAYS = int(os.environ.get("LICHESS_HISTORY_STRIDE_DAYS", "7"))
 RETRIES = int(os.environ.get("LICHESS_FETCH_RETRIES", "3"))
 TIMEOUT_SECONDS = float(os.environ.get("LICHESS_TIMEOUT_SECONDS", "30"))
+CONCURRENCY = int(os.environ.get("LICHESS_CONCURRENCY", "3"))
+MIN_INTERVAL_SECONDS = float(os.environ.get("LICHESS_MIN_INTERVAL_SECONDS", "1.0"))
+RATE_LIMIT_WAIT_SECONDS = float(os.environ.get("LICHESS_RATE_LIMIT_WAIT_SECONDS", "60"))
 HEADERS = {
     "Accept": "application/x-chess-pgn",
     "User-Agent": "SuperRitchie-chess-training/1.0",
 }
+_TAG_LINE = re.compile(r'^\[[A-Za-z0-9_]+\s+"')
+_SITE_ID = re.compile(r'^\[Site "[^"]*/([A-Za-z0-9]{8})[^"/]*"\]', re.MULTILINE)
+_GAME_ID = re.compile(r'^\[GameId "([^"]+)"\]', re.MULTILINE)
+_UTC_DATE = re.compile(r'^\[UTCDate "(\d{4})\.(\d{2})\.(\d{2})"\]', re.MULTILINE)
+_UTC_TIME = re.compile(r'^\[UTCTime "(\d{2}):(\d{2}):(\d{2})"\]', re.MULTILINE)
 
 
 def history_cutoff_ms() -> int:
@@ -33,6 +54,100 @@ def history_cutoff_ms() -> int:
     return int(cutoff.timestamp() * 1000)
 
 
+class RateLimiter:
+    """Space request starts across threads and hold everyone back after a 429."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval = max(0.0, interval_seconds)
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.next_start = max(self.next_start, time.monotonic() + seconds)
+
+
+class FetchState:
+    """Per-user cursors plus the index of game IDs already written, shared by the download threads."""
+
+    def __init__(self, state_path: pathlib.Path = None, seen_path: pathlib.Path = None):
+        self.state_path = STATE_JSON if state_path is None else state_path
+        self.seen_path = SEEN_IDS if seen_path is None else seen_path
+        self.lock = threading.Lock()
+        try:
+            self.cursors = json.loads(self.state_path.read_text(encoding="utf-8")).get("users", {})
+        except (OSError, json.JSONDecodeError, AttributeError):
+            self.cursors = {}
+        try:
+            self.seen = set(self.seen_path.read_text(encoding="utf-8").split())
+        except OSError:
+            self.seen = set()
+        self.seen_path.parent.mkdir(parents=True, exist_ok=True)
+        self.seen_handle = self.seen_path.open("a", encoding="utf-8")
+
+    def close(self) -> None:
+        self.seen_handle.close()
+
+    def cursor(self, username: str) -> dict:
+        with self.lock:
+            return dict(self.cursors.get(username.lower(), {}))
+
+    def claim(self, game_id: str) -> bool:
+        """Record a game ID; False when another user's download already wrote it."""
+        with self.lock:
+            if game_id in self.seen:
+                return False
+            self.seen.add(game_id)
+            self.seen_handle.write(game_id + "\n")
+            self.seen_handle.flush()
+            return True
+
+    def save_cursor(self, username: str, cursor: dict) -> None:
+        with self.lock:
+            self.cursors[username.lower()] = cursor
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.state_path.with_name(f".{self.state_path.name}.tmp")
+            temporary.write_text(json.dumps({"users": self.cursors}, indent=2, sort_keys=True), encoding="utf-8")
+            os.replace(temporary, self.state_path)
+
+
+def iter_pgn_games(lines):
+    """Split streamed PGN lines into game texts; a tag line after movetext starts a new game."""
+    game = []
+    in_movetext = False
+    for line in lines:
+        if _TAG_LINE.match(line) and in_movetext:
+            yield "\n".join(game).strip() + "\n"
+            game = []
+            in_movetext = False
+        if line.strip() and not line.startswith("["):
+            in_movetext = True
+        game.append(line)
+    if any(line.strip() for line in game):
+        yield "\n".join(game).strip() + "\n"
+
+
+def game_id(text: str) -> str | None:
+    match = _GAME_ID.search(text) or _SITE_ID.search(text)
+    return match.group(1) if match else None
+
+
+def game_timestamp_ms(text: str) -> int | None:
+    date = _UTC_DATE.search(text)
+    clock = _UTC_TIME.search(text)
+    if not date or not clock:
+        return None
+    started = dt.datetime(*map(int, date.groups()), *map(int, clock.groups()), tzinfo=dt.UTC)
+    return int(started.timestamp() * 1000)
+
+
 def discover_users(session: requests.Session) -> list[str]:
     if USER_OVERRIDE:
         return USER_OVERRIDE
@@ -60,61 +175,165 @@ def discover_users(session: requests.Session) -> list[str]:
     return fallback
 
 
-def fetch_user(session: requests.Session, username: str, until_ms: int) -> str:
-    url = f"https://lichess.org/api/games/user/{username}"
-    params = {
-        "max": MAX_GAMES,
-        "until": until_ms,
-        "perfType": "blitz,rapid",
-        "analysed": "false",
-        "clocks": "false",
-        "evals": "false",
-        "opening": "false",
-    }
+def stream_games(
+    session: requests.Session,
+    limiter: RateLimiter,
+    state: FetchState,
+    username: str,
+    params: dict,
+    out_handle,
+) -> tuple[int, list[int]]:
+    """
+    Download one game listing, writing unseen games to `out_handle` as they arrive.
+
+    Returns (games listed, start timestamps of every listed game). Partial
+    downloads are retried; games already written are skipped by ID.
+    """
+    url = f"{API_URL}/api/games/user/{username}"
     last_error = None
     for attempt in range(1, RETRIES + 1):
+        limiter.wait()
         try:
-            response = session.get(url, params=params, headers=HEADERS, timeout=TIMEOUT_SECONDS)
-            if response.status_code == 429 and attempt < RETRIES:
-                retry_after = max(60, int(response.headers.get("Retry-After", "60")))
-                print(f"[lichess] {username} rate limited, waiting {retry_after}s")
-                time.sleep(retry_after)
-                continue
-            response.raise_for_status()
-            text = response.text.strip()
-            if not text:
-                raise RuntimeError("empty PGN response")
-            return text
-        except (requests.RequestException, RuntimeError) as exc:
+            with session.get(url, params=params, headers=HEADERS, timeout=TIMEOUT_SECONDS, stream=True) as response:
+                if response.status_code == 429 and attempt < RETRIES:
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", RATE_LIMIT_WAIT_SECONDS))
+                    except ValueError:
+                        retry_after = RATE_LIMIT_WAIT_SECONDS
+                    retry_after = max(RATE_LIMIT_WAIT_SECONDS, retry_after)
+                    print(f"[lichess] {username} rate limited, pausing all downloads for {retry_after:.0f}s")
+                    limiter.pause(retry_after)
+                    continue
+                response.raise_for_status()
+                response.encoding = response.encoding or "utf-8"
+                listed = 0
+                timestamps = []
+                for text in iter_pgn_games(response.iter_lines(decode_unicode=True)):
+                    listed += 1
+                    timestamp = game_timestamp_ms(text)
+                    if timestamp is not None:
+                        timestamps.append(timestamp)
+                    identifier = game_id(text)
+                    if identifier is None or state.claim(identifier):
+                        out_handle.write(text + "\n")
+                out_handle.flush()
+                return listed, timestamps
+        except requests.RequestException as exc:
             last_error = exc
             print(f"[lichess] {username} attempt {attempt}/{RETRIES} failed: {exc}")
             if attempt < RETRIES:
                 time.sleep(min(2 ** (attempt - 1), 4))
-    raise RuntimeError(f"failed to fetch {username}: {last_error}")
+    raise RuntimeError(f"failed to fetch {username}: {last_error or 'rate limited'}")
 
 
+def fetch_user(limiter: RateLimiter, state: FetchState, username: str, cutoff_ms: int) -> pathlib.Path:
+    """
+    Fetch up to MAX_GAMES games a user played at or before the cutoff, skipping ranges fetched before.
+
+    The cursor is the [oldest, newest] start-time range already covered. A
+    cutoff inside it continues further back; a newer cutoff first fetches the
+    games since `newest`.
+    """
+    base = {
+        "perfType": "blitz,rapid",
+        "analysed": "false",
+        "clocks": "false",
+        "evals": "false",
+        "opening": "false",
+    }
+    cursor = state.cursor(username)
+    out_path = STAGING_DIR / f"{username}.pgn"
+    with requests.Session() as session, out_path.open("a", encoding="utf-8") as out_handle:
+        if not cursor or cutoff_ms < cursor["oldest"]:
+            listed, timestamps = stream_games(
+                session, limiter, state, username, {**base, "max": MAX_GAMES, "until": cutoff_ms}, out_handle
+            )
+            if timestamps:
+                cursor = {"oldest": min(timestamps), "newest": max(timestamps)}
+        else:
+            budget = MAX_GAMES
+            if cutoff_ms > cursor["newest"]:
+                params = {**base, "max": budget, "since": cursor["newest"], "until": cutoff_ms}
+                listed, timestamps = stream_games(session, limiter, state, username, params, out_handle)
+                budget -= listed
+                if listed >= MAX_GAMES and timestamps:
+                    # A full page may leave a gap before the old range, so start a new one.
+                    cursor = {"oldest": min(timestamps), "newest": max(timestamps)}
+                elif timestamps:
+                    cursor["newest"] = max(cursor["newest"], max(timestamps))
+            if budget > 0 and not cursor.get("complete"):
+                params = {**base, "max": budget, "until": cursor["oldest"] - 1}
+                listed, timestamps = stream_games(session, limiter, state, username, params, out_handle)
+                if timestamps:
+                    cursor["oldest"] = min(cursor["oldest"], min(timestamps))
+                if listed < budget:
+                    cursor["complete"] = True
+        if cursor:
+            state.save_cursor(username, cursor)
+    return out_path
+
+
+def join_staged_games(users: list[str]) -> int:
+    """Concatenate staged per-user files (leftovers of interrupted runs included) into games.pgn."""
+    by_name = {path.stem: path for path in STAGING_DIR.glob("*.pgn")}
+    ordered = [by_name.pop(user) for user in users if user in by_name] + [by_name[name] for name in sorted(by_name)]
+    game_count = 0
+    for path in ordered:
+        with path.open(encoding="utf-8") as handle:
+            game_count += sum(line.startswith("[Event ") for line in handle)
+    if not game_count:
+        return 0
+
+    temporary = OUT_PGN.with_name(f".{OUT_PGN.name}.tmp")
+    with temporary.open("w", encoding="utf-8") as out_handle:
+        for path in ordered:
+            with path.open(encoding="utf-8") as handle:
+                shutil.copyfileobj(handle, out_handle)
+            out_handle.write("\n")
+    os.replace(temporary, OUT_PGN)
+    for path in ordered:
+        path.unlink()
+    return game_count
+
+
+@telemetry.traced("lichess_fetch")
 def main():
-    downloaded = []
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
     with requests.Session() as session:
         users = discover_users(session)
-        if not users:
-            raise RuntimeError("Lichess player list resolved to empty")
-        until_ms = history_cutoff_ms()
-        print(f"[lichess] historical cutoff {until_ms} from seed {FETCH_SEED}")
-        for username in users:
-            print(f"[lichess] fetching {username}")
-            try:
-                downloaded.append(fetch_user(session, username, until_ms))
-            except RuntimeError as exc:
-                print(f"[lichess] warning: {exc}")
-            time.sleep(1.0)
-
-    if not downloaded:
+    if not users:
+        raise RuntimeError("Lichess player list resolved to empty")
+    cutoff_ms = history_cutoff_ms()
+    print(f"[lichess] historical cutoff {cutoff_ms} from seed {FETCH_SEED}")
+
+    limiter = RateLimiter(MIN_INTERVAL_SECONDS)
+    state = FetchState()
+    succeeded = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, CONCURRENCY)) as executor:
+            futures = {
+                executor.submit(fetch_user, limiter, state, username, cutoff_ms): username
+                for username in users
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                    succeeded += 1
+                    print(f"[lichess] fetched {futures[future]}")
+                except RuntimeError as exc:
+                    print(f"[lichess] warning: {exc}")
+    finally:
+        state.close()
+
+    if not succeeded:
         raise RuntimeError("all Lichess downloads failed; refusing to overwrite the dataset")
 
-    OUT_PGN.write_text("\n\n".join(downloaded) + "\n", encoding="utf-8")
-    game_count = sum(text.count("[Event ") for text in downloaded)
-    print(f"[lichess] wrote {game_count} games from {len(downloaded)}/{len(users)} players to {OUT_PGN}")
+    game_count = join_staged_games(users)
+    telemetry.add_items(game_count)
+    if not game_count:
+        print(f"[lichess] no unseen games from {succeeded}/{len(users)} players; keeping {OUT_PGN}")
+        return
+    print(f"[lichess] wrote {game_count} new games from {succeeded}/{len(users)} players to {OUT_PGN}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+# ml/gating.py
+"""
+Run the baseline- and candidate-side halves of the promotion gate side by side.
+
+With AZ_GATE_WORKERS=1 (the default) every job runs inline on the in-memory
+models, exactly as before. With more workers both models are saved to a
+scratch directory and each worker process loads its own copies. Searches in
+the gate are deterministic and workers keep TensorFlow's default thread
+counts, the same as the inline path, so the results and the gate decisions
+made from them do not depend on where a job ran. AZ_GATE_THREADS > 0 pins
+each worker to that many intra-op threads instead; a different thread count
+can change float reduction order, so only pin when the training process runs
+with the same count. Jobs are returned in submission order.
+
+Workers are spawned rather than forked: by gating time the parent has trained
+a model, and TensorFlow's thread pools do not survive a fork.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+GATE_WORKERS = int(os.environ.get("AZ_GATE_WORKERS", "1"))
+GATE_THREADS = int(os.environ.get("AZ_GATE_THREADS", "0"))
+
+_worker_models = {}
+
+
+def _init_worker(paths: dict, threads: int) -> None:
+    import tensorflow as tf
+
+    if threads > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    for side, path in paths.items():
+        _worker_models[side] = tf.keras.models.load_model(path, compile=False)
+
+
+def _run_job(function, args: tuple):
+    return function(_worker_models, *args)
+
+
+class GateExecutor:
+    """
+    Runs `function(models, *args)` jobs, where `models` maps a side name such
+    as "baseline" or "candidate" to its model (None when there is none).
+    The worker pool is only started by the first job that needs it.
+    """
+
+    def __init__(self, models: dict, workers: int = GATE_WORKERS, threads: int = GATE_THREADS):
+        self.models = models
+        self.workers = max(1, int(workers))
+        self.threads = max(0, int(threads))
+        self._pool = None
+        self._scratch = None
+
+    @property
+    def parallel(self) -> bool:
+        return self.workers > 1
+
+    def _start(self) -> None:
+        self._scratch = tempfile.mkdtemp(prefix="gate-models-")
+        paths = {}
+        for side, model in self.models.items():
+            if model is None:
+                continue
+            path = Path(self._scratch) / f"{side}.keras"
+            model.save(path)
+            paths[side] = str(path)
+        self._pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(paths, self.threads),
+        )
+        threads = f"{self.threads} TensorFlow threads" if self.threads else "default TensorFlow threads"
+        print(f"[gate] started {self.workers} workers with {threads} each")
+
+    def map(self, function, jobs: list[tuple]) -> list:
+        """Results of `function(models, *args)` for each args tuple, in order."""
+        if not self.parallel:
+            return [function(self.models, *args) for args in jobs]
+        if self._pool is None:
+            self._start()
+        futures = [self._pool.submit(_run_job, function, args) for args in jobs]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            # Queued jobs are dropped when a gate job failed.
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+            self._scratch = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,276 @@
+# ml/label_store.py
+"""
+SQLite index over the Stockfish replay buffer.
+
+replay_buffer.json stays the committed artifact. The first stage that opens the
+store after the JSON changes imports it once (normalizing every label); later
+stages answer membership, cache lookups, balanced-start queries and eviction
+from the indexed table and export the JSON again when the buffer changes.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import struct
+import time
+
+import chess
+import numpy as np
+
+import position_hash
+from dataset import normalize_labels
+
+SCHEMA_VERSION = 2
+MIN_START_PIECES = 10
+_POLICY_ENTRY = struct.Struct("<Hd")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    fen_hash INTEGER PRIMARY KEY,
+    fen TEXT NOT NULL,
+    cp REAL NOT NULL,
+    depth INTEGER,
+    multipv INTEGER,
+    policy_version INTEGER NOT NULL,
+    policy BLOB NOT NULL,
+    inserted_at REAL NOT NULL,
+    balanced_start INTEGER NOT NULL,
+    ord INTEGER
+);
+CREATE INDEX IF NOT EXISTS labels_balanced_start ON labels (balanced_start, cp);
+CREATE INDEX IF NOT EXISTS labels_ord ON labels (ord);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def fen_hash(fen: str) -> int:
+    """Signed 64-bit key of an already canonical FEN: its Zobrist hash in SQLite's INTEGER range."""
+    return position_hash.to_signed(position_hash.fen_hash(fen))
+
+
+def encode_policy(policy) -> bytes:
+    return b"".join(_POLICY_ENTRY.pack(int(index), float(probability)) for index, probability in policy or [])
+
+
+def decode_policy(blob: bytes) -> list[list]:
+    return [[index, probability] for index, probability in _POLICY_ENTRY.iter_unpack(blob)]
+
+
+def is_start_candidate(fen: str) -> bool:
+    """Playable middlegame start: game not over and enough material left. The cp bound is applied per query."""
+    board = chess.Board(fen)
+    return not board.is_game_over(claim_draw=True) and len(board.piece_map()) >= MIN_START_PIECES
+
+
+def _file_digest(path: pathlib.Path) -> str:
+    if not path.exists():
+        return ""
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _file_stamp(path: pathlib.Path) -> str:
+    """Size and modification time; a cheap check before hashing the whole file."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _row_label(row) -> dict:
+    fen, cp, depth, multipv, policy_version, policy = row
+    label = {"fen": fen, "cp": cp, "policy_version": policy_version, "policy": decode_policy(policy)}
+    if depth is not None:
+        label["depth"] = depth
+    if multipv is not None:
+        label["multipv"] = multipv
+    return label
+
+
+class LabelStore:
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.connection.executescript("DROP TABLE IF EXISTS labels; DROP TABLE IF EXISTS meta;")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _meta(self, key: str) -> str | None:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def sync_from_json(self, json_path: pathlib.Path) -> bool:
+        """Reimport the JSON export when it differs from the last import or export. Returns True on import."""
+        stamp = _file_stamp(json_path)
+        if stamp == self._meta("json_stamp"):
+            return False
+        digest = _file_digest(json_path)
+        if digest == self._meta("json_digest"):
+            # Touched (e.g. by a checkout) but unchanged.
+            with self.connection:
+                self._set_meta("json_stamp", stamp)
+            return False
+        try:
+            items = json.loads(json_path.read_text(encoding="utf-8")) if digest else []
+        except (json.JSONDecodeError, OSError):
+            items = []
+        with self.connection:
+            self.connection.execute("DELETE FROM labels")
+            self._write(normalize_labels(items if isinstance(items, list) else []))
+            self._set_meta("json_digest", digest)
+            self._set_meta("json_stamp", stamp)
+        return True
+
+    def _write(self, items: list[dict]) -> None:
+        now = time.time()
+        by_hash = {fen_hash(item["fen"]): item for item in items}
+        known = self._known_hashes(list(by_hash))
+        self.connection.execute("UPDATE labels SET ord = NULL")
+        self.connection.executemany(
+            """
+            INSERT INTO labels
+                (fen_hash, fen, cp, depth, multipv, policy_version, policy, inserted_at, balanced_start, ord)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (fen_hash) DO UPDATE SET
+                cp = excluded.cp,
+                depth = excluded.depth,
+                multipv = excluded.multipv,
+                policy_version = excluded.policy_version,
+                policy = excluded.policy,
+                ord = excluded.ord
+            """,
+            [
+                (
+                    key,
+                    item["fen"],
+                    float(item.get("cp", 0.0)),
+                    item.get("depth"),
+                    item.get("multipv"),
+                    int(item.get("policy_version", 1)),
+                    encode_policy(item.get("policy")),
+                    now,
+                    0 if key in known else int(is_start_candidate(item["fen"])),
+                    order,
+                )
+                for order, (key, item) in enumerate(by_hash.items())
+            ],
+        )
+        # Rows the new buffer no longer references are evicted.
+        self.connection.execute("DELETE FROM labels WHERE ord IS NULL")
+
+    def _known_hashes(self, keys: list[int]) -> set[int]:
+        known = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            known.update(
+                key for (key,) in self.connection.execute(
+                    f"SELECT fen_hash FROM labels WHERE fen_hash IN ({placeholders})", chunk
+                )
+            )
+        return known
+
+    def replace(self, items: list[dict], json_path: pathlib.Path | None = None) -> None:
+        """
+        Make `items` (normalized labels, in buffer order) the whole buffer.
+
+        Existing rows keep their insertion time and start flag; rows not in
+        `items` are deleted. With `json_path` the JSON export is rewritten too.
+        """
+        with self.connection:
+            self._write(items)
+            if json_path is not None:
+                self.export_json(json_path)
+
+    def export_json(self, json_path: pathlib.Path) -> None:
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = json_path.with_name(f".{json_path.name}.tmp")
+        data = json.dumps(self.labels(), separators=(",", ":")).encode("utf-8")
+        temporary.write_bytes(data)
+        os.replace(temporary, json_path)
+        self._set_meta("json_digest", hashlib.sha256(data).hexdigest())
+        self._set_meta("json_stamp", _file_stamp(json_path))
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def labels(self) -> list[dict]:
+        rows = self.connection.execute(
+            "SELECT fen, cp, depth, multipv, policy_version, policy FROM labels ORDER BY ord"
+        )
+        return [_row_label(row) for row in rows]
+
+    def fens(self) -> set[str]:
+        return {fen for (fen,) in self.connection.execute("SELECT fen FROM labels")}
+
+    def hashes(self) -> np.ndarray:
+        """Unsigned Zobrist hashes of every stored position, read without parsing a FEN."""
+        keys = np.fromiter(
+            (key for (key,) in self.connection.execute("SELECT fen_hash FROM labels")), dtype=np.int64
+        )
+        return keys.view(np.uint64)
+
+    def get_many(self, fens) -> dict[str, dict]:
+        """Return stored labels for the given canonical FENs."""
+        keys = {}
+        for fen in fens:
+            try:
+                keys[fen_hash(fen)] = fen
+            except ValueError:
+                continue
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                "SELECT fen, cp, depth, multipv, policy_version, policy FROM labels "
+                f"WHERE fen_hash IN ({placeholders})",
+                chunk,
+            )
+            for row in rows:
+                found[row[0]] = _row_label(row)
+        return {fen: found[fen] for fen in keys.values() if fen in found}
+
+    def shallow_labels(self, depth: int, multipv: int, legacy_depth: int, legacy_multipv: int) -> list[dict]:
+        """Labels searched below the given limits; rows without recorded limits use the legacy ones."""
+        rows = self.connection.execute(
+            "SELECT fen, cp, depth, multipv, policy_version, policy FROM labels "
+            "WHERE COALESCE(depth, ?) < ? OR COALESCE(multipv, ?) < ? ORDER BY ord",
+            (legacy_depth, depth, legacy_multipv, multipv),
+        )
+        return [_row_label(row) for row in rows]
+
+    def balanced_start_fens(self, max_cp: float) -> list[str]:
+        rows = self.connection.execute(
+            "SELECT fen FROM labels WHERE balanced_start = 1 AND cp BETWEEN ? AND ? ORDER BY fen",
+            (-float(max_cp), float(max_cp)),
+        )
+        return [fen for (fen,) in rows]
+
+
+def open_store(json_path: pathlib.Path) -> LabelStore:
+    """Open the store kept next to `json_path` (same name, .sqlite) and bring it up to date."""
+    json_path = pathlib.Path(json_path)
+    store = LabelStore(json_path.with_suffix(".sqlite"))
+    try:
+        store.sync_from_json(json_path)
+    except BaseException:
+        store.close()
+        raise
+    return store
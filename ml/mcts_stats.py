@@ -0,0 +1,135 @@
+# ml/mcts_stats.py
+"""
+Opt-in phase timers and counters for the Python MCTS.
+
+With AZ_MCTS_STATS=1, collect() installs a SearchStats that run_search_batch
+fills in; otherwise active() is None and the search only pays for a few
+`is not None` checks. AZ_MCTS_PROFILE=cprofile (or pyinstrument, when that
+package is installed) also writes a profile of every collected block to
+AZ_MCTS_PROFILE_DIR.
+"""
+import collections
+import contextlib
+import cProfile
+import os
+import pathlib
+import re
+import time
+
+ENABLED = os.environ.get("AZ_MCTS_STATS", "0") == "1"
+PROFILER = os.environ.get("AZ_MCTS_PROFILE", "").strip().lower()
+PROFILE_DIR = pathlib.Path(os.environ.get("AZ_MCTS_PROFILE_DIR", "ml/data/profiles"))
+PHASES = ("selection", "terminal_check", "featurization", "model_call", "prior_extraction", "expansion", "backup")
+
+_active = None
+
+
+class SearchStats:
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counts = collections.Counter()
+        self.batch_sizes = collections.Counter()
+        self.started = time.perf_counter()
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.seconds[phase] += seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counts[name] += amount
+
+    def batch(self, size: int) -> None:
+        self.batch_sizes[size] += 1
+
+    def merge(self, other: "SearchStats") -> None:
+        """Fold in stats collected elsewhere, e.g. by a worker process."""
+        for phase, seconds in other.seconds.items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.counts.update(other.counts)
+        self.batch_sizes.update(other.batch_sizes)
+
+    def summary(self) -> dict:
+        wall = time.perf_counter() - self.started
+        phase_total = sum(self.seconds.values())
+        model_batches = sum(self.batch_sizes.values())
+        summary = {
+            "wall_seconds": round(wall, 4),
+            "phase_seconds": {phase: round(seconds, 6) for phase, seconds in self.seconds.items()},
+            "phase_share": {
+                phase: round(seconds / phase_total, 4) if phase_total > 0 else 0.0
+                for phase, seconds in self.seconds.items()
+            },
+            "searches": self.counts["searches"],
+            "simulations": self.counts["simulations"],
+            "nodes_created": self.counts["nodes"],
+            "mean_tree_nodes": round(self.counts["nodes"] / self.counts["searches"], 2)
+            if self.counts["searches"] else 0.0,
+            "nodes_per_second": round(self.counts["nodes"] / wall, 2) if wall > 0 else 0.0,
+            "model_batches": model_batches,
+            "mean_batch_size": round(
+                sum(size * count for size, count in self.batch_sizes.items()) / model_batches, 3
+            ) if model_batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
+        # Caches report `<name>_hits` / `<name>_misses` counters.
+        for name in sorted(key[:-5] for key in self.counts if key.endswith("_hits")):
+            lookups = self.counts[f"{name}_hits"] + self.counts[f"{name}_misses"]
+            summary[f"{name}_hit_rate"] = round(self.counts[f"{name}_hits"] / lookups, 4) if lookups else 0.0
+        return summary
+
+
+def active() -> SearchStats | None:
+    return _active
+
+
+@contextlib.contextmanager
+def collect(label: str = "mcts", enabled: bool | None = None):
+    """Collect stats (and a profile, if configured) for the enclosed searches. Yields None when disabled."""
+    global _active
+    enabled = ENABLED if enabled is None else enabled
+    previous = _active
+    stats = SearchStats() if enabled else None
+    _active = stats
+    try:
+        with profile(label):
+            yield stats
+    finally:
+        _active = previous
+
+
+def _profile_path(label: str, suffix: str) -> pathlib.Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label)
+    return PROFILE_DIR / f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}{suffix}"
+
+
+@contextlib.contextmanager
+def profile(label: str, profiler: str | None = None):
+    profiler = PROFILER if profiler is None else profiler
+    if not profiler:
+        yield
+        return
+    if profiler == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            print("[mcts-stats] pyinstrument is not installed, using cProfile")
+        else:
+            session = pyinstrument.Profiler()
+            session.start()
+            try:
+                yield
+            finally:
+                session.stop()
+                path = _profile_path(label, ".html")
+                path.write_text(session.output_html(), encoding="utf-8")
+                print(f"[mcts-stats] wrote {path}")
+            return
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield
+    finally:
+        session.disable()
+        path = _profile_path(label, ".prof")
+        session.dump_stats(path)
+        print(f"[mcts-stats] wrote {path}")
@@ -0,0 +1,365 @@
+# ml/pipeline.py
+"""
+Local runner for the nightly training stages.
+
+Every stage declares the files it reads and writes and the environment
+variables that change its result. Its fingerprint covers the content of
+those inputs, the matching variables and the source of the script and every
+ml module it imports. A stage is skipped when its fingerprint and output
+digests match the last successful run; files a stage both reads and writes
+count as outputs only. Stages that pull from outside the tree, such as the
+Lichess fetch, declare always_run and are never skipped. Stages whose
+producers have finished run concurrently as subprocesses, and Stockfish
+labeling and self-play get disjoint CPU sets.
+
+    python ml/pipeline.py                   # every stale stage
+    python ml/pipeline.py stockfish train   # these stages, still cached
+    python ml/pipeline.py --force extract   # rerun extract even if fresh
+"""
+import argparse
+import ast
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+ML_DIR = pathlib.Path(__file__).resolve().parent
+ROOT = ML_DIR.parent
+STATE_JSON = pathlib.Path(os.environ.get("PIPELINE_STATE", "ml/data/pipeline_state.json"))
+# Comma-separated CPU ids per concurrent stage, e.g. PIPELINE_CORES_STOCKFISH=0-3.
+CORE_SETS_PREFIX = "PIPELINE_CORES_"
+SPLIT_CORES = os.environ.get("PIPELINE_SPLIT_CORES", "1") == "1"
+
+
+class Stage:
+    def __init__(self, name, script, inputs=(), outputs=(), params=(), worker_vars=(), always_run=False):
+        self.name = name
+        self.script = pathlib.Path(script)
+        self.inputs = [pathlib.Path(path) for path in inputs]
+        self.outputs = [pathlib.Path(path) for path in outputs]
+        # Environment variable names, or prefixes ending in "_".
+        self.params = tuple(params)
+        # Variables sized to the stage's CPU set when it is pinned and they are unset.
+        self.worker_vars = tuple(worker_vars)
+        # Results depend on something outside the declared inputs (e.g. the network).
+        self.always_run = always_run
+
+    def parameters(self, environ) -> dict[str, str]:
+        return {
+            name: value
+            for name, value in sorted(environ.items())
+            if any(name == param or (param.endswith("_") and name.startswith(param)) for param in self.params)
+        }
+
+
+STAGES = [
+    Stage(
+        "fetch",
+        "ml/fetch_lichess.py",
+        outputs=["ml/data/games.pgn"],
+        params=["LICHESS_"],
+        always_run=True,
+    ),
+    Stage(
+        "extract",
+        "ml/extract_positions.py",
+        inputs=["ml/data/games.pgn", "ml/data/replay_buffer.json"],
+        outputs=["ml/data/positions.fen"],
+        params=["POSITION_"],
+        worker_vars=["POSITION_WORKERS"],
+    ),
+    Stage(
+        "stockfish",
+        "ml/stockfish_eval.py",
+        inputs=["ml/data/positions.fen", "ml/data/replay_buffer.json"],
+        outputs=["ml/data/labels.json"],
+        params=["SF_", "STOCKFISH_PATH"],
+        worker_vars=["SF_ENGINES"],
+    ),
+    Stage(
+        "self_play",
+        "ml/self_play.py",
+        inputs=["ml/checkpoints/chess_eval.keras", "ml/data/replay_buffer.json", "ml/data/self_play_buffer.json"],
+        outputs=["ml/data/self_play_buffer.json"],
+        params=[
+            "AZ_SELF_PLAY_", "AZ_MCTS_SEARCHES", "AZ_MAX_PLIES", "AZ_MAX_SELF_PLAY_SAMPLES",
+            "AZ_CPUCT", "AZ_DIRICHLET_", "AZ_TEMP", "AZ_START_POSITION_",
+        ],
+    ),
+    Stage(
+        "train",
+        "ml/train_safe_export.py",
+        inputs=[
+            "ml/data/labels.json",
+            "ml/data/self_play_buffer.json",
+            "ml/data/replay_buffer.json",
+            "ml/data/fixed_eval_set_v3.json",
+            "ml/checkpoints",
+        ],
+        outputs=["ml/data/replay_buffer.json", "ml/checkpoints", "public/nn", "ml/training_history.json"],
+        params=["AZ_", "TRAIN_SEED", "CONTINUE_", "COLD_START_", "MAX_REPLAY_ITEMS"],
+        worker_vars=["AZ_DATA_WORKERS"],
+    ),
+]
+SPLIT_STAGES = ("stockfish", "self_play")
+
+
+def dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """Each stage waits for the latest earlier stage that writes one of its inputs."""
+    depends = {}
+    for position, stage in enumerate(stages):
+        depends[stage.name] = set()
+        for path in stage.inputs:
+            for producer in reversed(stages[:position]):
+                if path in producer.outputs:
+                    depends[stage.name].add(producer.name)
+                    break
+    return depends
+
+
+def code_files(script: pathlib.Path) -> list[pathlib.Path]:
+    """The script plus every sibling module it imports, directly or transitively."""
+    pending = [pathlib.Path(script)]
+    found = []
+    while pending:
+        path = pending.pop()
+        if path in found or not path.exists():
+            continue
+        found.append(path)
+        for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(path.parent / f"{name.split('.')[0]}.py" for name in names)
+    return sorted(found)
+
+
+class DigestCache:
+    """sha256 of files and directories, reusing stored digests while size and mtime are unchanged."""
+
+    def __init__(self, entries: dict | None = None):
+        self.entries = dict(entries or {})
+
+    def file(self, path: pathlib.Path) -> str:
+        stat = path.stat()
+        key = str(path)
+        cached = self.entries.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with path.open("rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path(self, path: pathlib.Path) -> str:
+        if path.is_file():
+            return self.file(path)
+        if not path.is_dir():
+            return "missing"
+        digest = hashlib.sha256()
+        for child in sorted(child for child in path.rglob("*") if child.is_file()):
+            digest.update(f"{child.relative_to(path).as_posix()}\0{self.file(child)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+
+def fingerprint(stage: Stage, cache: DigestCache, environ, root: pathlib.Path = ROOT) -> str:
+    outputs = set(stage.outputs)
+    payload = {
+        "code": {str(path.relative_to(root)): cache.file(path) for path in code_files(root / stage.script)},
+        "inputs": {str(path): cache.path(root / path) for path in stage.inputs if path not in outputs},
+        "params": stage.parameters(environ),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def output_digests(stage: Stage, cache: DigestCache, root: pathlib.Path = ROOT) -> dict[str, str]:
+    return {str(path): cache.path(root / path) for path in stage.outputs}
+
+
+def is_fresh(stage: Stage, record: dict | None, cache: DigestCache, environ, root: pathlib.Path = ROOT) -> bool:
+    if not record or stage.always_run:
+        return False
+    outputs = output_digests(stage, cache, root)
+    return (
+        record.get("fingerprint") == fingerprint(stage, cache, environ, root)
+        and record.get("outputs") == outputs
+        and "missing" not in outputs.values()
+    )
+
+
+def parse_cpus(text: str) -> list[int]:
+    cpus = []
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def core_sets(names: list[str], environ) -> dict[str, list[int]]:
+    """Explicit PIPELINE_CORES_<STAGE> sets, else an even split of the available CPUs between SPLIT_STAGES."""
+    sets = {
+        name: parse_cpus(environ[f"{CORE_SETS_PREFIX}{name.upper()}"])
+        for name in names
+        if environ.get(f"{CORE_SETS_PREFIX}{name.upper()}")
+    }
+    if sets or not SPLIT_CORES or not hasattr(os, "sched_getaffinity"):
+        return sets
+    split = [name for name in SPLIT_STAGES if name in names]
+    available = sorted(os.sched_getaffinity(0))
+    if len(split) < 2 or len(available) < len(split):
+        return sets
+    share = len(available) // len(split)
+    for index, name in enumerate(split):
+        end = len(available) if index == len(split) - 1 else (index + 1) * share
+        sets[name] = available[index * share:end]
+    return sets
+
+
+def stage_environment(stage: Stage, cpus: list[int] | None, environ) -> dict[str, str]:
+    env = dict(environ)
+    if cpus:
+        for name in stage.worker_vars:
+            env.setdefault(name, str(len(cpus)))
+    return env
+
+
+def run_stage(stage: Stage, cpus: list[int] | None, environ, root: pathlib.Path = ROOT) -> tuple[int, float]:
+    def pin():
+        os.sched_setaffinity(0, cpus)
+
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, str(stage.script)],
+        cwd=root,
+        env=stage_environment(stage, cpus, environ),
+        preexec_fn=pin if cpus and hasattr(os, "sched_setaffinity") else None,
+    )
+    return result.returncode, time.perf_counter() - started
+
+
+def read_state(path: pathlib.Path) -> dict:
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"stages": {}, "files": {}}
+    return state if isinstance(state, dict) else {"stages": {}, "files": {}}
+
+
+def write_state(state: dict, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text(json.dumps(state, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(temporary, path)
+
+
+def run_pipeline(
+    stages=None,
+    selected=None,
+    force=(),
+    environ=None,
+    runner=run_stage,
+    root: pathlib.Path = ROOT,
+) -> dict[str, dict]:
+    """
+    Run the selected stages (default: all) in dependency order and return {name: timing record}.
+
+    Unselected dependencies are assumed current. A failed stage cancels its
+    dependents; the others still run.
+    """
+    stages = STAGES if stages is None else stages
+    environ = dict(os.environ if environ is None else environ)
+    selected = [stage.name for stage in stages] if not selected else list(selected)
+    unknown = set(selected) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"unknown pipeline stages: {', '.join(sorted(unknown))}")
+
+    by_name = {stage.name: stage for stage in stages}
+    depends = {name: required & set(selected) for name, required in dependencies(stages).items()}
+    cpus = core_sets(selected, environ)
+    state_path = root / STATE_JSON
+    state = read_state(state_path)
+    cache = DigestCache(state.get("files"))
+    pending = [name for name in by_name if name in selected]
+    running = {}
+    results = {}
+    started = time.perf_counter()
+
+    def finished(name: str) -> bool:
+        return name in results and results[name]["status"] in ("ran", "cached")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+        while pending or running:
+            for name in list(pending):
+                if any(results.get(dep, {}).get("status") in ("failed", "blocked") for dep in depends[name]):
+                    pending.remove(name)
+                    results[name] = {"status": "blocked", "seconds": 0.0}
+                    print(f"[pipeline] {name}: skipped because a dependency failed")
+                    continue
+                if not all(finished(dep) for dep in depends[name]):
+                    continue
+                pending.remove(name)
+                stage = by_name[name]
+                if name not in force and is_fresh(stage, state["stages"].get(name), cache, environ, root):
+                    results[name] = {"status": "cached", "seconds": 0.0}
+                    print(f"[pipeline] {name}: up to date")
+                    continue
+                stage_fingerprint = fingerprint(stage, cache, environ, root)
+                core_text = f" on CPUs {cpus[name]}" if name in cpus else ""
+                print(f"[pipeline] {name}: running {stage.script}{core_text}")
+                running[pool.submit(runner, stage, cpus.get(name), environ, root)] = (name, stage_fingerprint)
+            if not running:
+                continue
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, stage_fingerprint = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode != 0:
+                    results[name] = {"status": "failed", "seconds": seconds}
+                    print(f"[pipeline] {name}: failed with exit code {returncode} after {seconds:.1f}s")
+                    continue
+                results[name] = {"status": "ran", "seconds": seconds}
+                state["stages"][name] = {
+                    "fingerprint": stage_fingerprint,
+                    "outputs": output_digests(by_name[name], cache, root),
+                    "seconds": round(seconds, 3),
+                    "finished_at": time.time(),
+                }
+                print(f"[pipeline] {name}: finished in {seconds:.1f}s")
+            state["files"] = cache.entries
+            write_state(state, state_path)
+
+    state["files"] = cache.entries
+    write_state(state, state_path)
+    width = max(len(name) for name in results) if results else 0
+    for name, result in results.items():
+        print(f"[pipeline] {name:<{width}}  {result['status']:<7}  {result['seconds']:8.1f}s")
+    print(f"[pipeline] wall clock {time.perf_counter() - started:.1f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the nightly training stages, skipping up-to-date ones")
+    parser.add_argument("stages", nargs="*", help=f"stages to run (default all): {', '.join(s.name for s in STAGES)}")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE", help="rerun a stage even if fresh")
+    args = parser.parse_args()
+    results = run_pipeline(selected=args.stages, force=set(args.force))
+    if any(result["status"] in ("failed", "blocked") for result in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 # ml/policy_map.py
-"""Stable chess move-to-policy mapping, including underpromotions."""
+"""
+Stable chess move-to-policy mapping, including underpromotions.
+
+Version 3 keeps only actions a chess move can actually take: every from/to
+pair on a queen line or knight jump, plus four promotion pieces for each
+pawn step onto the last rank. That is 1968 actions instead of the 20480 of
+the dense 64x64x5 version-2 layout. src/ai/nnAI.js builds the same table.
+"""
 import chess
 
-POLICY_VERSION = 2
+POLICY_VERSION = 3
 POLICY_CHANNELS = 5
 LEGACY_POLICY_SIZE = 64 * 64
-POLICY_SIZE = LEGACY_POLICY_SIZE * POLICY_CHANNELS
+V2_POLICY_SIZE = LEGACY_POLICY_SIZE * POLICY_CHANNELS
 
 _PROMOTION_TO_CHANNEL = {
     None: 0,
@@ -15,51 +22,107 @@ _PROMOTION_TO_CHANNEL = {
     chess.QUEEN: 4,
 }
 _CHANNEL_TO_PROMOTION = {value: key for key, value in _PROMOTION_TO_CHANNEL.items()}
+_PROMOTION_PIECES = (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)
 
 
-def move_to_index(move: chess.Move) -> int:
-    base = move.from_square * 64 + move.to_square
-    channel = _PROMOTION_TO_CHANNEL.get(move.promotion)
+def _is_queen_or_knight_move(from_square: int, to_square: int) -> bool:
+    file_delta = abs(chess.square_file(to_square) - chess.square_file(from_square))
+    rank_delta = abs(chess.square_rank(to_square) - chess.square_rank(from_square))
+    if from_square == to_square:
+        return False
+    return file_delta == 0 or rank_delta == 0 or file_delta == rank_delta or file_delta * rank_delta == 2
+
+
+def _is_promotion_step(from_square: int, to_square: int) -> bool:
+    from_rank = chess.square_rank(from_square)
+    to_rank = chess.square_rank(to_square)
+    if abs(chess.square_file(to_square) - chess.square_file(from_square)) > 1:
+        return False
+    return (from_rank, to_rank) in ((6, 7), (1, 0))
+
+
+def _v2_index(from_square: int, to_square: int, promotion) -> int:
+    channel = _PROMOTION_TO_CHANNEL.get(promotion)
     if channel is None:
-        raise ValueError(f"unsupported promotion piece: {move.promotion}")
-    return base * POLICY_CHANNELS + channel
+        raise ValueError(f"unsupported promotion piece: {promotion}")
+    return (from_square * 64 + to_square) * POLICY_CHANNELS + channel
+
+
+def _build_actions() -> list[tuple[int, int, int | None]]:
+    actions = []
+    for from_square in chess.SQUARES:
+        for to_square in chess.SQUARES:
+            if _is_queen_or_knight_move(from_square, to_square):
+                actions.append((from_square, to_square, None))
+            if _is_promotion_step(from_square, to_square):
+                actions.extend((from_square, to_square, piece) for piece in _PROMOTION_PIECES)
+    return actions
+
+
+_ACTIONS = _build_actions()
+POLICY_SIZE = len(_ACTIONS)
+_V2_TO_COMPACT = [-1] * V2_POLICY_SIZE
+for _index, (_from_square, _to_square, _promotion) in enumerate(_ACTIONS):
+    _V2_TO_COMPACT[_v2_index(_from_square, _to_square, _promotion)] = _index
+
+
+def move_to_index(move: chess.Move) -> int:
+    index = _V2_TO_COMPACT[_v2_index(move.from_square, move.to_square, move.promotion)]
+    if index < 0:
+        raise ValueError(f"move outside the policy action space: {move.uci()}")
+    return index
+
+
+def _board_promotion(from_square: int, to_square: int, board: chess.Board | None):
+    # Older targets encoded promotions as plain moves. Interpret them as queen
+    # promotions when a board shows a pawn stepping onto the last rank.
+    if board is None:
+        return None
+    piece = board.piece_at(from_square)
+    if piece and piece.piece_type == chess.PAWN and chess.square_rank(to_square) in (0, 7):
+        return chess.QUEEN
+    return None
 
 
 def index_to_move(index: int, board: chess.Board | None = None) -> chess.Move:
     if not 0 <= index < POLICY_SIZE:
         raise ValueError(f"policy index out of range: {index}")
 
-    base, channel = divmod(index, POLICY_CHANNELS)
-    from_square = base // 64
-    to_square = base % 64
-    promotion = _CHANNEL_TO_PROMOTION[channel]
+    from_square, to_square, promotion = _ACTIONS[index]
+    if promotion is None:
+        promotion = _board_promotion(from_square, to_square, board)
+    return chess.Move(from_square, to_square, promotion=promotion)
 
-    # Channel zero is a normal move. For defensive compatibility, interpret an
-    # old queen-promotion-shaped index as queen when a board makes that clear.
-    if promotion is None and board is not None:
-        piece = board.piece_at(from_square)
-        if piece and piece.piece_type == chess.PAWN and chess.square_rank(to_square) in (0, 7):
-            promotion = chess.QUEEN
 
-    return chess.Move(from_square, to_square, promotion=promotion)
+def source_policy_indices(policy_version: int) -> list[int]:
+    """Return, for every current action, its index in an older policy layout."""
+    if policy_version >= POLICY_VERSION:
+        return list(range(POLICY_SIZE))
+    if policy_version >= 2:
+        return [_v2_index(*action) for action in _ACTIONS]
+    return [from_square * 64 + to_square for from_square, to_square, _ in _ACTIONS]
 
 
 def normalize_policy_index(index: int, board: chess.Board | None, policy_version: int) -> int:
-    """Convert stored legacy 4096-action policies into the version-2 mapping."""
+    """Convert stored version-1 (4096) and version-2 (20480) policy indices into the compact mapping."""
     index = int(index)
     if policy_version >= POLICY_VERSION:
         if not 0 <= index < POLICY_SIZE:
             raise ValueError(f"policy index out of range: {index}")
         return index
 
-    if not 0 <= index < LEGACY_POLICY_SIZE:
-        raise ValueError(f"legacy policy index out of range: {index}")
+    if policy_version >= 2:
+        if not 0 <= index < V2_POLICY_SIZE:
+            raise ValueError(f"version-2 policy index out of range: {index}")
+        base, channel = divmod(index, POLICY_CHANNELS)
+        promotion = _CHANNEL_TO_PROMOTION[channel]
+    else:
+        if not 0 <= index < LEGACY_POLICY_SIZE:
+            raise ValueError(f"legacy policy index out of range: {index}")
+        base = index
+        promotion = None
 
-    from_square = index // 64
-    to_square = index % 64
-    promotion = None
-    if board is not None:
-        piece = board.piece_at(from_square)
-        if piece and piece.piece_type == chess.PAWN and chess.square_rank(to_square) in (0, 7):
-            promotion = chess.QUEEN
+    from_square, to_square = divmod(base, 64)
+    if promotion is None:
+        promotion = _board_promotion(from_square, to_square, board)
     return move_to_index(chess.Move(from_square, to_square, promotion=promotion))
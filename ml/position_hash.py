@@ -0,0 +1,149 @@
+# ml/position_hash.py
+"""
+64-bit position identity shared by the data pipeline.
+
+fen_hash reads the FEN fields directly instead of building a chess.Board. It
+XORs the Polyglot Zobrist keys for pieces, castling rights, side to move and
+en-passant file. Unlike Polyglot, the en-passant file counts whenever the FEN
+names a square, so two canonical FENs hash alike exactly when they are equal
+(up to collisions). Move clocks are ignored.
+Sorted NumPy arrays of hashes serve as compact membership indexes, and a
+Bloom filter is available where a rare false "seen" is acceptable.
+"""
+import math
+
+import chess.polyglot
+import numpy as np
+
+_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_PIECE_KINDS = "pPnNbBrRqQkK"
+_PIECE_SQUARE_KEYS = {
+    symbol: [_KEYS[64 * kind + square] for square in range(64)]
+    for kind, symbol in enumerate(_PIECE_KINDS)
+}
+_CASTLING_KEYS = {"K": _KEYS[768], "Q": _KEYS[769], "k": _KEYS[770], "q": _KEYS[771]}
+_EN_PASSANT_KEYS = {file: _KEYS[772 + index] for index, file in enumerate("abcdefgh")}
+_WHITE_TO_MOVE_KEY = _KEYS[780]
+
+
+def fen_hash(fen: str) -> int:
+    """Unsigned 64-bit Zobrist hash of a FEN's placement, turn, castling and en-passant fields."""
+    fields = fen.split()
+    try:
+        key = 0
+        rank = 7
+        file = 0
+        complete = False
+        for symbol in fields[0]:
+            if symbol == "/":
+                if file != 8 or rank == 0:
+                    break
+                rank -= 1
+                file = 0
+            elif symbol.isdigit():
+                file += int(symbol)
+            elif file < 8:
+                key ^= _PIECE_SQUARE_KEYS[symbol][8 * rank + file]
+                file += 1
+            else:
+                break
+            if file > 8:
+                break
+        else:
+            complete = rank == 0 and file == 8
+        if not complete:
+            # Short, long or extra ranks would otherwise wrap onto other squares.
+            raise ValueError(f"invalid FEN for hashing: {fen!r}")
+        if len(fields) > 2 and fields[2] != "-":
+            for symbol in fields[2]:
+                key ^= _CASTLING_KEYS[symbol]
+        if len(fields) > 3 and fields[3] != "-":
+            key ^= _EN_PASSANT_KEYS[fields[3][0]]
+    except (IndexError, KeyError) as exc:
+        raise ValueError(f"invalid FEN for hashing: {fen!r}") from exc
+    if len(fields) < 2 or fields[1] == "w":
+        key ^= _WHITE_TO_MOVE_KEY
+    return key
+
+
+def board_hash(board: chess.Board) -> int:
+    return fen_hash(board.fen(en_passant="fen"))
+
+
+def to_signed(key: int) -> int:
+    """Map an unsigned hash onto SQLite's signed 64-bit INTEGER range."""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def fen_hashes(fens) -> np.ndarray:
+    fens = list(fens)
+    return np.fromiter((fen_hash(fen) for fen in fens), dtype=np.uint64, count=len(fens))
+
+
+class HashIndex:
+    """Sorted unique uint64 hashes with vectorized membership via searchsorted."""
+
+    def __init__(self, hashes=()):
+        self.hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+
+    @classmethod
+    def from_fens(cls, fens) -> "HashIndex":
+        return cls(fen_hashes(fens))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def contains(self, hashes) -> np.ndarray:
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(self.hashes):
+            return np.zeros(hashes.shape, dtype=bool)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[positions] == hashes
+
+    def contains_fens(self, fens) -> np.ndarray:
+        return self.contains(fen_hashes(fens))
+
+    def __contains__(self, key: int) -> bool:
+        return bool(self.contains(np.asarray([key], dtype=np.uint64))[0])
+
+
+def as_index(fens_or_index) -> HashIndex:
+    """Accept an existing index, or any iterable of FENs (None means empty)."""
+    if isinstance(fens_or_index, HashIndex):
+        return fens_or_index
+    return HashIndex.from_fens(fens_or_index or ())
+
+
+class BloomFilter:
+    """Bit-array membership test with no false negatives and about `error_rate` false positives."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, int(capacity))
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, hashes) -> np.ndarray:
+        # Double hashing: the two 32-bit halves of each key generate every probe.
+        hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1, 1)
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        probes = np.arange(self.hash_count, dtype=np.uint64).reshape(1, -1)
+        return (low + probes * high) % np.uint64(self.size)
+
+    def add(self, hashes) -> None:
+        positions = self._positions(hashes).reshape(-1)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += int(np.asarray(hashes).size)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def contains(self, hashes) -> np.ndarray:
+        positions = self._positions(hashes)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return np.all(bits == 1, axis=1)
+
+    def __contains__(self, key: int) -> bool:
+        return bool(self.contains(np.asarray([key], dtype=np.uint64))[0])
@@ -1,16 +1,21 @@
 # ml/self_play.py
 """Generate AlphaZero-style self-play samples with neural PUCT search."""
+import hashlib
 import json
 import math
 import os
 import pathlib
 import random
+import sys
+import time
 
 import chess
 import numpy as np
-import tensorflow as tf
 
+import mcts_stats
+import telemetry
 from features import PLANES, board_to_features
+from label_store import open_store
 from policy_map import POLICY_SIZE, POLICY_VERSION, move_to_index
 
 CHECKPOINT_MODEL = pathlib.Path("ml/checkpoints/chess_eval.keras")
@@ -21,6 +26,11 @@ SELF_PLAY_GAMES = int(os.environ.get("AZ_SELF_PLAY_GAMES", "4"))
 SELF_PLAY_BATCH_SIZE = int(os.environ.get("AZ_SELF_PLAY_BATCH_SIZE", "4"))
 MCTS_SEARCHES = int(os.environ.get("AZ_MCTS_SEARCHES", "80"))
 MAX_PLIES = int(os.environ.get("AZ_MAX_PLIES", "180"))
+# With a budget, self-play keeps starting games until the deadline instead of playing AZ_SELF_PLAY_GAMES.
+SELF_PLAY_SECONDS = float(os.environ.get("AZ_SELF_PLAY_SECONDS", "0"))
+DEADLINE_MARGIN = float(os.environ.get("AZ_SELF_PLAY_DEADLINE_MARGIN", "30"))
+EXPECTED_GAME_PLIES = float(os.environ.get("AZ_SELF_PLAY_EXPECTED_PLIES", "120"))
+ADJUDICATE_VALUE = float(os.environ.get("AZ_SELF_PLAY_ADJUDICATE_VALUE", "0.9"))
 MAX_BUFFER = int(os.environ.get("AZ_MAX_SELF_PLAY_SAMPLES", "20000"))
 CPUCT = float(os.environ.get("AZ_CPUCT", "1.5"))
 DIRICHLET_ALPHA = float(os.environ.get("AZ_DIRICHLET_ALPHA", "0.3"))
@@ -30,12 +40,20 @@ TEMPERATURE = float(os.environ.get("AZ_TEMPERATURE", "1.0"))
 SEED = int(os.environ.get("AZ_SELF_PLAY_SEED", "42")) % (2**32 - 1)
 START_POSITION_FRACTION = float(os.environ.get("AZ_START_POSITION_FRACTION", "0.5"))
 START_POSITION_MAX_CP = float(os.environ.get("AZ_START_POSITION_MAX_CP", "150"))
+# Per-batch MCTS stats from the last run (AZ_MCTS_STATS=1); training folds them into its history record.
+SELF_PLAY_STATS = pathlib.Path("ml/data/self_play_stats.json")
+# In-flight games, finished samples and RNG state, so an interrupted run resumes where it stopped.
+SELF_PLAY_CHECKPOINT = pathlib.Path("ml/data/self_play_checkpoint.json")
+CHECKPOINT_SECONDS = float(os.environ.get("AZ_SELF_PLAY_CHECKPOINT_SECONDS", "60"))
+UNIFORM_MODEL = "uniform"
 
 
 def seed_everything(seed=SEED):
     random.seed(seed)
     np.random.seed(seed)
-    tf.keras.utils.set_random_seed(seed)
+    # Uniform-prior runs never load a model, so they need not import TensorFlow to seed it.
+    if "tensorflow" in sys.modules:
+        sys.modules["tensorflow"].keras.utils.set_random_seed(seed)
 
 
 def softmax(values):
@@ -64,25 +82,22 @@ def write_json(path, data):
 
 
 def load_balanced_start_fens(path=STOCKFISH_REPLAY_BUFFER):
-    candidates = []
-    for item in read_json_list(path):
-        fen = item.get("fen")
-        try:
-            cp = abs(float(item.get("cp", 0.0)))
-            board = chess.Board(fen)
-        except (TypeError, ValueError):
-            continue
-        if cp > START_POSITION_MAX_CP or board.is_game_over(claim_draw=True):
-            continue
-        if len(board.piece_map()) < 10:
-            continue
-        candidates.append(board.fen(en_passant="fen"))
-
-    candidates = sorted(set(candidates))
+    with open_store(path) as store:
+        candidates = store.balanced_start_fens(START_POSITION_MAX_CP)
     random.Random(SEED).shuffle(candidates)
     return candidates
 
 
+def model_digest(path):
+    if not path.exists():
+        return UNIFORM_MODEL
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def board_for_self_play_game(game_index, start_fens):
     use_start = start_fens and START_POSITION_FRACTION > 0 and (
         ((game_index * 37) % 100) / 100 < min(1.0, START_POSITION_FRACTION)
@@ -106,6 +121,8 @@ def load_model_or_none(path=CHECKPOINT_MODEL):
     if not path.exists():
         print("[self-play] no checkpoint yet, using uniform priors")
         return None
+    import tensorflow as tf
+
     try:
         model = tf.keras.models.load_model(path, compile=False)
     except Exception as exc:
@@ -127,10 +144,11 @@ def terminal_value(board):
     return 1.0 if outcome.winner == board.turn else -1.0
 
 
-def model_policy_value_batch(model, boards):
+def model_policy_value_batch(model, boards, stats=None):
     if not boards:
         return []
 
+    started = time.perf_counter() if stats is not None else 0.0
     legal_moves_by_board = [list(board.legal_moves) for board in boards]
     if model is None:
         results = []
@@ -140,14 +158,25 @@ def model_policy_value_batch(model, boards):
                 continue
             probability = 1.0 / len(legal_moves)
             results.append(({move_to_index(move): probability for move in legal_moves}, 0.0))
+        if stats is not None:
+            stats.add("prior_extraction", time.perf_counter() - started)
         return results
 
+    if stats is not None:
+        featurize_started = time.perf_counter()
+        stats.add("prior_extraction", featurize_started - started)
     features = np.stack(
         [board_to_features(board.fen(en_passant="fen")).reshape(8, 8, PLANES) for board in boards]
     ).astype(np.float32)
+    if stats is not None:
+        model_started = time.perf_counter()
+        stats.add("featurization", model_started - featurize_started)
     prediction = model(features, training=False)
+    if stats is not None:
+        priors_started = time.perf_counter()
+        stats.add("model_call", priors_started - model_started)
     if not isinstance(prediction, (list, tuple)) or len(prediction) != 2:
-        return model_policy_value_batch(None, boards)
+        return model_policy_value_batch(None, boards, stats)
 
     policy_logits, values = (np.asarray(output, dtype=np.float32) for output in prediction)
     results = []
@@ -163,6 +192,8 @@ def model_policy_value_batch(model, boards):
             for index, probability in zip(legal_indices, legal_probabilities)
         }
         results.append((priors, float(values[board_index][0])))
+    if stats is not None:
+        stats.add("prior_extraction", time.perf_counter() - priors_started)
     return results
 
 
@@ -198,6 +229,8 @@ class Node:
         return best_child
 
     def expand(self, priors):
+        """Add a child per legal move and return how many were created."""
+        created = 0
         for move in self.board.legal_moves:
             index = move_to_index(move)
             if index in self.children:
@@ -205,6 +238,8 @@ class Node:
             next_board = self.board.copy(stack=True)
             next_board.push(move)
             self.children[index] = Node(next_board, parent=self, prior=priors.get(index, 0.0), move=move)
+            created += 1
+        return created
 
     def backup(self, value):
         node = self
@@ -215,25 +250,29 @@ class Node:
             node = node.parent
 
 
-def add_root_noise(root):
+def add_root_noise(root, rng=np.random):
     children = list(root.children.values())
     if not children:
         return
-    noise = np.random.dirichlet([DIRICHLET_ALPHA] * len(children))
+    noise = rng.dirichlet([DIRICHLET_ALPHA] * len(children))
     for child, sample in zip(children, noise):
         child.prior = (1 - DIRICHLET_EPSILON) * child.prior + DIRICHLET_EPSILON * float(sample)
 
 
-def run_search_batch(model, boards, searches=None, add_noise=True):
+def run_search_batch(model, boards, searches=None, add_noise=True, rngs=None):
+    """Visit-count policies for `boards`; `rngs` optionally gives each root its own noise generator."""
     if not boards:
         return []
     searches = MCTS_SEARCHES if searches is None else int(searches)
+    stats = mcts_stats.active()
     roots = [Node(board.copy(stack=True)) for board in boards]
-    root_predictions = model_policy_value_batch(model, [root.board for root in roots])
-    for root, (priors, root_value) in zip(roots, root_predictions):
-        root.expand(priors)
+    root_predictions = model_policy_value_batch(model, [root.board for root in roots], stats)
+    nodes = len(roots)
+    for root_index, (root, (priors, root_value)) in enumerate(zip(roots, root_predictions)):
+        nodes += root.expand(priors)
         if add_noise:
-            add_root_noise(root)
+            rng = None if rngs is None else rngs[root_index]
+            add_root_noise(root, np.random if rng is None else rng)
         root.visit_count = 1
         root.value_sum = root_value
 
@@ -243,12 +282,17 @@ def run_search_batch(model, boards, searches=None, add_noise=True):
         pending_indices = []
 
         for root_index, root in enumerate(roots):
+            if stats is not None:
+                selection_started = time.perf_counter()
             node = root
             while node.children:
                 node = node.select_child()
                 if node is None:
                     break
             leaves.append(node)
+            if stats is not None:
+                terminal_started = time.perf_counter()
+                stats.add("selection", terminal_started - selection_started)
             if node is None:
                 continue
             value = terminal_value(node.board)
@@ -256,19 +300,35 @@ def run_search_batch(model, boards, searches=None, add_noise=True):
                 pending_indices.append(root_index)
             else:
                 values[root_index] = value
+            if stats is not None:
+                stats.add("terminal_check", time.perf_counter() - terminal_started)
 
         predictions = model_policy_value_batch(
             model,
             [leaves[index].board for index in pending_indices],
+            stats,
         )
+        if stats is not None:
+            stats.batch(len(pending_indices))
+            expansion_started = time.perf_counter()
         for root_index, (priors, value) in zip(pending_indices, predictions):
             node = leaves[root_index]
-            node.expand(priors)
+            nodes += node.expand(priors)
             values[root_index] = value
 
+        if stats is not None:
+            backup_started = time.perf_counter()
+            stats.add("expansion", backup_started - expansion_started)
         for node, value in zip(leaves, values):
             if node is not None and value is not None:
                 node.backup(value)
+        if stats is not None:
+            stats.add("backup", time.perf_counter() - backup_started)
+
+    if stats is not None:
+        stats.count("searches", len(roots))
+        stats.count("simulations", len(roots) * max(1, searches))
+        stats.count("nodes", nodes)
 
     policies = []
     for root, board in zip(roots, boards):
@@ -287,7 +347,7 @@ def run_search(model, board, searches=None, add_noise=True):
     return run_search_batch(model, [board], searches=searches, add_noise=add_noise)[0]
 
 
-def choose_action(policy, move_number, sample=True):
+def choose_action(policy, move_number, sample=True, rng=np.random):
     indices = list(policy.keys())
     if not indices:
         raise ValueError("cannot choose from an empty policy")
@@ -297,7 +357,7 @@ def choose_action(policy, move_number, sample=True):
     if sample and move_number < TEMP_MOVES and TEMPERATURE > 0:
         probabilities = np.power(probabilities, 1.0 / TEMPERATURE)
         probabilities = probabilities / np.sum(probabilities)
-        return int(np.random.choice(indices, p=probabilities))
+        return int(rng.choice(indices, p=probabilities))
     return int(indices[int(np.argmax(probabilities))])
 
 
@@ -308,64 +368,164 @@ def result_for_white(board):
     return 1.0 if outcome.winner == chess.WHITE else -1.0
 
 
-def play_games(model, first_game_index, game_count, start_fens=None):
-    games = [
+def new_game(game_index, start_fens):
+    return {
+        "board": board_for_self_play_game(game_index, start_fens or []),
+        "samples": [],
+        "game_index": game_index,
+    }
+
+
+def play_ply(game, policy, move_number):
+    """Sample and play a move, drawing from the game's own "rng" when it has one."""
+    board = game["board"]
+    rng = game.get("rng")
+    action = choose_action(policy, move_number, sample=True, rng=np.random if rng is None else rng)
+    legal_by_index = {move_to_index(move): move for move in board.legal_moves}
+    move = legal_by_index.get(action)
+    if move is None:
+        legal = list(board.legal_moves)
+        move = random.choice(legal) if rng is None else legal[int(rng.randint(len(legal)))]
+
+    game["samples"].append(
         {
-            "board": board_for_self_play_game(first_game_index + offset, start_fens or []),
-            "samples": [],
-            "game_index": first_game_index + offset,
+            "fen": board.fen(en_passant="fen"),
+            "turn": "white" if board.turn == chess.WHITE else "black",
+            "policy_version": POLICY_VERSION,
+            "policy": [
+                [int(index), float(probability)]
+                for index, probability in policy.items()
+                if probability > 0
+            ],
         }
-        for offset in range(game_count)
-    ]
-    for ply in range(MAX_PLIES):
-        active = [game for game in games if not game["board"].is_game_over(claim_draw=True)]
+    )
+    board.push(move)
+
+
+def label_samples(samples, white_result, termination):
+    for sample in samples:
+        sample["z"] = white_result if sample["turn"] == "white" else -white_result
+        sample["termination"] = termination
+    return samples
+
+
+def finish_game(game):
+    board = game["board"]
+    samples = game["samples"]
+    outcome = board.outcome(claim_draw=True)
+    if outcome is None:
+        print(
+            f"[self-play] game {game['game_index'] + 1}: "
+            f"discarded {len(samples)} plies because the game hit the ply limit"
+        )
+        return []
+    print(
+        f"[self-play] game {game['game_index'] + 1}: "
+        f"{len(samples)} plies, result {board.result(claim_draw=True)}"
+    )
+    return label_samples(samples, result_for_white(board), outcome.termination.name.lower())
+
+
+def play_out(model, games, on_ply=None):
+    """Play every game to its end or MAX_PLIES, batching the searches across games still in play."""
+    while True:
+        active = [
+            game for game in games
+            if len(game["samples"]) < MAX_PLIES and not game["board"].is_game_over(claim_draw=True)
+        ]
         if not active:
             break
-        policies = run_search_batch(model, [game["board"] for game in active], add_noise=True)
+        policies = run_search_batch(
+            model, [game["board"] for game in active], add_noise=True, rngs=[game.get("rng") for game in active]
+        )
         for game, policy in zip(active, policies):
-            board = game["board"]
-            action = choose_action(policy, ply, sample=True)
-            legal_by_index = {move_to_index(move): move for move in board.legal_moves}
-            move = legal_by_index.get(action)
-            if move is None:
-                move = random.choice(list(board.legal_moves))
-
-            game["samples"].append(
-                {
-                    "fen": board.fen(en_passant="fen"),
-                    "turn": "white" if board.turn == chess.WHITE else "black",
-                    "policy_version": POLICY_VERSION,
-                    "policy": [
-                        [int(index), float(probability)]
-                        for index, probability in policy.items()
-                        if probability > 0
-                    ],
-                }
-            )
-            board.push(move)
+            play_ply(game, policy, len(game["samples"]))
+        if on_ply is not None:
+            on_ply(games)
+    return [finish_game(game) for game in games]
 
-    completed_samples = []
-    for game in games:
+
+def play_games(model, first_game_index, game_count, start_fens=None):
+    return play_out(model, [new_game(first_game_index + offset, start_fens) for offset in range(game_count)])
+
+
+def adjudicate_games(model, games):
+    """Score games still running at the deadline by the model's value; undecided ones are dropped."""
+    predictions = model_policy_value_batch(model, [game["board"] for game in games])
+    completed = []
+    for game, (_, value) in zip(games, predictions):
         board = game["board"]
         samples = game["samples"]
-        outcome = board.outcome(claim_draw=True)
-        if outcome is None:
+        if abs(value) < ADJUDICATE_VALUE or not samples:
             print(
                 f"[self-play] game {game['game_index'] + 1}: "
-                f"discarded {len(samples)} plies because the game hit the ply limit"
+                f"discarded {len(samples)} plies still in play at the deadline"
             )
-            completed_samples.append([])
+            completed.append([])
             continue
-        white_result = result_for_white(board)
-        for sample in samples:
-            sample["z"] = white_result if sample["turn"] == "white" else -white_result
-            sample["termination"] = outcome.termination.name.lower()
+        side_to_move = 1.0 if board.turn == chess.WHITE else -1.0
+        white_result = side_to_move if value > 0 else -side_to_move
         print(
             f"[self-play] game {game['game_index'] + 1}: "
-            f"{len(samples)} plies, result {board.result(claim_draw=True)}"
+            f"{len(samples)} plies, adjudicated {'1-0' if white_result > 0 else '0-1'} at value {value:+.2f}"
+        )
+        completed.append(label_samples(samples, white_result, "adjudicated"))
+    return completed
+
+
+def play_games_until(
+    model,
+    deadline,
+    batch_size,
+    start_fens=None,
+    first_game_index=0,
+    clock=time.monotonic,
+    games=None,
+    on_ply=None,
+):
+    """
+    Keep up to batch_size games in play, refilling a finished slot only while a
+    new game is projected to end before `deadline` (a `clock` reading). The
+    projection multiplies a running average of batched ply time by the mean
+    length of finished games. Games still in play when the next ply would
+    overrun the deadline are adjudicated. `games` resumes games already in play.
+    """
+    games = list(games or [])
+    completed = []
+    finished_plies = []
+    ply_seconds = None
+    next_index = first_game_index
+    while True:
+        now = clock()
+        expected_plies = min(
+            MAX_PLIES,
+            sum(finished_plies) / len(finished_plies) if finished_plies else EXPECTED_GAME_PLIES,
         )
-        completed_samples.append(samples)
-    return completed_samples
+        while len(games) < batch_size and now < deadline and (
+            ply_seconds is None or now + expected_plies * ply_seconds <= deadline
+        ):
+            games.append(new_game(next_index, start_fens))
+            next_index += 1
+        if not games or (ply_seconds is not None and now + ply_seconds > deadline):
+            break
+
+        policies = run_search_batch(model, [game["board"] for game in games], add_noise=True)
+        for game, policy in zip(games, policies):
+            play_ply(game, policy, len(game["samples"]))
+        elapsed = clock() - now
+        ply_seconds = elapsed if ply_seconds is None else 0.8 * ply_seconds + 0.2 * elapsed
+
+        for game in [game for game in games if game["board"].is_game_over(claim_draw=True)
+                     or len(game["samples"]) >= MAX_PLIES]:
+            games.remove(game)
+            finished_plies.append(len(game["samples"]))
+            completed.append(finish_game(game))
+        if on_ply is not None:
+            on_ply(next_index, games, completed)
+
+    if games:
+        completed.extend(adjudicate_games(model, games))
+    return completed
 
 
 def play_game(model, game_index):
@@ -380,6 +540,7 @@ def play_arena_game(
     max_plies=160,
     opening=None,
     start_fen=None,
+    on_ply=None,
 ):
     board = chess.Board(start_fen) if start_fen else chess.Board()
     for uci in opening or []:
@@ -399,6 +560,8 @@ def play_arena_game(
         if move is None:
             return 0.0
         board.push(move)
+        if on_ply is not None:
+            on_ply(board)
 
     outcome = board.outcome(claim_draw=True)
     if outcome is None or outcome.winner is None:
@@ -407,7 +570,8 @@ def play_arena_game(
     return 1.0 if outcome.winner == candidate_color else 0.0
 
 
-def arena_score(candidate, baseline, games=2, searches=24, max_plies=160, start_fens=None):
+def arena_game_plans(games, searches=24, max_plies=160, start_fens=None):
+    """Keyword arguments of play_arena_game for each arena game, pairing colors per opening."""
     openings = (
         ("e2e4", "e7e5"),
         ("d2d4", "d7d5"),
@@ -418,30 +582,45 @@ def arena_score(candidate, baseline, games=2, searches=24, max_plies=160, start_
         ("c2c4", "c7c5"),
         ("g1f3", "g8f6"),
     )
-    scores = []
+    plans = []
     for game_index in range(max(0, games)):
-        candidate_is_white = game_index % 2 == 0
         start_fen = None
         opening = None
         if start_fens:
             start_fen = start_fens[(game_index // 2) % len(start_fens)]
         else:
             opening = openings[(game_index // 2) % len(openings)]
-        score = play_arena_game(
-            candidate,
-            baseline,
-            candidate_is_white,
-            searches=searches,
-            max_plies=max_plies,
-            opening=opening,
-            start_fen=start_fen,
-        )
-        scores.append(score)
-        print(f"[arena] game {game_index + 1}/{games}: candidate score {score:.1f}")
+        plans.append({
+            "candidate_is_white": game_index % 2 == 0,
+            "searches": searches,
+            "max_plies": max_plies,
+            "opening": opening,
+            "start_fen": start_fen,
+        })
+    return plans
+
+
+def arena_score(candidate, baseline, games=2, searches=24, max_plies=160, start_fens=None, play_all=None):
+    """
+    Score the candidate against the baseline. `play_all`, when given, plays the
+    list of game plans elsewhere (e.g. in worker processes) and returns their
+    scores in order.
+    """
+    def play_here(plans):
+        for plan in plans:
+            options = dict(plan)
+            yield play_arena_game(candidate, baseline, options.pop("candidate_is_white"), **options)
+
+    plans = arena_game_plans(games, searches, max_plies, start_fens)
+    scores = []
+    with mcts_stats.collect("arena") as stats:
+        for game_index, score in enumerate((play_all or play_here)(plans)):
+            scores.append(score)
+            print(f"[arena] game {game_index + 1}/{games}: candidate score {score:.1f}")
     wins = sum(score == 1.0 for score in scores)
     draws = sum(score == 0.5 for score in scores)
     losses = sum(score == 0.0 for score in scores)
-    return {
+    result = {
         "score": float(np.mean(scores)) if scores else 1.0,
         "wins": wins,
         "draws": draws,
@@ -449,27 +628,195 @@ def arena_score(candidate, baseline, games=2, searches=24, max_plies=160, start_
         "decisive_games": wins + losses,
         "start_positions": len(set(start_fens or [])),
     }
+    if stats is not None:
+        result["mcts"] = stats.summary()
+    return result
+
+
+def rng_state():
+    version, internal, gauss = random.getstate()
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "python": [version, list(internal), gauss],
+        "numpy": [name, keys.tolist(), int(position), int(has_gauss), float(cached_gaussian)],
+    }
+
+
+def set_rng_state(state):
+    version, internal, gauss = state["python"]
+    random.setstate((version, tuple(internal), gauss))
+    name, keys, position, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, np.asarray(keys, dtype=np.uint32), position, has_gauss, cached_gaussian))
+
+
+def snapshot_game(game):
+    board = game["board"]
+    return {
+        "game_index": game["game_index"],
+        "start_fen": board.root().fen(),
+        "moves": [move.uci() for move in board.move_stack],
+        "samples": game["samples"],
+    }
+
+
+def restore_game(snapshot):
+    # Replaying the moves keeps the move stack that repetition claims depend on.
+    board = chess.Board(snapshot["start_fen"])
+    for uci in snapshot["moves"]:
+        board.push_uci(uci)
+    return {"board": board, "samples": snapshot["samples"], "game_index": snapshot["game_index"]}
+
+
+class RunCheckpoint:
+    """Periodic snapshot of a self-play run; only reloaded by a run with the same settings and model."""
+
+    def __init__(self, path, config, interval=CHECKPOINT_SECONDS, clock=time.monotonic):
+        self.path = path
+        self.config = config
+        self.interval = interval
+        self.clock = clock
+        self.saved_at = clock()
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not isinstance(data, dict) or data.get("config") != self.config:
+            print(f"[self-play] ignoring {self.path}: it was written with different settings or model")
+            return None
+        return {
+            "next_game": data["next_game"],
+            "samples": data["samples"],
+            "games": [restore_game(game) for game in data["games"]],
+            "rng": data["rng"],
+        }
+
+    def due(self):
+        return self.interval > 0 and self.clock() - self.saved_at >= self.interval
+
+    def save(self, next_game, samples, games=()):
+        data = {
+            "config": self.config,
+            "next_game": next_game,
+            "samples": samples,
+            "games": [snapshot_game(game) for game in games],
+            "rng": rng_state(),
+        }
+        temporary = self.path.with_name(f".{self.path.name}.tmp")
+        write_json(temporary, data)
+        os.replace(temporary, self.path)
+        self.saved_at = self.clock()
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+
+def run_config(batch_size):
+    return {
+        "seed": SEED,
+        "games": SELF_PLAY_GAMES,
+        "seconds": SELF_PLAY_SECONDS,
+        "batch_size": batch_size,
+        "searches": MCTS_SEARCHES,
+        "max_plies": MAX_PLIES,
+        "cpuct": CPUCT,
+        "dirichlet": [DIRICHLET_ALPHA, DIRICHLET_EPSILON],
+        "temperature": [TEMP_MOVES, TEMPERATURE],
+        "start_positions": [START_POSITION_FRACTION, START_POSITION_MAX_CP],
+        "policy_version": POLICY_VERSION,
+        "model": model_digest(CHECKPOINT_MODEL),
+    }
 
 
+@telemetry.traced("self_play")
 def main():
-    seed_everything()
+    started = time.monotonic()
     model = load_model_or_none()
+    seed_everything()
     existing = read_json_list(SELF_PLAY_BUFFER)
     start_fens = load_balanced_start_fens()
     print(f"[self-play] loaded {len(start_fens)} balanced start positions")
     new_samples = []
+    batch_stats = []
 
     batch_size = max(1, SELF_PLAY_BATCH_SIZE)
-    for first_game_index in range(0, SELF_PLAY_GAMES, batch_size):
-        game_count = min(batch_size, SELF_PLAY_GAMES - first_game_index)
-        for samples in play_games(model, first_game_index, game_count, start_fens=start_fens):
+    checkpoint = RunCheckpoint(SELF_PLAY_CHECKPOINT, run_config(batch_size))
+    resumed = checkpoint.load()
+    start_game = 0
+    in_flight = []
+    if resumed is not None:
+        new_samples = resumed["samples"]
+        start_game = resumed["next_game"]
+        in_flight = resumed["games"]
+        set_rng_state(resumed["rng"])
+        print(
+            f"[self-play] resuming at game {start_game + 1} with {len(in_flight)} games in play "
+            f"and {len(new_samples)} samples already finished"
+        )
+
+    fixed_games = SELF_PLAY_GAMES
+    if SELF_PLAY_SECONDS > 0:
+        fixed_games = 0
+        deadline = started + SELF_PLAY_SECONDS - DEADLINE_MARGIN
+        print(f"[self-play] starting games for up to {max(0.0, deadline - time.monotonic()):.0f}s")
+        finished_before = list(new_samples)
+
+        def snapshot(next_game, games, completed):
+            if checkpoint.due():
+                checkpoint.save(next_game, finished_before + [sample for samples in completed for sample in samples], games)
+
+        with mcts_stats.collect("self_play_budget") as stats:
+            results = play_games_until(
+                model,
+                deadline,
+                batch_size,
+                start_fens=start_fens,
+                first_game_index=start_game,
+                games=in_flight,
+                on_ply=snapshot,
+            )
+        for samples in results:
             new_samples.extend(samples)
+        print(
+            f"[self-play] {len(results)} games, {sum(bool(samples) for samples in results)} kept, "
+            f"{time.monotonic() - started:.0f}s of a {SELF_PLAY_SECONDS:.0f}s budget"
+        )
+        if stats is not None:
+            batch_stats.append({"first_game": 0, "games": len(results), **stats.summary()})
+    for first_game_index in range(start_game, fixed_games, batch_size):
+        game_count = min(batch_size, fixed_games - first_game_index)
+        games = in_flight if first_game_index == start_game and in_flight else [
+            new_game(first_game_index + offset, start_fens) for offset in range(game_count)
+        ]
+
+        def snapshot(games, first_game_index=first_game_index):
+            if checkpoint.due():
+                checkpoint.save(first_game_index, new_samples, games)
+
+        with mcts_stats.collect(f"self_play_{first_game_index}") as stats:
+            for samples in play_out(model, games, on_ply=snapshot):
+                new_samples.extend(samples)
+        if checkpoint.due():
+            checkpoint.save(first_game_index + game_count, new_samples)
+        if stats is not None:
+            summary = {"first_game": first_game_index, "games": game_count, **stats.summary()}
+            batch_stats.append(summary)
+            print(
+                f"[self-play] games {first_game_index + 1}-{first_game_index + game_count}: "
+                f"{summary['nodes_per_second']:.0f} nodes/s, mean batch {summary['mean_batch_size']:.1f}, "
+                f"model share {summary['phase_share']['model_call']:.0%}"
+            )
+    if batch_stats:
+        write_json(SELF_PLAY_STATS, batch_stats)
 
     merged = existing + new_samples
     if len(merged) > MAX_BUFFER:
         merged = merged[-MAX_BUFFER:]
 
     write_json(SELF_PLAY_BUFFER, merged)
+    checkpoint.clear()
+    telemetry.add_items(len(new_samples))
     print(f"[self-play] saved {len(new_samples)} new samples, buffer now {len(merged)}")
 
 
@@ -0,0 +1,253 @@
+# ml/self_play_tuner.py
+"""
+Measure self-play throughput on this machine and recommend settings.
+
+Each trial runs in fresh worker processes, because TensorFlow thread pools
+cannot be resized after start-up. The workers play seeded games with the
+deterministic benchmark network for a fixed number of seconds. They report
+model-evaluated positions per second, searched plies (samples) per hour and
+peak RSS; arena trials time paired arena games the same way. The clock is
+checked after every ply, so a trial overruns its seconds by at most one ply.
+
+The sweep changes one knob at a time, keeping the best value so far: batch
+size, TensorFlow intra-op threads, inter-op threads, then worker processes.
+It finishes with a searches-per-move scaling curve at the chosen settings.
+It stops starting trials once AZ_TUNE_SECONDS would be exceeded.
+
+    python ml/self_play_tuner.py                # writes ml/data/tuning/
+"""
+import argparse
+import csv
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+TUNING_DIR = pathlib.Path(os.environ.get("AZ_TUNE_DIR", "ml/data/tuning"))
+TOTAL_SECONDS = float(os.environ.get("AZ_TUNE_SECONDS", "900"))
+TRIAL_SECONDS = float(os.environ.get("AZ_TUNE_TRIAL_SECONDS", "20"))
+TARGET_SEARCHES = int(os.environ.get("AZ_TUNE_SEARCHES", os.environ.get("AZ_MCTS_SEARCHES", "80")))
+TRIAL_MAX_PLIES = int(os.environ.get("AZ_TUNE_MAX_PLIES", "24"))
+MAX_RSS_MB = float(os.environ.get("AZ_TUNE_MAX_RSS_MB", "0"))
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+BATCH_SIZES = (1, 4, 8, 16, 32)
+SEARCH_CURVE = (16, 40, 80, 160, 320)
+CSV_FIELDS = (
+    "kind", "batch_size", "searches", "intra_threads", "inter_threads", "processes",
+    "seconds", "positions_per_second", "samples_per_hour", "peak_rss_mb",
+)
+
+
+def base_config() -> dict:
+    return {
+        "kind": "self_play",
+        "batch_size": int(os.environ.get("AZ_SELF_PLAY_BATCH_SIZE", "4")),
+        "searches": TARGET_SEARCHES,
+        "intra_threads": 1,
+        "inter_threads": 1,
+        "processes": 1,
+        "max_plies": TRIAL_MAX_PLIES,
+    }
+
+
+class _TrialOver(Exception):
+    pass
+
+
+def _count_values(limit: int) -> list[int]:
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def measure_trial(config: dict, seconds: float, seed: int = 0) -> dict:
+    """Run one trial in this process; thread settings only apply before TensorFlow starts."""
+    import resource
+
+    import tensorflow as tf
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(int(config["intra_threads"]))
+        tf.config.threading.set_inter_op_parallelism_threads(int(config["inter_threads"]))
+    except RuntimeError:
+        print("[tune] TensorFlow is already initialized; keeping its thread settings")
+
+    import benchmark
+    import mcts_stats
+    import self_play
+
+    saved = (self_play.MCTS_SEARCHES, self_play.MAX_PLIES)
+    self_play.MCTS_SEARCHES = int(config["searches"])
+    self_play.MAX_PLIES = int(config["max_plies"])
+    try:
+        self_play.seed_everything(seed)
+        model = benchmark.benchmark_model()
+        started = time.perf_counter()
+
+        def check_clock(_):
+            if time.perf_counter() - started >= seconds:
+                raise _TrialOver
+
+        first_game = 0
+        with mcts_stats.collect("tuner", enabled=True) as stats:
+            try:
+                while True:
+                    if config["kind"] == "arena":
+                        for plan in self_play.arena_game_plans(2, int(config["searches"]), int(config["max_plies"])):
+                            options = dict(plan)
+                            self_play.play_arena_game(
+                                model, model, options.pop("candidate_is_white"), on_ply=check_clock, **options
+                            )
+                    else:
+                        games = [
+                            self_play.new_game(first_game + offset, None)
+                            for offset in range(int(config["batch_size"]))
+                        ]
+                        self_play.play_out(model, games, on_ply=check_clock)
+                        first_game += len(games)
+            except _TrialOver:
+                pass
+    finally:
+        self_play.MCTS_SEARCHES, self_play.MAX_PLIES = saved
+    summary = stats.summary()
+    # Every searched ply evaluates its root, then one leaf per batch row.
+    plies = summary["searches"]
+    positions = summary["searches"] + sum(
+        int(size) * count for size, count in summary["batch_size_histogram"].items()
+    )
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "positions": positions,
+        "plies": plies,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_trial(config: dict, seconds: float) -> dict:
+    """Run `processes` workers side by side and add up their throughput."""
+    command = [sys.executable, str(pathlib.Path(__file__).resolve()), "--trial", json.dumps(config), "--seconds", str(seconds)]
+    environment = {**os.environ, "TF_CPP_MIN_LOG_LEVEL": "3", "CUDA_VISIBLE_DEVICES": "-1", "AZ_TELEMETRY": "0"}
+    workers = [
+        subprocess.Popen(command + ["--seed", str(index)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=environment)
+        for index in range(int(config["processes"]))
+    ]
+    reports = []
+    for worker in workers:
+        output, _ = worker.communicate()
+        if worker.returncode != 0:
+            raise RuntimeError(f"tuning worker failed with exit code {worker.returncode}")
+        reports.append(json.loads(output.strip().splitlines()[-1]))
+
+    wall = max(report["seconds"] for report in reports)
+    positions = sum(report["positions"] for report in reports)
+    plies = sum(report["plies"] for report in reports)
+    return {
+        **config,
+        "seconds": wall,
+        "positions_per_second": round(positions / wall, 2) if wall > 0 else 0.0,
+        "samples_per_hour": round(plies / wall * 3600, 1) if wall > 0 else 0.0,
+        "peak_rss_mb": round(sum(report["peak_rss_mb"] for report in reports), 1),
+    }
+
+
+def _fits(result: dict, max_rss_mb: float) -> bool:
+    return max_rss_mb <= 0 or result["peak_rss_mb"] <= max_rss_mb
+
+
+def sweep(trial=run_trial, total_seconds: float = TOTAL_SECONDS, trial_seconds: float = TRIAL_SECONDS,
+          max_rss_mb: float = MAX_RSS_MB, cpu_count: int = CPU_COUNT) -> tuple[dict, list[dict]]:
+    """Coordinate-wise search; returns (recommended config, every trial result)."""
+    deadline = time.monotonic() + total_seconds
+    results = []
+    best = base_config()
+    best_result = None
+
+    def attempt(config: dict) -> dict | None:
+        if time.monotonic() + trial_seconds * 1.5 > deadline:
+            return None
+        result = trial(config, trial_seconds)
+        results.append(result)
+        print(
+            f"[tune] {config['kind']} batch {config['batch_size']} searches {config['searches']} "
+            f"threads {config['intra_threads']}/{config['inter_threads']} processes {config['processes']}: "
+            f"{result['positions_per_second']:.0f} positions/s, {result['samples_per_hour']:.0f} samples/h, "
+            f"{result['peak_rss_mb']:.0f} MB"
+        )
+        return result
+
+    knobs = (
+        ("batch_size", BATCH_SIZES),
+        ("intra_threads", _count_values(cpu_count)),
+        ("inter_threads", (1, 2)),
+        ("processes", _count_values(cpu_count)),
+    )
+    for knob, values in knobs:
+        for value in values:
+            config = {**best, knob: value}
+            if best_result is not None and value == best[knob]:
+                continue
+            if config["processes"] * config["intra_threads"] > cpu_count and knob in ("intra_threads", "processes"):
+                continue
+            result = attempt(config)
+            if result is None:
+                break
+            if _fits(result, max_rss_mb) and (
+                best_result is None or result["samples_per_hour"] > best_result["samples_per_hour"]
+            ):
+                best, best_result = config, result
+
+    for searches in SEARCH_CURVE:
+        if attempt({**best, "searches": searches}) is None:
+            break
+    attempt({**best, "kind": "arena"})
+
+    recommended = {
+        "AZ_SELF_PLAY_BATCH_SIZE": best["batch_size"],
+        "AZ_MCTS_SEARCHES": best["searches"],
+        "TF_NUM_INTRAOP_THREADS": best["intra_threads"],
+        "TF_NUM_INTEROP_THREADS": best["inter_threads"],
+        "AZ_SELF_PLAY_WORKERS": best["processes"],
+        "expected_samples_per_hour": best_result["samples_per_hour"] if best_result else None,
+    }
+    return recommended, results
+
+
+def write_report(recommended: dict, results: list[dict], out_dir: pathlib.Path = TUNING_DIR) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    report = {
+        "created_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "cpu_count": CPU_COUNT,
+        "recommended": recommended,
+        "trials": results,
+    }
+    (out_dir / "self_play_tuning.json").write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    with (out_dir / "self_play_scaling.csv").open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.DictWriter(handle, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"[tune] recommended {json.dumps(recommended)}; wrote {out_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep self-play settings and recommend the fastest")
+    parser.add_argument("--trial", help=argparse.SUPPRESS)
+    parser.add_argument("--seconds", type=float, default=TRIAL_SECONDS, help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--out-dir", type=pathlib.Path, default=TUNING_DIR)
+    args = parser.parse_args()
+
+    if args.trial:
+        print(json.dumps(measure_trial(json.loads(args.trial), args.seconds, args.seed)))
+        return
+    recommended, results = sweep()
+    write_report(recommended, results, args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,41 @@ import json
 import math
 import os
 import pathlib
+import queue
+import threading
+import time
 
 import chess
 import chess.engine
 
+import telemetry
 from fen_utils import canonical_fen
+from label_store import open_store
 from policy_map import POLICY_VERSION, move_to_index
+from position_hash import fen_hash
 
 IN_FEN = pathlib.Path("ml/data/positions.fen")
 OUT_JSON = pathlib.Path("ml/data/labels.json")
 REPLAY_JSON = pathlib.Path("ml/data/replay_buffer.json")
+LABEL_LOG = pathlib.Path(os.environ.get("SF_LABEL_LOG", "ml/data/labels.log.jsonl"))
+LOG_FSYNC_EVERY = int(os.environ.get("SF_LOG_FSYNC_EVERY", "50"))
 STOCKFISH = os.environ.get("STOCKFISH_PATH", "stockfish")
 DEPTH = int(os.environ.get("SF_DEPTH", "12"))
 MULTIPV = int(os.environ.get("SF_MULTIPV", "3"))
+THREADS = int(os.environ.get("SF_THREADS", "1"))
+HASH_MB = int(os.environ.get("SF_HASH_MB", "16"))
+LEGACY_DEPTH = int(os.environ.get("SF_LEGACY_DEPTH", "12"))
+LEGACY_MULTIPV = int(os.environ.get("SF_LEGACY_MULTIPV", "3"))
+REFINE_SECONDS = float(os.environ.get("SF_REFINE_SECONDS", "0"))
+# SF_BUDGET_SECONDS > 0 replaces the fixed SF_DEPTH search of new positions
+# with time limits shared out of one wall-clock budget.
+BUDGET_SECONDS = float(os.environ.get("SF_BUDGET_SECONDS", "0"))
+MIN_DEPTH = int(os.environ.get("SF_MIN_DEPTH", "8"))
+STOP_GAP_CP = float(os.environ.get("SF_STOP_GAP_CP", "200"))
+EXTEND_GAP_CP = float(os.environ.get("SF_EXTEND_GAP_CP", "30"))
+EXTEND_FACTOR = float(os.environ.get("SF_EXTEND_FACTOR", "3"))
+MIN_POSITION_SECONDS = float(os.environ.get("SF_MIN_POSITION_SECONDS", "0.05"))
+ENGINES = int(os.environ.get("SF_ENGINES", str(max(1, (os.cpu_count() or 1) // max(1, THREADS)))))
 POLICY_TEMPERATURE_CP = float(os.environ.get("SF_POLICY_TEMPERATURE_CP", "120"))
 MATE_SCORE = 100000
 
@@ -36,30 +58,104 @@ def valid_policy(item: dict) -> bool:
     return False
 
 
-def read_cached_labels() -> dict[str, dict]:
-    if not REPLAY_JSON.exists():
-        return {}
-    try:
-        items = json.loads(REPLAY_JSON.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, OSError):
+def label_limits(item: dict) -> tuple[int, int]:
+    """Search depth and MultiPV a label was produced with; older labels get the legacy nightly limits."""
+    return int(item.get("depth", LEGACY_DEPTH)), int(item.get("multipv", LEGACY_MULTIPV))
+
+
+def required_depth() -> int:
+    return MIN_DEPTH if BUDGET_SECONDS > 0 else DEPTH
+
+
+def satisfies_limits(item: dict) -> bool:
+    if not valid_policy(item):
+        return False
+    depth, multipv = label_limits(item)
+    return depth >= required_depth() and multipv >= max(1, MULTIPV)
+
+
+def refinement_priority(item: dict) -> tuple:
+    # Shallowest first; among equals, the closest calls between the top two
+    # moves, where a deeper search is most likely to change the policy target.
+    depth, multipv = label_limits(item)
+    probabilities = sorted((float(entry[1]) for entry in item.get("policy", [])), reverse=True)
+    probabilities += [0.0, 0.0]
+    return depth, multipv, probabilities[0] - probabilities[1], item["fen"]
+
+
+def read_cached_labels(fens: list[str] | None = None) -> dict[str, dict]:
+    """Return replay-buffer labels, only those for `fens` when given."""
+    with open_store(REPLAY_JSON) as store:
+        if fens is None:
+            return {item["fen"]: item for item in store.labels()}
+        return store.get_many(fens)
+
+
+def read_label_log(path: pathlib.Path | None = None) -> dict[str, dict]:
+    """Return labels from the append-only log, ignoring a torn final line."""
+    path = LABEL_LOG if path is None else path
+    if not path.exists():
         return {}
+    labels = {}
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                item = json.loads(line)
+                fen = canonical_fen(item["fen"])
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                continue
+            if isinstance(item, dict) and valid_policy(item):
+                labels[fen] = {**item, "fen": fen}
+    return labels
 
-    cache = {}
-    for item in items if isinstance(items, list) else []:
-        fen = item.get("fen")
-        if not fen:
-            continue
-        try:
-            normalized_fen = canonical_fen(fen)
-            cache[normalized_fen] = {
-                "fen": normalized_fen,
-                "cp": float(item.get("cp", 0.0)),
-                "policy_version": int(item.get("policy_version", 1)),
-                "policy": item.get("policy", []),
-            }
-        except (TypeError, ValueError):
-            continue
-    return cache
+
+class LabelLog:
+    """Append finished labels as JSON lines, fsyncing every `fsync_every` entries."""
+
+    def __init__(self, path: pathlib.Path | None = None, fsync_every: int | None = None):
+        self.path = LABEL_LOG if path is None else path
+        self.fsync_every = max(1, LOG_FSYNC_EVERY if fsync_every is None else int(fsync_every))
+        self.pending = 0
+        self.handle = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        torn = False
+        if self.path.exists() and self.path.stat().st_size > 0:
+            with self.path.open("rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                torn = existing.read(1) != b"\n"
+        self.handle = self.path.open("a", encoding="utf-8")
+        if torn:
+            self.handle.write("\n")
+        return self
+
+    def append(self, label: dict) -> None:
+        self.handle.write(json.dumps(label, separators=(",", ":")) + "\n")
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.pending = 0
+
+    def __exit__(self, *exc_info):
+        self.sync()
+        self.handle.close()
+
+
+def compact_label_log(consolidated: set[str], path: pathlib.Path | None = None) -> int:
+    """Drop logged labels that labels.json now holds; returns how many entries are kept."""
+    path = LABEL_LOG if path is None else path
+    if not path.exists():
+        return 0
+    kept = [label for fen, label in read_label_log(path).items() if fen not in consolidated]
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text("".join(json.dumps(label, separators=(",", ":")) + "\n" for label in kept), encoding="utf-8")
+    os.replace(temporary, path)
+    return len(kept)
 
 
 def read_unique_fens() -> list[str]:
@@ -68,29 +164,86 @@ def read_unique_fens() -> list[str]:
     with IN_FEN.open(encoding="utf-8") as handle:
         for line in handle:
             fen = line.strip()
-            if not fen or fen in seen:
+            if not fen:
                 continue
             try:
+                if fen_hash(fen) in seen:
+                    continue
                 normalized_fen = canonical_fen(fen)
             except ValueError as exc:
                 print(f"[stockfish] skipped malformed FEN: {exc}")
                 continue
-            if normalized_fen in seen:
+            key = fen_hash(normalized_fen)
+            if key in seen:
                 continue
-            seen.add(normalized_fen)
+            seen.add(key)
             unique.append(normalized_fen)
     return unique
 
 
-def analyse_position(engine: chess.engine.SimpleEngine, fen: str) -> dict:
-    board = chess.Board(fen)
-    infos = engine.analyse(
-        board,
-        chess.engine.Limit(depth=DEPTH),
-        multipv=max(1, MULTIPV),
+class SearchBudget:
+    """Share a wall-clock budget between the positions that have not started yet."""
+
+    def __init__(self, seconds: float, positions: int, engines: int):
+        self.deadline = time.monotonic() + seconds
+        self.remaining = max(1, positions)
+        self.engines = max(1, engines)
+        self.lock = threading.Lock()
+
+    def allowance(self) -> float:
+        with self.lock:
+            seconds = (self.deadline - time.monotonic()) * self.engines / max(1, self.remaining)
+            self.remaining -= 1
+        return max(MIN_POSITION_SECONDS, seconds)
+
+
+def _search_depth(infos: list[dict]) -> int:
+    return min((int(info["depth"]) for info in infos if info.get("depth") is not None), default=0)
+
+
+def _score_gap(board: chess.Board, infos: list[dict]) -> float:
+    scores = sorted(
+        (info["score"].pov(board.turn).score(mate_score=MATE_SCORE) or 0 for info in infos if info.get("score")),
+        reverse=True,
     )
+    return float(scores[0] - scores[1]) if len(scores) > 1 else math.inf
+
+
+def budgeted_infos(engine: chess.engine.SimpleEngine, board: chess.Board, seconds: float) -> list[dict]:
+    """
+    Search for about `seconds`: stop at SF_MIN_DEPTH when the best line leads by
+    SF_STOP_GAP_CP, and run up to SF_EXTEND_FACTOR times longer while the top
+    lines stay within SF_EXTEND_GAP_CP.
+    """
+    started = time.monotonic()
+    limit = chess.engine.Limit(time=max(MIN_POSITION_SECONDS, seconds * max(1.0, EXTEND_FACTOR)))
+    with engine.analysis(board, limit, multipv=max(1, MULTIPV)) as analysis:
+        for _ in analysis:
+            infos = [info for info in analysis.multipv if info.get("pv") and info.get("score")]
+            if not infos or _search_depth(infos) < MIN_DEPTH:
+                continue
+            gap = _score_gap(board, infos)
+            spent = time.monotonic() - started >= seconds
+            if gap >= STOP_GAP_CP or (spent and gap >= EXTEND_GAP_CP):
+                analysis.stop()
+                break
+        analysis.wait()
+        return [dict(info) for info in analysis.multipv]
+
+
+def analyse_position(engine: chess.engine.SimpleEngine, fen: str, budget: SearchBudget | None = None) -> dict:
+    board = chess.Board(fen)
+    if budget is None:
+        infos = engine.analyse(
+            board,
+            chess.engine.Limit(depth=DEPTH),
+            multipv=max(1, MULTIPV),
+        )
+    else:
+        infos = budgeted_infos(engine, board, budget.allowance())
     if isinstance(infos, dict):
         infos = [infos]
+    depth = _search_depth(infos) or DEPTH
 
     candidates = []
     for info in infos:
@@ -116,36 +269,192 @@ def analyse_position(engine: chess.engine.SimpleEngine, fen: str) -> dict:
         "cp": best_score,
         "policy_version": POLICY_VERSION,
         "policy": policy,
+        "depth": depth,
+        "multipv": max(1, MULTIPV),
     }
 
 
+LABEL_ERRORS = (chess.engine.EngineError, chess.engine.EngineTerminatedError, ValueError)
+
+
+def open_engine(command=None) -> chess.engine.SimpleEngine:
+    engine = chess.engine.SimpleEngine.popen_uci(command or STOCKFISH)
+    options = {"Threads": max(1, THREADS), "Hash": max(1, HASH_MB)}
+    engine.configure({name: value for name, value in options.items() if name in engine.options})
+    return engine
+
+
+def _close_engine(engine) -> None:
+    if engine is None:
+        return
+    try:
+        engine.quit()
+    except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError):
+        engine.close()
+
+
+def _engine_worker(engine, command, tasks: queue.Queue, results: queue.Queue, budget=None) -> None:
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, fen = task
+            for attempt in range(2):
+                try:
+                    if engine is None:
+                        engine = open_engine(command)
+                    results.put((index, fen, analyse_position(engine, fen, budget)))
+                    break
+                except chess.engine.EngineTerminatedError as exc:
+                    # Restart the crashed process and give the position one more try.
+                    _close_engine(engine)
+                    engine = None
+                    if attempt:
+                        results.put((index, fen, exc))
+                except Exception as exc:
+                    results.put((index, fen, exc))
+                    break
+    finally:
+        _close_engine(engine)
+
+
+def label_positions(fens: list[str], engines: int | None = None, command=None, budget_seconds: float = 0.0):
+    """
+    Yield (index, fen, label or exception) as analyses finish.
+
+    Positions are spread over several engine processes, each driven by its own
+    thread. Results arrive in completion order; index refers to `fens`. With
+    `budget_seconds` the engines share that wall-clock budget instead of
+    searching every position to SF_DEPTH.
+    """
+    fens = list(fens)
+    if not fens:
+        return
+    count = max(1, min(ENGINES if engines is None else int(engines), len(fens)))
+    opened = []
+    try:
+        for _ in range(count):
+            opened.append(open_engine(command))
+    except BaseException:
+        for engine in opened:
+            _close_engine(engine)
+        raise
+
+    budget = SearchBudget(budget_seconds, len(fens), count) if budget_seconds > 0 else None
+    tasks = queue.Queue()
+    results = queue.Queue()
+    for task in enumerate(fens):
+        tasks.put(task)
+    for _ in opened:
+        tasks.put(None)
+    workers = [
+        threading.Thread(target=_engine_worker, args=(engine, command, tasks, results, budget), daemon=True)
+        for engine in opened
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for _ in fens:
+            yield results.get()
+    finally:
+        # Stop early when the caller abandons the generator.
+        while True:
+            try:
+                tasks.get_nowait()
+            except queue.Empty:
+                break
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+
+def write_labels(data: list[dict]) -> None:
+    OUT_JSON.parent.mkdir(parents=True, exist_ok=True)
+    temporary = OUT_JSON.with_name(f".{OUT_JSON.name}.tmp")
+    temporary.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+    os.replace(temporary, OUT_JSON)
+
+
+def refinement_candidates(exclude: set[str], overrides: dict[str, dict]) -> list[str]:
+    """Replay-buffer positions whose labels are shallower than SF_DEPTH/SF_MULTIPV, in refinement order."""
+    with open_store(REPLAY_JSON) as store:
+        shallow = store.shallow_labels(max(1, required_depth()), max(1, MULTIPV), LEGACY_DEPTH, LEGACY_MULTIPV)
+    labels = [overrides.get(item["fen"], item) for item in shallow if item["fen"] not in exclude]
+    return [item["fen"] for item in sorted(labels, key=refinement_priority) if not satisfies_limits(item)]
+
+
+def analyse_into(
+    fens: list[str],
+    labels: dict[str, dict],
+    log: LabelLog,
+    kind: str,
+    deadline=None,
+    budget_seconds: float = 0.0,
+) -> None:
+    depths = []
+    started = time.monotonic()
+    for completed, (index, fen, result) in enumerate(label_positions(fens, budget_seconds=budget_seconds), start=1):
+        if isinstance(result, LABEL_ERRORS):
+            print(f"[stockfish] failed {kind} position {index + 1}/{len(fens)}: {result}")
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            labels[fen] = result
+            log.append(result)
+            depths.append(result["depth"])
+        if completed % 200 == 0:
+            print(f"[stockfish] evaluated {completed}/{len(fens)} {kind} positions")
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"[stockfish] refinement budget spent after {completed}/{len(fens)} positions")
+            break
+    if depths:
+        print(
+            f"[stockfish] {kind}: {len(depths)} labels in {time.monotonic() - started:.1f}s, achieved depth "
+            f"min {min(depths)}, mean {sum(depths) / len(depths):.1f}, max {max(depths)}"
+        )
+
+
+@telemetry.traced("stockfish_label")
 def main():
     fens = read_unique_fens()
-    cache = read_cached_labels()
-    missing = [fen for fen in fens if fen not in cache or not valid_policy(cache[fen])]
-    print(f"[stockfish] positions {len(fens)}, cache hits {len(fens) - len(missing)}, new {len(missing)}")
+    wanted = set(fens)
+    cache = read_cached_labels(fens)
+    logged = read_label_log()
+    cache.update((fen, label) for fen, label in logged.items() if fen in wanted)
+    # The log only holds labels that never reached labels.json (compact_label_log
+    # drops the rest), so these are refinements from an interrupted run.
+    refined = {fen: label for fen, label in logged.items() if fen not in wanted and satisfies_limits(label)}
+    missing = [fen for fen in fens if fen not in cache or not satisfies_limits(cache[fen])]
+    print(
+        f"[stockfish] positions {len(fens)}, cache hits {len(fens) - len(missing)} "
+        f"({len(logged)} logged), new or shallow {len(missing)}, depth {required_depth()}, multipv {MULTIPV}"
+    )
 
-    if missing:
-        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH)
-        try:
-            for index, fen in enumerate(missing, start=1):
-                try:
-                    cache[fen] = analyse_position(engine, fen)
-                except (chess.engine.EngineError, chess.engine.EngineTerminatedError, ValueError) as exc:
-                    print(f"[stockfish] failed position {index}/{len(missing)}: {exc}")
-                    continue
-                if index % 200 == 0:
-                    print(f"[stockfish] evaluated {index}/{len(missing)} new positions")
-        finally:
-            engine.quit()
+    if missing or REFINE_SECONDS > 0:
+        print(f"[stockfish] engines {ENGINES}, threads {THREADS}, hash {HASH_MB} MB")
+        with LabelLog() as log:
+            # A failed deeper search keeps the shallower cached label.
+            if BUDGET_SECONDS > 0:
+                print(f"[stockfish] wall-clock budget {BUDGET_SECONDS:.0f}s for {len(missing)} positions")
+            analyse_into(missing, cache, log, "new", budget_seconds=BUDGET_SECONDS)
+            if REFINE_SECONDS > 0:
+                candidates = refinement_candidates(wanted, logged)
+                print(f"[stockfish] refining up to {len(candidates)} shallow labels for {REFINE_SECONDS:.0f}s")
+                analyse_into(candidates, refined, log, "refined", time.monotonic() + REFINE_SECONDS)
 
     data = [cache[fen] for fen in fens if fen in cache and valid_policy(cache[fen])]
     if not data:
         raise RuntimeError("Stockfish evaluation produced no labels")
 
-    OUT_JSON.parent.mkdir(parents=True, exist_ok=True)
-    OUT_JSON.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
-    print(f"[stockfish] wrote {len(data)} labels to {OUT_JSON}")
+    # Refined replay labels ride along; train.py merges them over the older ones.
+    data += refined.values()
+    write_labels(data)
+    compact_label_log({label["fen"] for label in data})
+    telemetry.add_items(len(data))
+    print(f"[stockfish] wrote {len(data)} labels ({len(refined)} refined) to {OUT_JSON}")
 
 
 if __name__ == "__main__":
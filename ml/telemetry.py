@@ -0,0 +1,296 @@
+# ml/telemetry.py
+"""
+Stage timing and peak-memory telemetry for the ml entry points.
+
+span() and the traced() decorator append one JSON line per finished stage to
+AZ_TELEMETRY_LOG. Each line holds wall and CPU seconds (including waited-for
+child processes such as Stockfish), the peak RSS reached during the span, and
+the number of items processed. `python ml/telemetry.py` folds the log into
+the latest training_history.json record and flags stages slower or larger
+than the rolling median of earlier runs. AZ_TELEMETRY=0 turns spans into
+no-ops.
+"""
+import contextlib
+import datetime as dt
+import functools
+import json
+import os
+import pathlib
+import statistics
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENABLED = os.environ.get("AZ_TELEMETRY", "1") == "1"
+TELEMETRY_LOG = pathlib.Path(os.environ.get("AZ_TELEMETRY_LOG", "ml/data/telemetry.jsonl"))
+TRAINING_HISTORY = pathlib.Path("ml/training_history.json")
+# Spans from all entry points of one nightly job share this id.
+RUN_ID = os.environ.get("AZ_TELEMETRY_RUN_ID") or os.environ.get("GITHUB_RUN_ID") or dt.date.today().isoformat()
+REGRESSION_WINDOW = int(os.environ.get("AZ_TELEMETRY_WINDOW", "7"))
+REGRESSION_RATIO = float(os.environ.get("AZ_TELEMETRY_REGRESSION_RATIO", "1.25"))
+MIN_REGRESSION_SECONDS = float(os.environ.get("AZ_TELEMETRY_MIN_SECONDS", "5"))
+MIN_REGRESSION_MB = float(os.environ.get("AZ_TELEMETRY_MIN_MB", "64"))
+
+_stack = []
+_STATUS = pathlib.Path("/proc/self/status")
+_CLEAR_REFS = pathlib.Path("/proc/self/clear_refs")
+
+
+def _status_kb(field: str) -> int | None:
+    try:
+        for line in _STATUS.read_text(encoding="ascii").splitlines():
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak() -> bool:
+    """Restart the kernel's high-water mark (VmHWM) at the current RSS; Linux only."""
+    try:
+        _CLEAR_REFS.write_text("5", encoding="ascii")
+    except OSError:
+        return False
+    return True
+
+
+def _fold_peak() -> None:
+    # Open spans keep the highest VmHWM seen so far, so an inner span's reset
+    # does not hide memory its parents used before it started.
+    peak = _status_kb("VmHWM")
+    if peak is None:
+        return
+    for open_span in _stack:
+        if open_span.peak_kb is not None:
+            open_span.peak_kb = max(open_span.peak_kb, peak)
+
+
+def _peak_rss_mb(who) -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class Span:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.items = None
+        # Highest RSS in kB while the span is open; None when it cannot be measured.
+        self.peak_kb = None
+        self.lifetime_peak_mb = None
+
+    def start_peak(self) -> None:
+        _fold_peak()
+        rss = _status_kb("VmRSS")
+        if rss is not None and _reset_peak():
+            self.peak_kb = rss
+        elif resource is not None:
+            self.lifetime_peak_mb = _peak_rss_mb(resource.RUSAGE_SELF)
+
+    def peak_rss_mb(self) -> float | None:
+        if self.peak_kb is not None:
+            _fold_peak()
+            return round(self.peak_kb / 1024, 1)
+        # Without a resettable high-water mark, the lifetime peak only belongs
+        # to this span if it rose while the span was open.
+        peak = _peak_rss_mb(resource.RUSAGE_SELF) if resource is not None else None
+        if peak is None or self.lifetime_peak_mb is None or peak <= self.lifetime_peak_mb:
+            return None
+        return peak
+
+    def add_items(self, count: int) -> None:
+        self.items = (self.items or 0) + int(count)
+
+
+def add_items(count: int) -> None:
+    """Credit processed items to the innermost open span."""
+    if _stack:
+        _stack[-1].add_items(count)
+
+
+def write_event(event: dict, path: pathlib.Path | None = None) -> None:
+    path = TELEMETRY_LOG if path is None else path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # One short O_APPEND write per line keeps concurrent stages from interleaving.
+    with path.open("a", encoding="utf-8") as handle:
+        handle.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+
+@contextlib.contextmanager
+def span(stage: str, items: int | None = None, enabled: bool | None = None):
+    enabled = ENABLED if enabled is None else enabled
+    current = Span(stage)
+    if items is not None:
+        current.add_items(items)
+    if not enabled:
+        yield current
+        return
+    parent = _stack[-1].stage if _stack else None
+    current.start_peak()
+    _stack.append(current)
+    started_utc = dt.datetime.now(dt.UTC).isoformat()
+    started = time.perf_counter()
+    cpu_started = _cpu_seconds()
+    status = "error"
+    try:
+        yield current
+        status = "ok"
+    finally:
+        peak_rss_mb = current.peak_rss_mb()
+        _stack.pop()
+        wall = time.perf_counter() - started
+        event = {
+            "run_id": RUN_ID,
+            "stage": stage,
+            "parent": parent,
+            "entry": pathlib.Path(sys.argv[0]).name if sys.argv and sys.argv[0] else None,
+            "pid": os.getpid(),
+            "started_utc": started_utc,
+            "status": status,
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(_cpu_seconds() - cpu_started, 3),
+            "peak_rss_mb": peak_rss_mb,
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "items": current.items,
+        }
+        if current.items is not None and wall > 0:
+            event["items_per_second"] = round(current.items / wall, 2)
+        try:
+            write_event(event)
+        except OSError as exc:
+            print(f"[telemetry] could not write {TELEMETRY_LOG}: {exc}")
+
+
+def traced(stage: str):
+    """Decorator form of span() for entry-point main functions."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def read_events(path: pathlib.Path | None = None) -> list[dict]:
+    path = TELEMETRY_LOG if path is None else path
+    if not path.exists():
+        return []
+    events = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(event, dict) and event.get("stage"):
+            events.append(event)
+    return events
+
+
+def summarize_events(events: list[dict]) -> dict[str, dict]:
+    """Per-stage totals: wall and CPU seconds and items summed, peak RSS maximized."""
+    stages = {}
+    for event in events:
+        summary = stages.setdefault(
+            event["stage"],
+            {"runs": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": None, "items": None, "errors": 0},
+        )
+        summary["runs"] += 1
+        summary["errors"] += event.get("status") != "ok"
+        summary["wall_seconds"] = round(summary["wall_seconds"] + float(event.get("wall_seconds") or 0.0), 3)
+        summary["cpu_seconds"] = round(summary["cpu_seconds"] + float(event.get("cpu_seconds") or 0.0), 3)
+        peaks = [value for value in (summary["peak_rss_mb"], event.get("peak_rss_mb")) if value is not None]
+        summary["peak_rss_mb"] = max(peaks) if peaks else None
+        if event.get("items") is not None:
+            summary["items"] = (summary["items"] or 0) + int(event["items"])
+    for summary in stages.values():
+        if summary["items"] is not None and summary["wall_seconds"] > 0:
+            summary["items_per_second"] = round(summary["items"] / summary["wall_seconds"], 2)
+    return stages
+
+
+def find_regressions(current: dict[str, dict], previous: list[dict[str, dict]]) -> list[dict]:
+    """Stages whose wall time or peak RSS exceed REGRESSION_RATIO times the median of earlier runs."""
+    regressions = []
+    for stage, summary in sorted(current.items()):
+        for metric, floor in (("wall_seconds", MIN_REGRESSION_SECONDS), ("peak_rss_mb", MIN_REGRESSION_MB)):
+            history = [
+                run[stage][metric]
+                for run in previous[-REGRESSION_WINDOW:]
+                if stage in run and run[stage].get(metric) is not None
+            ]
+            value = summary.get(metric)
+            if value is None or not history:
+                continue
+            median = statistics.median(history)
+            if value > median * REGRESSION_RATIO and value - median > floor:
+                regressions.append({
+                    "stage": stage,
+                    "metric": metric,
+                    "value": value,
+                    "median": median,
+                    "ratio": round(value / median, 3) if median else None,
+                })
+    return regressions
+
+
+def fold_into_history(
+    history_path: pathlib.Path = TRAINING_HISTORY,
+    log_path: pathlib.Path | None = None,
+) -> list[dict]:
+    """Attach the logged spans to the latest history record, clear the log and return any regressions."""
+    log_path = TELEMETRY_LOG if log_path is None else log_path
+    events = read_events(log_path)
+    if not events:
+        print("[telemetry] no spans to fold")
+        return []
+    try:
+        records = json.loads(history_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        records = []
+    if not isinstance(records, list) or not records:
+        print(f"[telemetry] {history_path} has no record to attach {len(events)} spans to")
+        return []
+
+    current = summarize_events(events)
+    previous = [record["telemetry"] for record in records[:-1] if isinstance(record.get("telemetry"), dict)]
+    regressions = find_regressions(current, previous)
+    records[-1]["telemetry"] = current
+    records[-1]["telemetry_run_ids"] = sorted({str(event.get("run_id")) for event in events})
+    records[-1]["telemetry_regressions"] = regressions
+    history_path.write_text(json.dumps(records, separators=(",", ":")), encoding="utf-8")
+    log_path.unlink()
+
+    width = max(len(stage) for stage in current)
+    for stage, summary in sorted(current.items(), key=lambda item: -item[1]["wall_seconds"]):
+        rss = f"{summary['peak_rss_mb']:.0f} MB" if summary["peak_rss_mb"] is not None else "n/a"
+        print(f"[telemetry] {stage:<{width}}  {summary['wall_seconds']:9.1f}s  cpu {summary['cpu_seconds']:9.1f}s  peak {rss}")
+    for regression in regressions:
+        print(
+            f"[telemetry] regression: {regression['stage']} {regression['metric']} "
+            f"{regression['value']} vs median {regression['median']}"
+        )
+    return regressions
+
+
+def main():
+    fold_into_history()
+
+
+if __name__ == "__main__":
+    main()
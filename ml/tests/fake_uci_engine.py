@@ -0,0 +1,61 @@
+"""
+Scripted UCI engine for Stockfish labeling tests.
+
+Legal moves are ranked by UCI string; the n-th move scores 40 - 25 * n
+centipawns at every depth. Searches without a depth limit report depth 20. FAKE_UCI_CRASH_ONCE names a marker file: the first
+search that finds it missing creates it and exits without answering.
+"""
+import os
+import pathlib
+import sys
+
+import chess
+
+
+def main() -> None:
+    board = chess.Board()
+    multipv = 1
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "uci":
+            print("id name FakeFish")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "setoption" and tokens[2:3] == ["MultiPV"]:
+            multipv = int(tokens[4])
+        elif command == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+                rest = tokens[2:]
+            else:
+                end = tokens.index("moves") if "moves" in tokens else len(tokens)
+                board = chess.Board(" ".join(tokens[2:end]))
+                rest = tokens[end:]
+            for move in rest[1:]:
+                board.push_uci(move)
+        elif command == "go":
+            crash_marker = os.environ.get("FAKE_UCI_CRASH_ONCE")
+            if crash_marker and not pathlib.Path(crash_marker).exists():
+                pathlib.Path(crash_marker).write_text("crashed", encoding="utf-8")
+                sys.stdout.flush()
+                os._exit(1)
+            depth = int(tokens[tokens.index("depth") + 1]) if "depth" in tokens else 20
+            moves = sorted(move.uci() for move in board.legal_moves)
+            for current in range(1, depth + 1):
+                for rank, move in enumerate(moves[:multipv], start=1):
+                    print(f"info depth {current} multipv {rank} score cp {40 - 25 * (rank - 1)} nodes {current * 100} pv {move}")
+            print(f"bestmove {moves[0]}" if moves else "bestmove (none)")
+        elif command == "quit":
+            return
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
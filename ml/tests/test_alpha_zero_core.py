@@ -1,5 +1,7 @@
 import json
 import pathlib
+import random
+import subprocess
 import sys
 import tempfile
 import unittest
@@ -13,8 +15,10 @@ ML_DIR = pathlib.Path(__file__).resolve().parents[1]
 if str(ML_DIR) not in sys.path:
     sys.path.insert(0, str(ML_DIR))
 
+import dataset
 import features
 import fen_utils
+import mcts_stats
 import policy_map
 import self_play
 import stockfish_eval
@@ -40,6 +44,29 @@ class PolicyMapTests(unittest.TestCase):
         normalized = policy_map.normalize_policy_index(legacy, board, policy_version=1)
         self.assertEqual(policy_map.index_to_move(normalized), chess.Move.from_uci("a7a8q"))
 
+    def test_compact_action_space_covers_legal_moves(self):
+        self.assertEqual(policy_map.POLICY_SIZE, 1968)
+        for fen in (
+            chess.STARTING_FEN,
+            "r3k2r/1P4P1/8/8/8/8/1p4p1/R3K2R w KQkq - 0 1",
+            "r3k2r/1P4P1/8/8/8/8/1p4p1/R3K2R b KQkq - 0 1",
+        ):
+            board = chess.Board(fen)
+            indices = [policy_map.move_to_index(move) for move in board.legal_moves]
+            self.assertEqual(len(set(indices)), board.legal_moves.count())
+            self.assertEqual([policy_map.index_to_move(index) for index in indices], list(board.legal_moves))
+
+    def test_version_two_indices_migrate_to_compact_actions(self):
+        board = chess.Board("8/P7/8/8/8/8/8/k6K w - - 0 1")
+        for uci, channel in (("h1g2", 0), ("a7a8", 0), ("a7a8n", 1)):
+            move = chess.Move.from_uci(uci)
+            v2_index = (move.from_square * 64 + move.to_square) * policy_map.POLICY_CHANNELS + channel
+            normalized = policy_map.normalize_policy_index(v2_index, board, policy_version=2)
+            expected = move if move.promotion or uci != "a7a8" else chess.Move.from_uci("a7a8q")
+            self.assertEqual(policy_map.index_to_move(normalized), expected)
+        with self.assertRaises(ValueError):
+            policy_map.normalize_policy_index(chess.A1 * 64 * 5 + chess.B4 * 5, board, policy_version=2)
+
 
 class FeatureTests(unittest.TestCase):
     def test_feature_shape_and_castling_rights(self):
@@ -141,6 +168,53 @@ class DataPipelineTests(unittest.TestCase):
         _, _, _, _, fixed_value_weights = train_fixed_eval.fixed_eval_arrays(fixed_samples)
         self.assertEqual(fixed_value_weights.tolist(), [0.0, 1.0])
 
+    def test_parallel_sample_encoding_matches_serial_order(self):
+        board = chess.Board()
+        samples = []
+        for uci in ("e2e4", "e7e5", "g1f3", "b8c6", "f1b5"):
+            move = chess.Move.from_uci(uci)
+            policy = [[policy_map.move_to_index(move), 1.0]]
+            fen = board.fen(en_passant="fen")
+            version = policy_map.POLICY_VERSION
+            samples.append({"source": "self_play", "fen": fen, "policy_version": version, "policy": policy, "z": 1})
+            samples.append({"source": "stockfish", "fen": fen, "cp": 35, "policy_version": version, "policy": policy})
+            board.push(move)
+        samples.insert(3, {"source": "self_play", "fen": chess.STARTING_FEN, "policy": [], "z": 1})
+
+        serial = dataset.encode_samples(samples, shuffle=random.Random(7).shuffle, workers=1)
+        parallel = dataset.encode_samples(samples, shuffle=random.Random(7).shuffle, workers=3, chunk_size=2)
+
+        self.assertEqual(len(serial[0]), 10)
+        self.assertNotIn(3, serial[5].tolist())
+        for expected, actual in zip(serial, parallel):
+            np.testing.assert_array_equal(expected, actual)
+        self.assertEqual(
+            dataset.normalize_labels(samples, workers=1),
+            dataset.map_chunks(dataset._normalize_label_chunk, samples, workers=3, chunk_size=2),
+        )
+
+
+class ImportTests(unittest.TestCase):
+    def test_data_and_search_modules_import_without_tensorflow(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            loaded = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys; sys.path.insert(0, sys.argv[1]); "
+                    "import dataset, features, policy_map, label_store, self_play, train, train_fixed_eval; "
+                    "print('tensorflow' in sys.modules)",
+                    str(ML_DIR),
+                ],
+                cwd=tmp,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            created = list(pathlib.Path(tmp).iterdir())
+        self.assertEqual("False", loaded.stdout.strip())
+        self.assertEqual([], created)
+
 
 class SearchAndModelTests(unittest.TestCase):
     def test_terminal_value_uses_side_to_move_perspective(self):
@@ -155,6 +229,29 @@ class SearchAndModelTests(unittest.TestCase):
         self.assertEqual(int(model.outputs[1].shape[-1]), 1)
         self.assertTrue(train.is_dual_head_model(model))
 
+    def test_version_two_checkpoint_migrates_policy_columns(self):
+        import tensorflow as tf
+
+        inputs = tf.keras.Input(shape=(8, 8, features.PLANES), name="board")
+        x = tf.keras.layers.Conv2D(64, 3, padding="same", activation="relu", name="trunk_conv_1")(inputs)
+        x = tf.keras.layers.Conv2D(64, 3, padding="same", activation="relu", name="trunk_conv_2")(x)
+        x = tf.keras.layers.Flatten(name="trunk_flatten")(x)
+        x = tf.keras.layers.Dense(256, activation="relu", name="trunk_dense")(x)
+        policy = tf.keras.layers.Dense(policy_map.V2_POLICY_SIZE, name="policy_logits")(x)
+        value = tf.keras.layers.Dense(1, activation="tanh", name="value")(x)
+        legacy = tf.keras.Model(inputs, [policy, value])
+
+        migrated = train.migrate_legacy_model(legacy, train.CONTINUE_LR)
+
+        self.assertTrue(train.is_dual_head_model(migrated))
+        board = features.board_to_features(chess.STARTING_FEN).reshape(1, 8, 8, features.PLANES)
+        old_logits, old_value = (np.asarray(output) for output in legacy(board))
+        new_logits, new_value = (np.asarray(output) for output in migrated(board))
+        move = chess.Move.from_uci("e2e4")
+        v2_index = (move.from_square * 64 + move.to_square) * policy_map.POLICY_CHANNELS
+        self.assertAlmostEqual(float(new_logits[0, policy_map.move_to_index(move)]), float(old_logits[0, v2_index]), 5)
+        self.assertAlmostEqual(float(new_value[0, 0]), float(old_value[0, 0]), 5)
+
     def test_candidate_gate_fails_closed(self):
         self.assertEqual(
             train.should_accept_candidate(None, {"loss": 1.0}, resumed=True),
@@ -207,6 +304,154 @@ class SearchAndModelTests(unittest.TestCase):
             self.assertEqual(set(policy), legal_indices)
             self.assertAlmostEqual(sum(policy.values()), 1.0)
 
+    def test_search_stats_are_opt_in_and_do_not_change_results(self):
+        class ZeroModel:
+            def __call__(self, features_batch, training=False):
+                batch_size = len(features_batch)
+                return [
+                    np.zeros((batch_size, policy_map.POLICY_SIZE), dtype=np.float32),
+                    np.zeros((batch_size, 1), dtype=np.float32),
+                ]
+
+        boards = [chess.Board(), chess.Board("8/8/8/3k4/8/4K3/4P3/8 w - - 0 1")]
+        with mcts_stats.collect(enabled=False) as disabled:
+            self.assertIsNone(mcts_stats.active())
+            expected = self_play.run_search_batch(ZeroModel(), boards, searches=3, add_noise=False)
+        self.assertIsNone(disabled)
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(mcts_stats, "PROFILE_DIR", pathlib.Path(tmp)):
+            with mock.patch.object(mcts_stats, "PROFILER", "cprofile"), mcts_stats.collect("unit", enabled=True) as stats:
+                policies = self_play.run_search_batch(ZeroModel(), boards, searches=3, add_noise=False)
+            profiles = list(pathlib.Path(tmp).glob("unit-*.prof"))
+        self.assertIsNone(mcts_stats.active())
+        self.assertEqual(expected, policies)
+        self.assertEqual(1, len(profiles))
+
+        summary = stats.summary()
+        self.assertEqual(2, summary["searches"])
+        self.assertEqual(6, summary["simulations"])
+        self.assertEqual({"2": 3}, summary["batch_size_histogram"])
+        self.assertEqual(2.0, summary["mean_batch_size"])
+        self.assertEqual(set(mcts_stats.PHASES), set(summary["phase_seconds"]))
+        self.assertGreater(summary["phase_seconds"]["model_call"], 0.0)
+        self.assertGreater(summary["nodes_created"], 2 + 20 + 5)
+        self.assertEqual(summary["nodes_created"] / 2, summary["mean_tree_nodes"])
+
+    def test_budgeted_self_play_refills_until_the_deadline_then_adjudicates(self):
+        class ConstantModel:
+            def __init__(self, value):
+                self.value = value
+
+            def __call__(self, features_batch, training=False):
+                batch_size = len(features_batch)
+                return [
+                    np.zeros((batch_size, policy_map.POLICY_SIZE), dtype=np.float32),
+                    np.full((batch_size, 1), self.value, dtype=np.float32),
+                ]
+
+        def play(value):
+            ticks = iter(range(1000))
+            np.random.seed(0)
+            random.seed(0)
+            with mock.patch.object(self_play, "MAX_PLIES", 4), mock.patch.object(self_play, "EXPECTED_GAME_PLIES", 3):
+                with mock.patch.object(self_play, "MCTS_SEARCHES", 2), mock.patch("builtins.print"):
+                    return self_play.play_games_until(ConstantModel(value), 14, 2, clock=lambda: next(ticks))
+
+        # Each batched ply takes one tick. The first pair hits the ply limit at tick 8, a second pair
+        # is projected to finish by 12, and it is cut off after three plies at the deadline.
+        undecided = play(0.0)
+        self.assertEqual([[], [], [], []], undecided)
+
+        adjudicated = play(0.95)
+        self.assertEqual([[], []], adjudicated[:2])
+        for samples in adjudicated[2:]:
+            self.assertEqual(3, len(samples))
+            self.assertEqual({"adjudicated"}, {sample["termination"] for sample in samples})
+            # Black is to move after three plies, so the value favours black.
+            self.assertEqual([-1.0, 1.0, -1.0], [sample["z"] for sample in samples])
+
+    def test_cached_holdout_streams_the_same_metrics_as_whole_set_evaluation(self):
+        import tensorflow as tf
+
+        board = chess.Board()
+        samples = []
+        for ply, uci in enumerate(("e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6", "b5a4")):
+            moves = list(board.legal_moves)[:3]
+            policy = [[policy_map.move_to_index(move), 1.0 / len(moves)] for move in moves]
+            fen = board.fen(en_passant="fen")
+            version = policy_map.POLICY_VERSION
+            if ply % 2:
+                samples.append({"source": "stockfish", "fen": fen, "cp": 40 * ply, "policy_version": version, "policy": policy})
+            else:
+                samples.append({"source": "self_play", "fen": fen, "policy_version": version, "policy": policy, "z": 1})
+            board.push_uci(uci)
+        tf.keras.utils.set_random_seed(3)
+        candidate = train.build_model()
+        baseline = train.build_model()
+
+        with mock.patch("builtins.print"):
+            X, P, V, PW, VW = train_fixed_eval.fixed_eval_arrays(samples)
+            logits, values = candidate.predict(X, verbose=0)
+            error = (V - values).reshape(-1)
+            expected_policy = np.sum(train_fixed_eval._softmax_cross_entropy(P, logits) * PW) / np.sum(PW)
+            expected_value = np.sum(np.square(error) * VW) / np.sum(VW)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                cache_dir = pathlib.Path(tmp)
+                encoded = train_fixed_eval.load_fixed_holdout(samples, cache_dir)
+                cached = train_fixed_eval.load_fixed_holdout(samples, cache_dir)
+                self.assertEqual(1, len(list(cache_dir.iterdir())))
+                chunked = train_fixed_eval.FixedHoldout.encode(samples, chunk_rows=3)
+                for field in train_fixed_eval.FixedHoldout.FIELDS:
+                    np.testing.assert_array_equal(encoded.arrays[field], chunked.arrays[field])
+                for dense, compact in zip((X, P, V, PW, VW), zip(*cached.batches(len(samples)))):
+                    np.testing.assert_array_equal(dense, compact[0])
+                metrics = train_fixed_eval.evaluate_fixed_models(
+                    {"baseline": baseline, "candidate": candidate, "missing": None}, cached, batch_size=3
+                )
+        self.assertEqual(len(samples), len(encoded))
+        self.assertIsNone(metrics["missing"])
+        self.assertNotEqual(metrics["baseline"], metrics["candidate"])
+        self.assertAlmostEqual(expected_policy, metrics["candidate"]["policy_logits_loss"], places=5)
+        self.assertAlmostEqual(expected_value, metrics["candidate"]["value_loss"], places=5)
+        with mock.patch("builtins.print"):
+            whole = train_fixed_eval.evaluate_fixed_model(candidate, encoded, "candidate")
+        for name, value in whole.items():
+            self.assertAlmostEqual(value, metrics["candidate"][name], places=5)
+
+    def test_checkpointed_games_resume_with_identical_results(self):
+        near_fifty_moves = "8/8/8/3k4/8/4K3/8/4R3 w - - 90 60"
+
+        def fresh_games():
+            return [{"board": chess.Board(near_fifty_moves), "samples": [], "game_index": index} for index in range(2)]
+
+        class Interrupted(Exception):
+            pass
+
+        with mock.patch.object(self_play, "MCTS_SEARCHES", 3), mock.patch("builtins.print"):
+            self_play.seed_everything(5)
+            expected = self_play.play_out(None, fresh_games())
+
+            with tempfile.TemporaryDirectory() as tmp:
+                checkpoint = self_play.RunCheckpoint(pathlib.Path(tmp) / "checkpoint.json", {"run": 1})
+
+                def interrupt_after_four_plies(games):
+                    if len(games[0]["samples"]) == 4:
+                        checkpoint.save(0, [], games)
+                        raise Interrupted
+
+                self_play.seed_everything(5)
+                with self.assertRaises(Interrupted):
+                    self_play.play_out(None, fresh_games(), on_ply=interrupt_after_four_plies)
+                self.assertIsNone(self_play.RunCheckpoint(checkpoint.path, {"run": 2}).load())
+                resumed = checkpoint.load()
+
+            self_play.seed_everything(99)
+            self_play.set_rng_state(resumed["rng"])
+            self.assertEqual(4, len(resumed["games"][1]["board"].move_stack))
+            self.assertEqual(expected, self_play.play_out(None, resumed["games"]))
+        self.assertTrue(all(len(samples) > 4 for samples in expected))
+
     def test_arena_pairs_balanced_positions_and_reports_decisive_games(self):
         start_fens = [chess.STARTING_FEN, "8/8/8/3k4/8/4K3/8/8 w - - 0 1"]
         with mock.patch.object(self_play, "play_arena_game", side_effect=[1.0, 0.0, 0.5, 1.0]) as play:
@@ -0,0 +1,50 @@
+import io
+import pathlib
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import benchmark
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_seeded_positions_are_reproducible(self):
+        first = [board.fen() for board in benchmark.seeded_boards(8, seed=3)]
+        self.assertEqual(first, [board.fen() for board in benchmark.seeded_boards(8, seed=3)])
+        self.assertEqual(8, len(set(first)))
+
+    def test_run_reports_time_per_item_and_compare_flags_slowdowns(self):
+        with redirect_stdout(io.StringIO()):
+            results = benchmark.run_benchmarks(["canonical_fen", "move_to_index"], repeats=1, min_seconds=0.0)
+        self.assertEqual(["canonical_fen", "move_to_index"], list(results["benchmarks"]))
+        fen_result = results["benchmarks"]["canonical_fen"]
+        self.assertEqual(benchmark.POSITIONS, fen_result["items_per_call"])
+        self.assertGreater(fen_result["microseconds_per_item"], 0.0)
+
+        baseline = {"benchmarks": {
+            "canonical_fen": {"microseconds_per_item": 100.0},
+            "move_to_index": {"microseconds_per_item": 1.0},
+            "retired": {"microseconds_per_item": 1.0},
+        }}
+        current = {"benchmarks": {
+            "canonical_fen": {"microseconds_per_item": 119.0},
+            "move_to_index": {"microseconds_per_item": 1.5},
+            "new": {"microseconds_per_item": 9.0},
+        }}
+        self.assertEqual(
+            [
+                {"name": "canonical_fen", "ratio": 1.19, "regression": False},
+                {"name": "move_to_index", "ratio": 1.5, "regression": True},
+            ],
+            benchmark.compare(baseline, current, threshold=0.2),
+        )
+        with self.assertRaises(ValueError):
+            benchmark.run_benchmarks(["canonical_fen", "missing"], repeats=1, min_seconds=0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
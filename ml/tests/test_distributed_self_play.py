@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import distributed_self_play
+import self_play
+
+# Fifty-move draw is claimable after two more plies, so every game ends with two samples.
+NEAR_FIFTY_MOVES = "8/8/8/3k4/8/4K3/8/4R3 w - - 97 60"
+# Ten freely sampled plies before the fifty-move draw.
+TEN_PLIES_FROM_FIFTY_MOVES = "8/8/8/3k4/8/4K3/8/4R3 w - - 90 60"
+
+
+def plan(work_dir, games, start_fen=NEAR_FIFTY_MOVES, max_plies=8):
+    with mock.patch.object(self_play, "START_POSITION_FRACTION", 1.0), redirect_stdout(io.StringIO()):
+        return distributed_self_play.plan_games(
+            work_dir, games, seed=7, searches=2, max_plies=max_plies, start_fens=[start_fen],
+            model_path=work_dir / "missing.keras",
+        )
+
+
+def merged_buffer(work_dir):
+    buffer_path = work_dir / "buffer.json"
+    with redirect_stdout(io.StringIO()):
+        distributed_self_play.merge(work_dir, buffer_path, max_buffer=1000)
+    return buffer_path.read_bytes()
+
+
+class DistributedSelfPlayTests(unittest.TestCase):
+    def test_local_workers_share_the_plan_and_merge_in_game_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            work_dir = pathlib.Path(tmp) / "work"
+            plan(work_dir, 9)
+            environment = {**os.environ, "AZ_TELEMETRY": "0", "AZ_SELF_PLAY_POLL_SECONDS": "0.05"}
+            workers = [
+                subprocess.Popen(
+                    [sys.executable, str(ML_DIR / "distributed_self_play.py"), "--work-dir", str(work_dir),
+                     "work", "--batch-size", "2", *extra],
+                    cwd=tmp, env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                )
+                # Three workers: one on its own, two started by one `work --processes 2`.
+                for extra in ([], ["--processes", "2"])
+            ]
+            for worker in workers:
+                output, _ = worker.communicate(timeout=300)
+                self.assertEqual(0, worker.returncode, output)
+
+            self.assertEqual([], distributed_self_play.pending(work_dir))
+            self.assertEqual([], list((work_dir / "leases").iterdir()))
+            buffer_path = pathlib.Path(tmp) / "buffer.json"
+            buffer_path.write_text(json.dumps([{"fen": "old"}]), encoding="utf-8")
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(18, distributed_self_play.merge(work_dir, buffer_path, max_buffer=100))
+                self.assertEqual(0, distributed_self_play.merge(work_dir, buffer_path, max_buffer=100))
+            merged = json.loads(buffer_path.read_text(encoding="utf-8"))
+
+            self.assertEqual("old", merged[0]["fen"])
+            self.assertEqual(19, len(merged))
+            self.assertEqual({"fifty_moves"}, {sample["termination"] for sample in merged[1:]})
+            self.assertEqual([NEAR_FIFTY_MOVES.split(" 97 ")[0]] * 9, [
+                sample["fen"].rsplit(" ", 2)[0] for sample in merged[1::2]
+            ])
+
+    def test_sampled_games_do_not_depend_on_batch_membership(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            one, two = pathlib.Path(tmp) / "one", pathlib.Path(tmp) / "two"
+            for work_dir in (one, two):
+                plan(work_dir, 5, start_fen=TEN_PLIES_FROM_FIFTY_MOVES, max_plies=12)
+            with mock.patch.object(self_play, "MCTS_SEARCHES"), mock.patch.object(self_play, "MAX_PLIES"), \
+                    redirect_stdout(io.StringIO()):
+                self.assertEqual(5, distributed_self_play.work(one, batch_size=5, poll_seconds=0.05))
+            environment = {**os.environ, "AZ_TELEMETRY": "0", "AZ_SELF_PLAY_POLL_SECONDS": "0.05"}
+            worker = subprocess.run(
+                [sys.executable, str(ML_DIR / "distributed_self_play.py"), "--work-dir", str(two),
+                 "work", "--batch-size", "2", "--processes", "2"],
+                cwd=tmp, env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=300,
+            )
+            self.assertEqual(0, worker.returncode, worker.stdout)
+
+            buffer = merged_buffer(one)
+            self.assertEqual(buffer, merged_buffer(two))
+            games = [
+                json.loads(path.read_text(encoding="utf-8"))["samples"]
+                for path in sorted((one / "results").iterdir())
+            ]
+            self.assertTrue(all(games))
+            self.assertGreater(len({tuple(sample["fen"] for sample in samples) for samples in games}), 1)
+
+    def test_expired_leases_are_reclaimed_and_live_ones_are_not(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            work_dir = pathlib.Path(tmp)
+            plan(work_dir, 3)
+            leases = work_dir / "leases"
+            (leases / "game-000000.json.lease").write_text("crashed", encoding="utf-8")
+            stale = time.time() - 60
+            os.utime(leases / "game-000000.json.lease", (stale, stale))
+            (leases / "game-000001.json.lease").write_text("alive", encoding="utf-8")
+
+            with redirect_stdout(io.StringIO()):
+                claimed = distributed_self_play.claim(work_dir, 5, "me", lease_seconds=30)
+            self.assertEqual([0, 2], claimed)
+            self.assertEqual("me", (leases / "game-000000.json.lease").read_text(encoding="utf-8"))
+            self.assertEqual([], distributed_self_play.claim(work_dir, 5, "other", lease_seconds=30))
+
+            distributed_self_play.release_lease(leases / "game-000001.json.lease", "me")
+            self.assertTrue((leases / "game-000001.json.lease").exists())
+            with self.assertRaises(SystemExit):
+                (work_dir / "results" / "game-000000.json").write_text("{}", encoding="utf-8")
+                plan(work_dir, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import bz2
+import gzip
+import io
+import pathlib
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+import chess.pgn
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import extract_positions
+from fen_utils import canonical_fen
+from position_hash import HashIndex
+
+
+def _random_game(seed: int, plies: int) -> chess.pgn.Game:
+    rng = random.Random(seed)
+    game = chess.pgn.Game()
+    game.headers["Event"] = f"Game {seed}"
+    node = game
+    for _ in range(plies):
+        moves = list(node.board().legal_moves)
+        if not moves:
+            break
+        node = node.add_variation(rng.choice(moves), comment="[%clk 0:03:00]" if seed % 2 else "")
+    if len(game.variations) > 0 and seed % 3 == 0:
+        game.add_variation(chess.Move.from_uci("g1f3"))
+    return game
+
+
+class ExtractPositionsTests(unittest.TestCase):
+    def test_parallel_sampling_matches_single_process_and_game_tree_parsing(self):
+        games = [_random_game(seed, 20 + seed * 7) for seed in range(9)]
+        with tempfile.TemporaryDirectory() as tmp:
+            pgn_path = pathlib.Path(tmp) / "games.pgn"
+            pgn_path.write_text("\n\n".join(str(game) for game in games) + "\n", encoding="utf-8")
+
+            self.assertEqual(len(games), len(extract_positions.index_games(pgn_path)))
+            serial = list(extract_positions.sample_positions(pgn_path, per_game=5, workers=1))
+            with mock.patch.object(extract_positions, "CHUNK_GAMES", 2):
+                parallel = list(extract_positions.sample_positions(pgn_path, per_game=5, workers=3))
+                limited = list(extract_positions.sample_positions(pgn_path, max_games=4, per_game=5, workers=3))
+
+        expected = []
+        for game_number, game in enumerate(games, start=1):
+            nodes = list(game.mainline())
+            plies = [ply for ply in range(min(len(nodes), 100)) if ply >= 12]
+            extract_positions.game_rng(game_number).shuffle(plies)
+            selected = set(plies[:5])
+            expected += [canonical_fen(node.board().fen(en_passant="fen")) for ply, node in enumerate(nodes) if ply in selected]
+
+        self.assertEqual(expected, serial)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(expected[:len(limited)], limited)
+        self.assertLess(len(limited), len(expected))
+
+    def test_archives_are_filtered_on_headers_and_reservoir_sampled(self):
+        games = []
+        for seed, (elo, time_control, termination) in enumerate([
+            ("2100", "180+2", "Normal"),
+            ("1200", "180+2", "Normal"),
+            ("2300", "60+0", "Normal"),
+            ("2200", "600+5", "Normal"),
+            ("2250", "300+0", "Abandoned"),
+        ]):
+            game = _random_game(seed + 20, 60)
+            game.headers.update(WhiteElo=elo, BlackElo="2000", TimeControl=time_control, Termination=termination)
+            games.append(str(game))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            gz_path = pathlib.Path(tmp) / "part1.pgn.gz"
+            bz2_path = pathlib.Path(tmp) / "part2.pgn.bz2"
+            with gzip.open(gz_path, "wt", encoding="utf-8") as handle:
+                handle.write("\n\n".join(games[:3]) + "\n")
+            with bz2.open(bz2_path, "wt", encoding="utf-8") as handle:
+                handle.write("\n\n".join(games[3:]) + "\n")
+
+            with mock.patch.multiple(
+                extract_positions,
+                MIN_RATING=1800,
+                TIME_CONTROLS={"blitz", "rapid"},
+                TERMINATIONS={"Normal"},
+            ):
+                fens = list(extract_positions.sample_archive_positions([gz_path, bz2_path], per_game=4))
+
+        expected = []
+        for game_number in (1, 4):
+            game = chess.pgn.read_game(io.StringIO(games[game_number - 1]))
+            visitor = chess.pgn.read_game(io.StringIO(games[game_number - 1]), Visitor=extract_positions.MainlineVisitor)
+            self.assertEqual(len(list(game.mainline_moves())), len(visitor.moves))
+            expected += extract_positions.sample_game(game_number, visitor, 4, 12, 100)
+        self.assertEqual(expected, fens)
+        self.assertEqual("blitz", extract_positions.time_control_category("180+2"))
+        self.assertEqual("correspondence", extract_positions.time_control_category("-"))
+
+        a, b, c, d, e, f = [node.board().fen() for node in _random_game(40, 6).mainline()]
+        sample, candidates, seen = extract_positions.reservoir_sample(
+            iter([a, b, a, c, d, e, f]), 3, HashIndex.from_fens([b]), random.Random(1)
+        )
+        self.assertEqual((3, 5, 1), (len(sample), candidates, seen))
+        self.assertEqual(len(sample), len(set(sample)))
+
+
+if __name__ == "__main__":
+    unittest.main()
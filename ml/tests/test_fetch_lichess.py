@@ -0,0 +1,109 @@
+import datetime as dt
+import http.server
+import json
+import pathlib
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import fetch_lichess
+import telemetry
+
+
+def _game(game_id: str, day: int) -> tuple[str, int, str]:
+    started = dt.datetime(2024, 1, day, 12, 0, 0, tzinfo=dt.UTC)
+    text = (
+        f'[Event "Rated blitz game"]\n[Site "https://lichess.org/{game_id}"]\n'
+        f'[UTCDate "{started:%Y.%m.%d}"]\n[UTCTime "{started:%H:%M:%S}"]\n\n1. e4 e5 1-0\n'
+    )
+    return game_id, int(started.timestamp() * 1000), text
+
+
+SHARED = _game("shared01", 9)
+GAMES = {
+    "alice": [SHARED] + [_game(f"alice00{day}", day) for day in range(5, 0, -1)],
+    "bob": [SHARED, _game("bobgame1", 2), _game("bobgame0", 1)],
+}
+
+
+class _LichessStandIn(http.server.BaseHTTPRequestHandler):
+    requests = []
+    rate_limited = set()
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        username = url.path.rsplit("/", 1)[-1]
+        type(self).requests.append((username, query))
+        if username == "bob" and username not in type(self).rate_limited:
+            type(self).rate_limited.add(username)
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        since = int(query.get("since", 0))
+        until = int(query.get("until", 2**62))
+        games = [text for _, started, text in GAMES[username] if since <= started <= until]
+        body = "\n\n".join(games[:int(query["max"])]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-chess-pgn; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchLichessTests(unittest.TestCase):
+    def test_runs_fetch_only_unseen_games_through_per_user_cursors(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _LichessStandIn)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                staging = pathlib.Path(tmp) / "lichess"
+                out_pgn = pathlib.Path(tmp) / "games.pgn"
+                with mock.patch.multiple(
+                    fetch_lichess,
+                    API_URL=f"http://127.0.0.1:{server.server_address[1]}",
+                    OUT_PGN=out_pgn,
+                    STAGING_DIR=staging,
+                    STATE_JSON=staging / "cursors.json",
+                    SEEN_IDS=staging / "seen_game_ids.txt",
+                    USER_OVERRIDE=["alice", "bob"],
+                    MAX_GAMES=2,
+                    MIN_INTERVAL_SECONDS=0.0,
+                    RATE_LIMIT_WAIT_SECONDS=0.0,
+                    history_cutoff_ms=mock.Mock(return_value=2**60),
+                ), mock.patch.object(telemetry, "TELEMETRY_LOG", pathlib.Path(tmp) / "telemetry.jsonl"):
+                    runs = []
+                    for _ in range(3):
+                        fetch_lichess.main()
+                        text = out_pgn.read_text(encoding="utf-8")
+                        runs.append(sorted(fetch_lichess.game_id(game) for game in fetch_lichess.iter_pgn_games(text.splitlines())))
+                    cursors = json.loads((staging / "cursors.json").read_text(encoding="utf-8"))["users"]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(["alice005", "bobgame1", "shared01"], runs[0])
+        self.assertEqual(["alice004", "bobgame0"], runs[1])
+        self.assertEqual(["alice003"], runs[2])
+        self.assertTrue(cursors["bob"]["complete"])
+        self.assertEqual(GAMES["alice"][3][1], cursors["alice"]["oldest"])
+        bob_queries = [query for user, query in _LichessStandIn.requests if user == "bob"]
+        self.assertEqual(bob_queries[0], bob_queries[1])
+        self.assertEqual(str(GAMES["bob"][0][1]), bob_queries[2]["since"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import os
+import pathlib
+import sys
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import benchmark
+import gating
+import mcts_stats
+import self_play
+import train_fixed_eval
+from policy_map import POLICY_VERSION, move_to_index
+
+SETTINGS = {"AZ_MCTS_EVAL_POSITIONS": "3", "AZ_MCTS_EVAL_SEARCHES": "4", "AZ_MCTS_STATS": "1", "AZ_TELEMETRY": "0"}
+
+
+def gate(executor, samples):
+    alignments = executor.map(
+        train_fixed_eval._side_mcts_alignment,
+        [("baseline", samples, "previous"), ("candidate", samples, "candidate")],
+    )
+    arena = self_play.arena_score(
+        executor.models["candidate"],
+        executor.models["baseline"],
+        games=2,
+        searches=3,
+        max_plies=6,
+        play_all=train_fixed_eval.gated_arena_games(executor) if executor.parallel else None,
+    )
+    return alignments, arena
+
+
+class GateExecutorTests(unittest.TestCase):
+    def test_worker_processes_reproduce_inline_metrics(self):
+        samples = []
+        for board in benchmark.seeded_boards(count=3):
+            first, second = list(board.legal_moves)[:2]
+            policy = [[move_to_index(first), 0.8], [move_to_index(second), 0.2]]
+            samples.append({"source": "stockfish", "fen": board.fen(), "policy_version": POLICY_VERSION, "policy": policy})
+        models = {"baseline": benchmark.benchmark_model(seed=1), "candidate": benchmark.benchmark_model(seed=2)}
+        with mock.patch.dict(os.environ, SETTINGS), \
+                mock.patch.object(train_fixed_eval, "MCTS_EVAL_POSITIONS", 3), \
+                mock.patch.object(train_fixed_eval, "MCTS_EVAL_SEARCHES", 4), \
+                mock.patch.object(mcts_stats, "ENABLED", True), \
+                redirect_stdout(io.StringIO()):
+            with gating.GateExecutor(models, workers=1) as executor:
+                inline = gate(executor, samples)
+            # Default threads match the inline path; two pinned threads still split each op.
+            runs = {}
+            for threads in (0, 2):
+                with gating.GateExecutor(models, workers=2, threads=threads) as executor:
+                    runs[threads] = gate(executor, samples)
+
+        self.assertIsNotNone(inline[0][0])
+        inline_stats = inline[1].pop("mcts")
+        for threads, parallel in runs.items():
+            with self.subTest(threads=threads):
+                self.assertEqual(inline[0], parallel[0])
+                parallel_stats = parallel[1].pop("mcts")
+                self.assertEqual(inline[1], parallel[1])
+                self.assertEqual(inline_stats["searches"], parallel_stats["searches"])
+                self.assertEqual(inline_stats["batch_size_histogram"], parallel_stats["batch_size_histogram"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import label_store
+import policy_map
+from fen_utils import canonical_fen
+
+
+def _label(fen: str, cp: float, move: str) -> dict:
+    return {
+        "fen": canonical_fen(fen),
+        "cp": cp,
+        "policy_version": policy_map.POLICY_VERSION,
+        "policy": [[policy_map.move_to_index(chess.Move.from_uci(move)), 1.0]],
+    }
+
+
+OPENING = _label(chess.STARTING_FEN, 20.0, "e2e4")
+LOPSIDED = _label("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/4K3 w kq - 0 1", -3000.0, "e1e2")
+ENDGAME = _label("8/8/8/4k3/8/8/4P3/4K3 w - - 0 1", 90.0, "e2e4")
+
+
+class LabelStoreTests(unittest.TestCase):
+    def test_imports_queries_and_exports_the_json_buffer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = pathlib.Path(tmp) / "replay_buffer.json"
+            json_path.write_text(json.dumps([LOPSIDED, OPENING, ENDGAME]), encoding="utf-8")
+
+            with label_store.open_store(json_path) as store:
+                self.assertEqual([LOPSIDED, OPENING, ENDGAME], store.labels())
+                self.assertEqual({OPENING["fen"], LOPSIDED["fen"], ENDGAME["fen"]}, store.fens())
+                self.assertEqual({OPENING["fen"]: OPENING}, store.get_many([OPENING["fen"], "missing"]))
+                self.assertEqual([OPENING["fen"]], store.balanced_start_fens(150))
+                self.assertFalse(store.sync_from_json(json_path))
+
+                store.replace([ENDGAME, {**OPENING, "cp": 35.0}], json_path)
+
+            self.assertEqual(
+                [ENDGAME, {**OPENING, "cp": 35.0}],
+                json.loads(json_path.read_text(encoding="utf-8")),
+            )
+            with label_store.open_store(json_path) as store:
+                self.assertEqual(2, store.count())
+                self.assertFalse(store.sync_from_json(json_path))
+
+            json_path.write_text(json.dumps([LOPSIDED]), encoding="utf-8")
+            with label_store.open_store(json_path) as store:
+                self.assertEqual([LOPSIDED], store.labels())
+
+    def test_unchanged_buffer_is_not_read_or_hashed_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = pathlib.Path(tmp) / "replay_buffer.json"
+            json_path.write_text(json.dumps([OPENING]), encoding="utf-8")
+            with label_store.open_store(json_path):
+                pass
+
+            with mock.patch.object(label_store, "_file_digest", side_effect=AssertionError("hashed")):
+                with label_store.open_store(json_path) as store:
+                    self.assertEqual([OPENING], store.labels())
+
+            # A touched but identical file is hashed once and not reimported.
+            os.utime(json_path, ns=(0, 0))
+            with label_store.LabelStore(json_path.with_suffix(".sqlite")) as store:
+                self.assertFalse(store.sync_from_json(json_path))
+                self.assertEqual(label_store._file_stamp(json_path), store._meta("json_stamp"))
+
+    def test_policy_blob_round_trips_exactly(self):
+        policy = [[0, 2 / 3], [1967, 1 / 3]]
+        self.assertEqual(policy, label_store.decode_policy(label_store.encode_policy(policy)))
+
+
+if __name__ == "__main__":
+    unittest.main()
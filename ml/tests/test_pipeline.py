@@ -0,0 +1,131 @@
+import io
+import json
+import pathlib
+import sys
+import tempfile
+import textwrap
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import pipeline
+
+COPY_SCRIPT = textwrap.dedent(
+    """
+    import os, pathlib, sys
+    from helper import SUFFIX
+    source, target = sys.argv[0].replace(".py", ".in"), sys.argv[0].replace(".py", ".out")
+    with open("runs.log", "a") as log:
+        log.write(pathlib.Path(sys.argv[0]).stem + "\\n")
+    if os.environ.get("STAGE_FAIL") == pathlib.Path(sys.argv[0]).stem:
+        raise SystemExit(3)
+    pathlib.Path(target).write_text(pathlib.Path(source).read_text() + os.environ.get("STAGE_PARAM", "") + SUFFIX)
+    """
+)
+
+
+def _stages():
+    # a -> b, c independent; b and c each read their own .in file.
+    return [
+        pipeline.Stage("a", "ml/a.py", inputs=["ml/a.in"], outputs=["ml/a.out"], params=["STAGE_PARAM"]),
+        pipeline.Stage("b", "ml/b.py", inputs=["ml/b.in", "ml/a.out"], outputs=["ml/b.out"]),
+        pipeline.Stage("c", "ml/c.py", inputs=["ml/c.in"], outputs=["ml/c.out"]),
+    ]
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        ml = self.root / "ml"
+        ml.mkdir()
+        (ml / "helper.py").write_text('SUFFIX = "!"\n')
+        for name in "abc":
+            (ml / f"{name}.py").write_text(COPY_SCRIPT)
+            (ml / f"{name}.in").write_text(name)
+        # b's script reads b.in; make b.in the copy of a.out so the dependency matters.
+        (ml / "b.py").write_text(COPY_SCRIPT.replace('sys.argv[0].replace(".py", ".in")', '"ml/a.out"'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _run(self, environ=None, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return pipeline.run_pipeline(_stages(), environ=environ or {}, root=self.root, **kwargs)
+
+    def _runs(self) -> list[str]:
+        log = self.root / "runs.log"
+        runs = log.read_text().split() if log.exists() else []
+        log.unlink(missing_ok=True)
+        return sorted(runs)
+
+    def test_stages_rerun_only_when_inputs_params_or_code_change(self):
+        self.assertEqual({"b": {"a"}, "a": set(), "c": set()}, pipeline.dependencies(_stages()))
+        self.assertEqual(["a.py", "helper.py"], [path.name for path in pipeline.code_files(self.root / "ml/a.py")])
+
+        results = self._run()
+        self.assertEqual({"ran"}, {result["status"] for result in results.values()})
+        self.assertEqual(["a", "b", "c"], self._runs())
+        self.assertEqual("a!!", (self.root / "ml/b.out").read_text())
+
+        self.assertEqual({"cached"}, {result["status"] for result in self._run().values()})
+        self.assertEqual([], self._runs())
+
+        (self.root / "ml/c.in").write_text("changed")
+        self._run()
+        self.assertEqual(["c"], self._runs())
+
+        self._run({"STAGE_PARAM": "x", "UNRELATED": "1"})
+        self.assertEqual(["a", "b"], self._runs())
+        self.assertEqual("ax!x!", (self.root / "ml/b.out").read_text())
+
+        (self.root / "ml/helper.py").write_text('SUFFIX = "?"\n')
+        self._run({"STAGE_PARAM": "x"}, selected=["c"])
+        self.assertEqual(["c"], self._runs())
+
+        (self.root / "ml/c.out").unlink()
+        self._run({"STAGE_PARAM": "x"}, selected=["c"], force={"c"})
+        self.assertEqual(["c"], self._runs())
+
+        state = json.loads((self.root / pipeline.STATE_JSON).read_text())
+        self.assertEqual({"a", "b", "c"}, set(state["stages"]))
+        self.assertIn("seconds", state["stages"]["c"])
+
+    def test_always_run_stage_is_never_cached(self):
+        stages = _stages()
+        stages[2].always_run = True
+        with redirect_stdout(io.StringIO()):
+            pipeline.run_pipeline(stages, environ={}, root=self.root)
+            self._runs()
+            results = pipeline.run_pipeline(stages, environ={}, root=self.root)
+
+        self.assertEqual(["c"], self._runs())
+        self.assertEqual("ran", results["c"]["status"])
+        self.assertTrue(next(stage for stage in pipeline.STAGES if stage.name == "fetch").always_run)
+
+    def test_failed_stage_blocks_dependents_only(self):
+        results = self._run({"STAGE_FAIL": "a"})
+        self.assertEqual(
+            {"a": "failed", "b": "blocked", "c": "ran"},
+            {name: result["status"] for name, result in results.items()},
+        )
+        self.assertEqual(["a", "c"], self._runs())
+        self.assertEqual(["a", "b"], sorted(name for name, result in self._run().items() if result["status"] == "ran"))
+
+    def test_core_sets_split_concurrent_stages(self):
+        self.assertEqual([0, 1, 2, 5], pipeline.parse_cpus("0-2, 5"))
+        self.assertEqual({"stockfish": [3]}, pipeline.core_sets(["stockfish", "train"], {"PIPELINE_CORES_STOCKFISH": "3"}))
+        with mock.patch.object(pipeline.os, "sched_getaffinity", return_value={0, 1, 2, 3, 4}, create=True):
+            sets = pipeline.core_sets(["stockfish", "self_play", "train"], {})
+        self.assertEqual({"stockfish": [0, 1], "self_play": [2, 3, 4]}, sets)
+        stage = pipeline.STAGES[2]
+        self.assertEqual("2", pipeline.stage_environment(stage, [0, 1], {})["SF_ENGINES"])
+        self.assertEqual("8", pipeline.stage_environment(stage, [0, 1], {"SF_ENGINES": "8"})["SF_ENGINES"])
+
+
+if __name__ == "__main__":
+    unittest.main()
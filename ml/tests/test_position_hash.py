@@ -0,0 +1,72 @@
+import pathlib
+import random
+import sys
+import unittest
+
+import chess
+import chess.polyglot
+import numpy as np
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import position_hash
+from fen_utils import canonical_fen
+
+
+def _random_fens(count: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = chess.Board()
+        for _ in range(40):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+            fens.append(board.fen(en_passant="fen"))
+    return fens[:count]
+
+
+class PositionHashTests(unittest.TestCase):
+    def test_hash_matches_polyglot_and_tracks_canonical_identity(self):
+        self.assertEqual(chess.polyglot.zobrist_hash(chess.Board()), position_hash.fen_hash(chess.STARTING_FEN))
+
+        board = chess.Board()
+        board.push_uci("e2e4")
+        # Polyglot skips an en-passant square nobody can capture on; the FEN identity keeps it.
+        self.assertNotEqual(chess.polyglot.zobrist_hash(board), position_hash.board_hash(board))
+        self.assertNotEqual(position_hash.fen_hash(board.fen(en_passant="fen")), position_hash.fen_hash(board.fen()))
+
+        fens = _random_fens(2000)
+        canonical = {canonical_fen(fen) for fen in fens}
+        self.assertEqual(len(canonical), len({position_hash.fen_hash(fen) for fen in fens}))
+        self.assertEqual(position_hash.fen_hash(fens[10]), position_hash.fen_hash(canonical_fen(fens[10])))
+        for malformed in ("not a fen", "8/8/8/8/8/8/8/8/8 w - - 0 1", "9/8/8/8/8/8/8/8 w - - 0 1", "7/8/8/8/8/8/8/8 w - - 0 1"):
+            with self.subTest(fen=malformed), self.assertRaises(ValueError):
+                position_hash.fen_hash(malformed)
+
+    def test_hash_index_and_bloom_filter_membership(self):
+        fens = _random_fens(600)
+        stored, fresh = fens[:300], [fen for fen in fens[300:] if fen not in set(fens[:300])]
+        index = position_hash.HashIndex.from_fens(stored + stored[:20])
+        self.assertEqual(len(set(stored)), len(index))
+        self.assertTrue(index.contains_fens(stored).all())
+        self.assertFalse(index.contains_fens(fresh).any())
+        self.assertIn(position_hash.fen_hash(stored[0]), index)
+        self.assertNotIn(2 ** 64 - 1, index)
+        self.assertFalse(position_hash.HashIndex().contains_fens(stored).any())
+        self.assertIs(index, position_hash.as_index(index))
+
+        bloom = position_hash.BloomFilter(len(stored), error_rate=0.01)
+        bloom.add(position_hash.fen_hashes(stored))
+        self.assertTrue(bloom.contains(position_hash.fen_hashes(stored)).all())
+        self.assertLess(float(np.mean(bloom.contains(position_hash.fen_hashes(fresh)))), 0.05)
+
+        self.assertEqual(-1, position_hash.to_signed(2 ** 64 - 1))
+        self.assertEqual(5, position_hash.to_signed(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
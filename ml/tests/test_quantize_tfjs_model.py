@@ -9,7 +9,7 @@ import unittest
 ROOT_DIR = pathlib.Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(ROOT_DIR / "scripts"))
 
-from quantize_tfjs_model import quantize_model
+from quantize_tfjs_model import layer_errors, quantize_model, read_weights
 
 
 class QuantizeTFJSModelTests(unittest.TestCase):
@@ -35,13 +35,110 @@ class QuantizeTFJSModelTests(unittest.TestCase):
             updated = json.loads(model_path.read_text(encoding="utf-8"))
             weights = updated["weightsManifest"][0]["weights"]
 
+            paths = updated["weightsManifest"][0]["paths"]
+            quantized_path = model_dir / paths[0]
+
             self.assertEqual((12, 6), sizes)
-            self.assertEqual((0.25, -1.5, 3.125), struct.unpack("<eee", shard_path.read_bytes()))
+            self.assertEqual(1, len(paths))
+            self.assertRegex(paths[0], r"^group-[0-9a-f]{20}\.bin$")
+            self.assertEqual((0.25, -1.5, 3.125), struct.unpack("<eee", quantized_path.read_bytes()))
             self.assertTrue(
                 all(weight["quantization"] == {"dtype": "float16"} for weight in weights)
             )
             self.assertFalse(stale_path.exists())
+            self.assertFalse(shard_path.exists())
             self.assertEqual((6, 6), quantize_model(model_path))
+            self.assertEqual(paths, json.loads(model_path.read_text(encoding="utf-8"))["weightsManifest"][0]["paths"])
+            self.assertTrue(quantized_path.exists())
+
+    def test_splits_weights_into_fixed_size_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = pathlib.Path(tmp)
+            model_path = model_dir / "model.json"
+            model_path.write_text(json.dumps({
+                "weightsManifest": [{
+                    "paths": ["group1-shard1of2.bin", "group1-shard2of2.bin"],
+                    "weights": [{"name": "dense/kernel", "shape": [5], "dtype": "float32"}],
+                }],
+            }), encoding="utf-8")
+            values = (1.0, 2.0, 3.0, 4.0, 5.0)
+            data = struct.pack("<fffff", *values)
+            (model_dir / "group1-shard1of2.bin").write_bytes(data[:12])
+            (model_dir / "group1-shard2of2.bin").write_bytes(data[12:])
+
+            quantize_model(model_path, shard_bytes=4)
+            paths = json.loads(model_path.read_text(encoding="utf-8"))["weightsManifest"][0]["paths"]
+
+            self.assertEqual([4, 4, 2], [(model_dir / path).stat().st_size for path in paths])
+            joined = b"".join((model_dir / path).read_bytes() for path in paths)
+            self.assertEqual(values, struct.unpack("<eeeee", joined))
+            self.assertEqual(sorted(set(paths)), sorted(path.name for path in model_dir.glob("group*.bin")))
+
+    def test_syncs_value_model_manifest_with_quantized_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = pathlib.Path(tmp)
+            model_path = model_dir / "model.json"
+            value_path = model_dir / "value_model.json"
+            manifest = [{
+                "paths": ["group1-shard1of1.bin"],
+                "weights": [{"name": "value/kernel", "shape": [2], "dtype": "float32"}],
+            }]
+            model_path.write_text(json.dumps({"weightsManifest": manifest}), encoding="utf-8")
+            value_path.write_text(json.dumps({
+                "modelTopology": {"name": "value_head"},
+                "weightsManifest": manifest,
+            }), encoding="utf-8")
+            (model_dir / "group1-shard1of1.bin").write_bytes(struct.pack("<ff", 0.5, -2.0))
+
+            quantize_model(model_path)
+            value_model = json.loads(value_path.read_text(encoding="utf-8"))
+
+            self.assertEqual({"name": "value_head"}, value_model["modelTopology"])
+            self.assertEqual(
+                {"dtype": "float16"},
+                value_model["weightsManifest"][0]["weights"][0]["quantization"],
+            )
+            self.assertEqual(
+                json.loads(model_path.read_text(encoding="utf-8"))["weightsManifest"],
+                value_model["weightsManifest"],
+            )
+
+    def test_uint8_quantization_keeps_value_head_in_float16(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = pathlib.Path(tmp)
+            model_path = model_dir / "model.json"
+            trunk = [-1.0, -0.25, 0.0, 0.5, 2.0]
+            model_path.write_text(json.dumps({
+                "weightsManifest": [{
+                    "paths": ["group1-shard1of1.bin"],
+                    "weights": [
+                        {"name": "trunk/kernel", "shape": [5], "dtype": "float32"},
+                        {"name": "value/kernel", "shape": [2], "dtype": "float32"},
+                    ],
+                }],
+            }), encoding="utf-8")
+            (model_dir / "group1-shard1of1.bin").write_bytes(struct.pack("<7f", *trunk, 0.125, -0.75))
+            reference = read_weights(model_path)
+
+            self.assertEqual((28, 9), quantize_model(model_path, dtype="uint8"))
+            weights = json.loads(model_path.read_text(encoding="utf-8"))["weightsManifest"][0]["weights"]
+            quantized = read_weights(model_path)
+
+            scale = weights[0]["quantization"]["scale"]
+            self.assertEqual("uint8", weights[0]["quantization"]["dtype"])
+            self.assertAlmostEqual(3.0 / 255.0, scale)
+            self.assertEqual(0.0, quantized["trunk/kernel"][2])
+            self.assertLessEqual(max(abs(a - b) for a, b in zip(quantized["trunk/kernel"], trunk)), scale / 2 + 1e-6)
+            self.assertEqual({"dtype": "float16"}, weights[1]["quantization"])
+            self.assertEqual([0.125, -0.75], quantized["value/kernel"].tolist())
+
+            errors = layer_errors(reference, quantized)
+            self.assertEqual({"trunk", "value"}, set(errors))
+            self.assertEqual(0.0, errors["value"]["max_error"])
+            self.assertGreater(errors["trunk"]["max_error"], 0.0)
+
+            self.assertEqual((9, 14), quantize_model(model_path, layer_dtypes=[("*", "float16")]))
+            self.assertEqual({"dtype": "float16"}, json.loads(model_path.read_text(encoding="utf-8"))["weightsManifest"][0]["weights"][0]["quantization"])
 
     def test_rejects_a_truncated_weight_shard(self):
         with tempfile.TemporaryDirectory() as tmp:
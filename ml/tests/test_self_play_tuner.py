@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import pathlib
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import self_play_tuner
+
+
+def fake_trial(config, seconds):
+    # Throughput peaks at batch 8 and two processes; four processes exceed the memory cap.
+    rate = 100.0 - abs(config["batch_size"] - 8) + 50.0 * min(config["processes"], 2)
+    return {
+        **config,
+        "seconds": seconds,
+        "positions_per_second": rate * 10,
+        "samples_per_hour": rate * 3600 / config["searches"],
+        "peak_rss_mb": 500.0 * config["processes"],
+    }
+
+
+class SelfPlayTunerTests(unittest.TestCase):
+    def test_sweep_keeps_the_fastest_setting_that_fits_in_memory(self):
+        with redirect_stdout(io.StringIO()):
+            recommended, results = self_play_tuner.sweep(
+                fake_trial, total_seconds=3600, trial_seconds=1, max_rss_mb=1500, cpu_count=4
+            )
+        self.assertEqual(8, recommended["AZ_SELF_PLAY_BATCH_SIZE"])
+        self.assertEqual(2, recommended["AZ_SELF_PLAY_WORKERS"])
+        self.assertEqual(self_play_tuner.TARGET_SEARCHES, recommended["AZ_MCTS_SEARCHES"])
+        self.assertIn(4, [result["processes"] for result in results])
+        curve = [result["searches"] for result in results if result["kind"] == "self_play" and result["processes"] == 2]
+        self.assertEqual(list(self_play_tuner.SEARCH_CURVE), curve[-len(self_play_tuner.SEARCH_CURVE):])
+        self.assertEqual("arena", results[-1]["kind"])
+
+        with tempfile.TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+            out_dir = pathlib.Path(temp_dir)
+            self_play_tuner.write_report(recommended, results, out_dir)
+            report = json.loads((out_dir / "self_play_tuning.json").read_text(encoding="utf-8"))
+            with (out_dir / "self_play_scaling.csv").open(encoding="utf-8") as handle:
+                rows = list(csv.DictReader(handle))
+        self.assertEqual(recommended, report["recommended"])
+        self.assertEqual(len(results), len(rows))
+
+    def test_sweep_stops_starting_trials_at_the_time_budget(self):
+        with redirect_stdout(io.StringIO()):
+            recommended, results = self_play_tuner.sweep(fake_trial, total_seconds=0, trial_seconds=1, cpu_count=1)
+        self.assertEqual([], results)
+        self.assertIsNone(recommended["expected_samples_per_hour"])
+
+    def test_trial_plays_real_games_with_the_benchmark_model(self):
+        config = {**self_play_tuner.base_config(), "batch_size": 2, "searches": 2, "max_plies": 8}
+        with redirect_stdout(io.StringIO()):
+            report = self_play_tuner.measure_trial(config, seconds=0.0)
+            arena = self_play_tuner.measure_trial({**config, "kind": "arena"}, seconds=0.0)
+        # An expired clock stops the trial after one ply of every game in the batch.
+        self.assertEqual(2, report["plies"])
+        self.assertEqual(1, arena["plies"])
+        self.assertGreater(report["positions"], report["plies"])
+        self.assertGreater(report["peak_rss_mb"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import stockfish_eval
+import telemetry
+
+
+FAKE_ENGINE = [sys.executable, str(pathlib.Path(__file__).resolve().with_name("fake_uci_engine.py"))]
+FENS = [
+    chess.STARTING_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1",
+    "rnbqkb1r/pppp1ppp/5n2/4p3/2B1P3/8/PPPP1PPP/RNBQK1NR w KQkq - 2 3",
+]
+
+
+class StockfishEvalTests(unittest.TestCase):
+    def test_engine_pool_matches_single_engine_labels(self):
+        engine = stockfish_eval.open_engine(FAKE_ENGINE)
+        try:
+            expected = [stockfish_eval.analyse_position(engine, fen) for fen in FENS]
+        finally:
+            engine.quit()
+
+        results = sorted(stockfish_eval.label_positions(FENS, engines=3, command=FAKE_ENGINE))
+
+        self.assertEqual(list(range(len(FENS))), [index for index, _, _ in results])
+        self.assertEqual(FENS, [fen for _, fen, _ in results])
+        self.assertEqual(expected, [label for _, _, label in results])
+        self.assertEqual(3, len(expected[0]["policy"]))
+
+    def test_crashed_engine_is_restarted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            marker = pathlib.Path(tmp) / "crashed"
+            with mock.patch.dict(os.environ, {"FAKE_UCI_CRASH_ONCE": str(marker)}):
+                results = list(stockfish_eval.label_positions(FENS[:2], engines=1, command=FAKE_ENGINE))
+
+            self.assertTrue(marker.exists())
+            self.assertEqual(2, len(results))
+            self.assertTrue(all(isinstance(label, dict) for _, _, label in results))
+
+    def test_rerun_skips_positions_in_the_label_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = pathlib.Path(tmp)
+            (data_dir / "positions.fen").write_text("\n".join(FENS[:3]) + "\n", encoding="utf-8")
+            log_path = data_dir / "labels.log.jsonl"
+            logged = {"fen": FENS[0], "cp": 999.0, "policy_version": 3, "policy": [[378, 1.0]]}
+            log_path.write_text(json.dumps(logged) + "\n" + '{"fen": "torn', encoding="utf-8")
+
+            with mock.patch.multiple(
+                stockfish_eval,
+                IN_FEN=data_dir / "positions.fen",
+                OUT_JSON=data_dir / "labels.json",
+                REPLAY_JSON=data_dir / "replay_buffer.json",
+                LABEL_LOG=log_path,
+                STOCKFISH=FAKE_ENGINE,
+                ENGINES=2,
+            ), mock.patch.object(telemetry, "TELEMETRY_LOG", data_dir / "telemetry.jsonl"):
+                stockfish_eval.main()
+                log = stockfish_eval.read_label_log()
+                (span,) = telemetry.read_events()
+
+            labels = json.loads((data_dir / "labels.json").read_text(encoding="utf-8"))
+            expected_fens = [stockfish_eval.canonical_fen(fen) for fen in FENS[:3]]
+            self.assertEqual(expected_fens, [label["fen"] for label in labels])
+            self.assertEqual(999.0, labels[0]["cp"])
+            # Everything logged is now in labels.json, so the log is emptied.
+            self.assertEqual({}, log)
+            self.assertEqual("", log_path.read_text(encoding="utf-8"))
+            self.assertEqual(("stockfish_label", "ok", 3), (span["stage"], span["status"], span["items"]))
+
+    def test_compacting_the_log_keeps_only_unconsolidated_labels(self):
+        fens = [stockfish_eval.canonical_fen(fen) for fen in FENS[:2]]
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = pathlib.Path(tmp) / "labels.log.jsonl"
+            with stockfish_eval.LabelLog(log_path) as log:
+                for fen in fens:
+                    log.append({"fen": fen, "cp": 1.0, "policy_version": 3, "policy": [[378, 1.0]]})
+
+            self.assertEqual(1, stockfish_eval.compact_label_log({fens[0]}, log_path))
+            self.assertEqual([fens[1]], list(stockfish_eval.read_label_log(log_path)))
+
+    def test_shallow_replay_labels_are_refined_to_the_required_depth(self):
+        fens = [stockfish_eval.canonical_fen(fen) for fen in FENS]
+        shallow = {"fen": fens[1], "cp": 5.0, "policy_version": 3, "policy": [[378, 0.5], [36, 0.5]], "depth": 8}
+        confident = {**shallow, "fen": fens[2], "policy": [[378, 0.9], [36, 0.1]], "depth": 8}
+        deep = {**shallow, "fen": fens[3], "depth": 12, "multipv": 3}
+        self.assertEqual(
+            [fens[1], fens[2]],
+            [item["fen"] for item in sorted([confident, shallow], key=stockfish_eval.refinement_priority)],
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = pathlib.Path(tmp)
+            (data_dir / "positions.fen").write_text(fens[0] + "\n", encoding="utf-8")
+            (data_dir / "replay_buffer.json").write_text(json.dumps([deep, confident, shallow]), encoding="utf-8")
+
+            with mock.patch.multiple(
+                stockfish_eval,
+                IN_FEN=data_dir / "positions.fen",
+                OUT_JSON=data_dir / "labels.json",
+                REPLAY_JSON=data_dir / "replay_buffer.json",
+                LABEL_LOG=data_dir / "labels.log.jsonl",
+                STOCKFISH=FAKE_ENGINE,
+                ENGINES=1,
+                REFINE_SECONDS=60.0,
+            ), mock.patch.object(telemetry, "TELEMETRY_LOG", data_dir / "telemetry.jsonl"):
+                stockfish_eval.main()
+                labels = json.loads((data_dir / "labels.json").read_text(encoding="utf-8"))
+                # A later run does not carry this run's refinements again.
+                with mock.patch.object(stockfish_eval, "REFINE_SECONDS", 0.0):
+                    stockfish_eval.main()
+                rerun = json.loads((data_dir / "labels.json").read_text(encoding="utf-8"))
+
+        self.assertEqual([fens[0], fens[1], fens[2]], [label["fen"] for label in labels])
+        self.assertTrue(all(label["depth"] == 12 and label["multipv"] == 3 for label in labels))
+        self.assertEqual([fens[0]], [label["fen"] for label in rerun])
+
+    def test_budgeted_labels_report_achieved_depth(self):
+        with mock.patch.multiple(stockfish_eval, MIN_DEPTH=4, STOP_GAP_CP=20.0):
+            results = sorted(stockfish_eval.label_positions(FENS, engines=2, command=FAKE_ENGINE, budget_seconds=5.0))
+
+        self.assertTrue(all(label["depth"] >= 4 for _, _, label in results))
+        self.assertEqual(FENS, [fen for _, fen, _ in results])
+
+        budget = stockfish_eval.SearchBudget(10.0, positions=4, engines=2)
+        self.assertAlmostEqual(5.0, budget.allowance(), places=1)
+        self.assertAlmostEqual(20.0 / 3, budget.allowance(), places=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import json
+import pathlib
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+
+ML_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ML_DIR))
+
+import telemetry
+
+
+class TelemetryTests(unittest.TestCase):
+    def test_spans_nest_and_record_items_and_failures(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = pathlib.Path(tmp) / "telemetry.jsonl"
+            with mock.patch.object(telemetry, "TELEMETRY_LOG", log):
+                @telemetry.traced("outer")
+                def run():
+                    with telemetry.span("inner", items=5):
+                        telemetry.add_items(2)
+                    telemetry.add_items(3)
+                    with self.assertRaises(KeyError), telemetry.span("broken"):
+                        raise KeyError("boom")
+
+                run()
+                with telemetry.span("disabled", enabled=False):
+                    pass
+                events = telemetry.read_events()
+
+        self.assertEqual(["inner", "broken", "outer"], [event["stage"] for event in events])
+        inner, broken, outer = events
+        self.assertEqual(("outer", 7), (inner["parent"], inner["items"]))
+        self.assertEqual((None, 3, "ok"), (outer["parent"], outer["items"], outer["status"]))
+        self.assertEqual("error", broken["status"])
+        self.assertGreaterEqual(outer["wall_seconds"], inner["wall_seconds"])
+        self.assertGreater(outer["peak_rss_mb"], 0)
+        self.assertIn("items_per_second", inner)
+
+    @unittest.skipUnless(telemetry._reset_peak(), "needs a resettable VmHWM (Linux)")
+    def test_peak_rss_is_measured_per_span(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch.object(telemetry, "TELEMETRY_LOG", pathlib.Path(tmp) / "telemetry.jsonl"):
+                with telemetry.span("outer"):
+                    with telemetry.span("large"):
+                        block = b"\x01" * (160 * 1024 * 1024)
+                        del block
+                    with telemetry.span("small"):
+                        pass
+                large, small, outer = telemetry.read_events()
+
+        self.assertGreater(large["peak_rss_mb"] - small["peak_rss_mb"], 100)
+        self.assertGreaterEqual(outer["peak_rss_mb"], large["peak_rss_mb"])
+
+    def test_fold_attaches_summary_and_flags_regressions_against_the_median(self):
+        history = [
+            {"timestamp_utc": str(day), "telemetry": {"model_fit": {"wall_seconds": seconds, "peak_rss_mb": 900.0}}}
+            for day, seconds in enumerate([100.0, 110.0, 90.0])
+        ]
+        history.append({"timestamp_utc": "latest"})
+        events = [
+            {"run_id": "7", "stage": "model_fit", "status": "ok", "wall_seconds": 150.0, "cpu_seconds": 140.0,
+             "peak_rss_mb": 950.0, "items": 1000},
+            {"run_id": "7", "stage": "arena", "status": "ok", "wall_seconds": 40.0, "cpu_seconds": 39.0,
+             "peak_rss_mb": 800.0, "items": 24},
+            {"run_id": "7", "stage": "arena", "status": "error", "wall_seconds": 2.0, "cpu_seconds": 1.0,
+             "peak_rss_mb": 810.0, "items": None},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            history_path = pathlib.Path(tmp) / "training_history.json"
+            log_path = pathlib.Path(tmp) / "telemetry.jsonl"
+            history_path.write_text(json.dumps(history), encoding="utf-8")
+            log_path.write_text("".join(json.dumps(event) + "\n" for event in events) + '{"torn', encoding="utf-8")
+            with redirect_stdout(io.StringIO()):
+                regressions = telemetry.fold_into_history(history_path, log_path)
+            records = json.loads(history_path.read_text(encoding="utf-8"))
+            self.assertFalse(log_path.exists())
+
+        latest = records[-1]
+        self.assertEqual(["7"], latest["telemetry_run_ids"])
+        self.assertEqual(
+            {"runs": 2, "wall_seconds": 42.0, "cpu_seconds": 40.0, "peak_rss_mb": 810.0, "items": 24, "errors": 1,
+             "items_per_second": round(24 / 42.0, 2)},
+            latest["telemetry"]["arena"],
+        )
+        self.assertEqual(
+            [{"stage": "model_fit", "metric": "wall_seconds", "value": 150.0, "median": 100.0, "ratio": 1.5}],
+            regressions,
+        )
+        self.assertEqual(regressions, latest["telemetry_regressions"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,7 +11,7 @@ import tensorflow as tf
 ML_DIR = pathlib.Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ML_DIR))
 
-from tfjs_layers_export import WEIGHTS_FILENAME, export_keras_layers_model
+from tfjs_layers_export import VALUE_MODEL_FILENAME, export_keras_layers_model
 
 
 class TFJSLayersExportTests(unittest.TestCase):
@@ -30,7 +30,9 @@ class TFJSLayersExportTests(unittest.TestCase):
             model_json = json.loads(model_json_path.read_text(encoding="utf-8"))
             weights = model_json["weightsManifest"][0]["weights"]
 
-            self.assertEqual([WEIGHTS_FILENAME], model_json["weightsManifest"][0]["paths"])
+            paths = model_json["weightsManifest"][0]["paths"]
+            self.assertEqual(1, len(paths))
+            self.assertRegex(paths[0], r"^group-[0-9a-f]{20}\.bin$")
             self.assertTrue(all(weight["dtype"] == "float32" for weight in weights))
             self.assertTrue(
                 all(weight["quantization"] == {"dtype": "float16"} for weight in weights)
@@ -38,7 +40,53 @@ class TFJSLayersExportTests(unittest.TestCase):
             self.assertFalse((out_dir / "group1-shard1of3.bin").exists())
 
             scalar_count = sum(np.prod(weight["shape"]) for weight in weights)
-            self.assertEqual(2 * scalar_count, (out_dir / WEIGHTS_FILENAME).stat().st_size)
+            self.assertEqual(2 * scalar_count, (out_dir / paths[0]).stat().st_size)
+            self.assertFalse((out_dir / VALUE_MODEL_FILENAME).exists())
+
+    def test_policy_value_export_adds_value_only_model_sharing_weights(self):
+        inputs = tf.keras.Input(shape=(4,), name="board")
+        trunk = tf.keras.layers.Dense(3, activation="relu", name="trunk_dense")(inputs)
+        policy = tf.keras.layers.Dense(5, name="policy_logits")(trunk)
+        value = tf.keras.layers.Dense(1, activation="tanh", name="value")(trunk)
+        model = tf.keras.Model(inputs, [policy, value])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out_dir = pathlib.Path(tmp)
+            model_json_path = export_keras_layers_model(model, out_dir)
+            model_json = json.loads(model_json_path.read_text(encoding="utf-8"))
+            value_json = json.loads((out_dir / VALUE_MODEL_FILENAME).read_text(encoding="utf-8"))
+
+            self.assertEqual(
+                [group for group in model_json["weightsManifest"] if group["weights"][0]["name"] != "policy_logits/kernel"],
+                value_json["weightsManifest"],
+            )
+            self.assertEqual(3, len(model_json["weightsManifest"]))
+            value_config = value_json["modelTopology"]["model_config"]["config"]
+            layer_names = {layer["config"]["name"] for layer in value_config["layers"]}
+            self.assertIn("value", layer_names)
+            self.assertNotIn("policy_logits", layer_names)
+
+    def test_unchanged_layers_keep_their_shard_names(self):
+        model = tf.keras.Sequential([
+            tf.keras.Input(shape=(4,)),
+            tf.keras.layers.Dense(8, name="first"),
+            tf.keras.layers.Dense(2, name="second"),
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out_dir = pathlib.Path(tmp)
+            first_export = json.loads(export_keras_layers_model(model, out_dir, shard_bytes=32).read_text())
+            kernel, bias = model.get_layer("second").get_weights()
+            model.get_layer("second").set_weights([kernel + 1.0, bias])
+            second_export = json.loads(export_keras_layers_model(model, out_dir, shard_bytes=32).read_text())
+
+            first_groups = [group["paths"] for group in first_export["weightsManifest"]]
+            second_groups = [group["paths"] for group in second_export["weightsManifest"]]
+            self.assertEqual(first_groups[0], second_groups[0])
+            self.assertGreater(len(first_groups[0]), 1)
+            self.assertNotEqual(first_groups[1], second_groups[1])
+            referenced = {path for paths in second_groups for path in paths}
+            self.assertEqual(referenced, {path.name for path in out_dir.glob("group*.bin")})
 
 
 if __name__ == "__main__":
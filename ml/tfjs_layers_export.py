@@ -6,17 +6,27 @@ This avoids the tensorflowjs Python converter dependency, which pulls in
 TensorFlow Decision Forests even though this project only exports a standard
 Keras Conv/Dense neural network.
 """
+from __future__ import annotations
+
+import hashlib
 import json
+import os
 import pathlib
+from typing import TYPE_CHECKING
 
 import numpy as np
-import tensorflow as tf
+
+if TYPE_CHECKING:
+    import tensorflow as tf
 
 
-WEIGHTS_FILENAME = "group1-shard1of1.bin"
+SHARD_BYTES = int(os.environ.get("AZ_TFJS_SHARD_BYTES", str(4 * 1024 * 1024)))
+VALUE_MODEL_FILENAME = "value_model.json"
 
 
 def keras_version() -> str:
+    import tensorflow as tf
+
     return getattr(tf.keras, "__version__", "unknown")
 
 
@@ -32,53 +42,110 @@ def float16_bytes(array: np.ndarray) -> bytes:
     return np.ascontiguousarray(array, dtype="<f2").tobytes(order="C")
 
 
-def export_keras_layers_model(model: tf.keras.Model, out_dir: pathlib.Path) -> pathlib.Path:
-    """Write a float16-quantized TFJS Layers model and one weight shard"""
-    out_dir.mkdir(parents=True, exist_ok=True)
+def value_head_model(model: tf.keras.Model) -> tf.keras.Model | None:
+    """Return a value-only view of a policy/value model that shares its layers"""
+    try:
+        value_layer = model.get_layer("value")
+    except ValueError:
+        return None
+    if len(model.outputs) < 2:
+        return None
+    import tensorflow as tf
 
-    for stale_shard in out_dir.glob("group*.bin"):
-        stale_shard.unlink()
+    return tf.keras.Model(model.inputs, value_layer.output, name="value_head")
+
+
+def layers_model_json(model: tf.keras.Model, weights_manifest: list[dict]) -> dict:
+    return {
+        "format": "layers-model",
+        "generatedBy": f"keras v{keras_version()}",
+        "convertedBy": "ml/tfjs_layers_export.py",
+        "modelTopology": {
+            "keras_version": keras_version(),
+            "backend": "tensorflow",
+            "model_config": json.loads(model.to_json()),
+        },
+        "weightsManifest": weights_manifest,
+    }
+
+
+def write_content_addressed_shards(data: bytes, out_dir: pathlib.Path, shard_bytes: int = SHARD_BYTES) -> list[str]:
+    """Split data into fixed-size shards named by their SHA-256 so browsers can cache them immutably"""
+    shard_bytes = max(1, int(shard_bytes))
+    paths = []
+    for start in range(0, len(data), shard_bytes):
+        chunk = data[start:start + shard_bytes]
+        filename = f"group-{hashlib.sha256(chunk).hexdigest()[:20]}.bin"
+        shard_path = out_dir / filename
+        if not shard_path.exists() or shard_path.stat().st_size != len(chunk):
+            shard_path.write_bytes(chunk)
+        paths.append(filename)
+    return paths
+
+
+def export_keras_layers_model(
+    model: tf.keras.Model,
+    out_dir: pathlib.Path,
+    shard_bytes: int = SHARD_BYTES,
+) -> pathlib.Path:
+    """
+    Write a float16-quantized TFJS Layers model with content-addressed shards.
+
+    Each layer gets its own manifest group split into shards of at most
+    shard_bytes, so a layer whose weights did not change keeps its shard
+    names between exports and only model.json needs revalidating.
+
+    Policy/value models also get value_model.json, a value-head-only topology
+    whose manifest lists just the trunk and value groups. The browser uses it
+    for leaf evaluations, so it never computes or downloads the policy logits.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
 
     weights_manifest = []
-    weight_chunks = []
     for layer in model.layers:
+        layer_weights = []
+        layer_chunks = []
         for weight in layer.weights:
             array = weight.numpy()
             if not np.issubdtype(array.dtype, np.floating):
                 raise TypeError(f"Unsupported non-floating weight {weight.name}: {array.dtype}")
-            weights_manifest.append({
+            layer_weights.append({
                 "name": weight_name(layer, weight),
                 "shape": list(array.shape),
                 "dtype": "float32",
                 "quantization": {"dtype": "float16"},
             })
-            weight_chunks.append(float16_bytes(array))
+            layer_chunks.append(float16_bytes(array))
+        if layer_weights:
+            weights_manifest.append({
+                "paths": write_content_addressed_shards(b"".join(layer_chunks), out_dir, shard_bytes),
+                "weights": layer_weights,
+            })
 
-    (out_dir / WEIGHTS_FILENAME).write_bytes(b"".join(weight_chunks))
+    if not weights_manifest:
+        raise ValueError("TFJS export produced no weights")
 
-    model_json = {
-        "format": "layers-model",
-        "generatedBy": f"keras v{keras_version()}",
-        "convertedBy": "ml/tfjs_layers_export.py",
-        "modelTopology": {
-            "keras_version": keras_version(),
-            "backend": "tensorflow",
-            "model_config": json.loads(model.to_json()),
-        },
-        "weightsManifest": [
-            {
-                "paths": [WEIGHTS_FILENAME],
-                "weights": weights_manifest,
-            }
-        ],
-    }
+    referenced = {path for group in weights_manifest for path in group["paths"]}
+    for stale_shard in out_dir.glob("group*.bin"):
+        if stale_shard.name not in referenced:
+            stale_shard.unlink()
+    for relative_path in referenced:
+        if not (out_dir / relative_path).exists():
+            raise FileNotFoundError(f"TFJS weight shard missing: {relative_path}")
 
     model_json_path = out_dir / "model.json"
-    model_json_path.write_text(json.dumps(model_json), encoding="utf-8")
-
-    if not weights_manifest:
-        raise ValueError("TFJS export produced no weights")
-    if not (out_dir / WEIGHTS_FILENAME).exists():
-        raise FileNotFoundError(f"TFJS weight shard missing: {WEIGHTS_FILENAME}")
+    model_json_path.write_text(json.dumps(layers_model_json(model, weights_manifest)), encoding="utf-8")
+
+    value_json_path = out_dir / VALUE_MODEL_FILENAME
+    value_model = value_head_model(model)
+    if value_model is not None:
+        value_names = {weight_name(layer, weight) for layer in value_model.layers for weight in layer.weights}
+        value_manifest = [
+            group for group in weights_manifest
+            if all(weight["name"] in value_names for weight in group["weights"])
+        ]
+        value_json_path.write_text(json.dumps(layers_model_json(value_model, value_manifest)), encoding="utf-8")
+    elif value_json_path.exists():
+        value_json_path.unlink()
 
     return model_json_path
@@ -1,26 +1,42 @@
 # ml/train.py
 """Train the chess policy/value model and preserve a compatible checkpoint."""
+from __future__ import annotations
+
 import os
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
 
 import datetime as dt
+import functools
 import json
 import pathlib
 import random
+from typing import TYPE_CHECKING
 
-import chess
 import numpy as np
-import tensorflow as tf
 
+from dataset import (
+    cp_to_value,
+    dense_policy_from_sparse,
+    encode_sample,
+    encode_samples,
+    normalize_labels,
+    normalize_sparse_policy,
+)
 from features import PLANES, board_to_features
-from fen_utils import canonical_fen
+from label_store import open_store
 from policy_map import (
     LEGACY_POLICY_SIZE,
-    POLICY_CHANNELS,
     POLICY_SIZE,
     POLICY_VERSION,
-    normalize_policy_index,
+    V2_POLICY_SIZE,
+    source_policy_indices,
 )
+from position_hash import as_index, fen_hash
+import telemetry
+from tfjs_layers_export import VALUE_MODEL_FILENAME
+
+if TYPE_CHECKING:
+    import tensorflow as tf
 
 LABELS = pathlib.Path("ml/data/labels.json")
 STOCKFISH_REPLAY_BUFFER = pathlib.Path("ml/data/replay_buffer.json")
@@ -30,9 +46,6 @@ CHECKPOINT_DIR = pathlib.Path("ml/checkpoints")
 CHECKPOINT_MODEL = CHECKPOINT_DIR / "chess_eval.keras"
 OUT_DIR = pathlib.Path("public/nn")
 
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
-
 BOARD_H, BOARD_W = 8, 8
 FLAT_SIZE = BOARD_H * BOARD_W * PLANES
 MAX_REPLAY_ITEMS = int(os.environ.get("MAX_REPLAY_ITEMS", "50000"))
@@ -48,9 +61,13 @@ STOCKFISH_POLICY_WEIGHT = float(os.environ.get("AZ_STOCKFISH_POLICY_WEIGHT", "1.
 MERGE_FRESH_STOCKFISH_LABELS = os.environ.get("AZ_MERGE_FRESH_STOCKFISH_LABELS", "1") != "0"
 TRAIN_SEED = int(os.environ.get("TRAIN_SEED", "42"))
 
-random.seed(TRAIN_SEED)
-np.random.seed(TRAIN_SEED)
-tf.keras.utils.set_random_seed(TRAIN_SEED)
+
+def seed_everything(seed: int = TRAIN_SEED) -> None:
+    import tensorflow as tf
+
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.keras.utils.set_random_seed(seed)
 
 
 def read_json_list(path: pathlib.Path) -> list[dict]:
@@ -68,211 +85,128 @@ def write_json(path: pathlib.Path, data) -> None:
     path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
 
 
-def normalize_sparse_policy(policy_items, fen: str, policy_version: int) -> list[list[float]]:
-    board = chess.Board(fen)
-    by_index = {}
-    for item in policy_items or []:
-        if not isinstance(item, (list, tuple)) or len(item) != 2:
-            continue
-        try:
-            index = normalize_policy_index(int(item[0]), board, policy_version)
-            probability = float(item[1])
-        except (TypeError, ValueError):
-            continue
-        if probability > 0 and np.isfinite(probability):
-            by_index[index] = by_index.get(index, 0.0) + probability
-
-    total = sum(by_index.values())
-    if total <= 0:
-        return []
-    return [[index, probability / total] for index, probability in sorted(by_index.items())]
-
+def merge_stockfish_replay_buffer(new_items: list[dict]) -> tuple[list[dict], int]:
+    with open_store(STOCKFISH_REPLAY_BUFFER) as store:
+        return _merge_into_store(store, normalize_labels(new_items))
 
-def normalize_labels(items: list[dict]) -> list[dict]:
-    normalized = []
-    for item in items:
-        fen = item.get("fen")
-        if not fen:
-            continue
-        try:
-            fen = canonical_fen(fen)
-            cp = float(item.get("cp", 0.0))
-            policy_version = int(item.get("policy_version", 1))
-        except (TypeError, ValueError):
-            continue
-        policy = normalize_sparse_policy(item.get("policy"), fen, policy_version)
-        normalized.append(
-            {
-                "fen": fen,
-                "cp": cp,
-                "policy_version": POLICY_VERSION if policy else policy_version,
-                "policy": policy,
-            }
-        )
-    return normalized
 
+def _merge_into_store(store, new_items: list[dict]) -> tuple[list[dict], int]:
+    existing_items = store.labels()
 
-def merge_stockfish_replay_buffer(new_items: list[dict]) -> tuple[list[dict], int]:
-    existing_items = normalize_labels(read_json_list(STOCKFISH_REPLAY_BUFFER))
-    new_items = normalize_labels(new_items)
-
-    existing_by_fen = {item["fen"]: item for item in existing_items}
-    new_by_fen = {item["fen"]: item for item in new_items}
-    novel_count = sum(fen not in existing_by_fen for fen in new_by_fen)
-    by_fen = dict(existing_by_fen)
-    for fen, item in list(new_by_fen.items()):
-        existing = by_fen.get(item["fen"])
+    # Positions are keyed by their 64-bit Zobrist hash rather than the FEN string.
+    existing_by_key = {fen_hash(item["fen"]): item for item in existing_items}
+    new_by_key = {fen_hash(item["fen"]): item for item in new_items}
+    novel_count = sum(key not in existing_by_key for key in new_by_key)
+    by_key = dict(existing_by_key)
+    for key, item in list(new_by_key.items()):
+        existing = by_key.get(key)
         if existing and existing.get("policy") and not item.get("policy"):
             item = {**item, "policy_version": existing["policy_version"], "policy": existing["policy"]}
-        new_by_fen[fen] = item
-        by_fen[item["fen"]] = item
+        new_by_key[key] = item
+        by_key[key] = item
 
-    if len(new_by_fen) >= MAX_REPLAY_ITEMS:
-        merged = list(new_by_fen.values())
+    if len(new_by_key) >= MAX_REPLAY_ITEMS:
+        merged = list(new_by_key.values())
         random.shuffle(merged)
         merged = merged[:MAX_REPLAY_ITEMS]
     else:
-        old_items = [item for fen, item in by_fen.items() if fen not in new_by_fen]
+        old_items = [item for key, item in by_key.items() if key not in new_by_key]
         random.shuffle(old_items)
-        room_for_old = MAX_REPLAY_ITEMS - len(new_by_fen)
-        merged = list(new_by_fen.values()) + old_items[:room_for_old]
+        room_for_old = MAX_REPLAY_ITEMS - len(new_by_key)
+        merged = list(new_by_key.values()) + old_items[:room_for_old]
 
     random.shuffle(merged)
-    write_json(STOCKFISH_REPLAY_BUFFER, merged)
+    store.replace(merged, STOCKFISH_REPLAY_BUFFER)
     policy_count = sum(bool(item.get("policy")) for item in merged)
     print(
         f"[train] Stockfish replay buffer {len(merged)} positions, "
-        f"incoming {len(new_by_fen)}, truly new {novel_count}, policy targets {policy_count}"
+        f"incoming {len(new_by_key)}, truly new {novel_count}, policy targets {policy_count}"
     )
     return merged, novel_count
 
 
-def cp_to_value(cp: float) -> float:
-    return float(np.tanh(np.clip(cp, -2000.0, 2000.0) / 600.0))
+def without_excluded(items: list[dict], excluded_fens=None) -> list[dict]:
+    """Drop rows whose position is excluded. `excluded_fens` is an iterable of FENs or a position_hash.HashIndex."""
+    if not excluded_fens:
+        return items
+    held_out = as_index(excluded_fens).contains_fens(item["fen"] for item in items)
+    return [item for item, excluded in zip(items, held_out) if not excluded]
 
 
-def dense_policy_from_sparse(policy_items, fen: str | None = None, policy_version: int = 1) -> np.ndarray:
-    policy = np.zeros((POLICY_SIZE,), dtype=np.float32)
-    board = chess.Board(fen) if fen else None
-    for item in policy_items or []:
-        if not isinstance(item, (list, tuple)) or len(item) != 2:
-            continue
-        raw_index, probability = item
-        try:
-            index = normalize_policy_index(int(raw_index), board, int(policy_version))
-            probability = float(probability)
-        except (TypeError, ValueError):
-            continue
-        if probability > 0:
-            policy[index] += probability
-    total = float(np.sum(policy))
-    if total > 0:
-        policy /= total
-    return policy
-
-
-def load_self_play_samples(excluded_fens: set[str] | None = None):
-    excluded_fens = excluded_fens or set()
-    items = read_json_list(SELF_PLAY_BUFFER)[-MAX_SELF_PLAY_TRAIN:]
-    X, policies, values, value_weights = [], [], [], []
-    for item in items:
-        fen = item.get("fen")
-        if not fen or fen in excluded_fens:
-            continue
-        policy = dense_policy_from_sparse(
-            item.get("policy"),
-            fen=fen,
-            policy_version=int(item.get("policy_version", 1)),
-        )
-        if float(np.sum(policy)) <= 0:
-            continue
-        try:
-            outcome = float(item.get("z"))
-        except (TypeError, ValueError):
-            continue
-        X.append(board_to_features(fen))
-        policies.append(policy)
-        values.append(np.clip(outcome, -1.0, 1.0))
-        value_weights.append(1.0 if outcome != 0.0 or item.get("termination") else 0.0)
+def self_play_training_rows(excluded_fens=None) -> list[dict]:
+    items = [item for item in read_json_list(SELF_PLAY_BUFFER)[-MAX_SELF_PLAY_TRAIN:] if item.get("fen")]
+    return [{**item, "source": "self_play"} for item in without_excluded(items, excluded_fens)]
+
+
+def stockfish_training_rows(excluded_fens=None) -> tuple[list[dict], int]:
+    fresh_items = normalize_labels(read_json_list(LABELS)) if MERGE_FRESH_STOCKFISH_LABELS else []
+    all_items, novel_count = merge_stockfish_replay_buffer(fresh_items)
+    items = without_excluded(all_items, excluded_fens)[-MAX_STOCKFISH_TRAIN:]
+    return [{**item, "source": "stockfish"} for item in items], novel_count
+
+
+def training_sample_encoder():
+    return functools.partial(
+        encode_sample,
+        stockfish_policy_weight=STOCKFISH_POLICY_WEIGHT,
+        stockfish_value_weight=STOCKFISH_VALUE_WEIGHT,
+        require_stockfish_policy=False,
+    )
+
+
+def _print_self_play_usage(value_weights) -> None:
     print(
         f"[train] using {sum(weight > 0 for weight in value_weights)} verified "
         f"self-play value targets from {len(value_weights)} policy samples"
     )
-    return X, policies, values, value_weights
 
 
-def load_stockfish_samples(excluded_fens: set[str] | None = None):
-    excluded_fens = excluded_fens or set()
-    fresh_items = normalize_labels(read_json_list(LABELS)) if MERGE_FRESH_STOCKFISH_LABELS else []
-    all_items, novel_count = merge_stockfish_replay_buffer(fresh_items)
-    items = [item for item in all_items if item["fen"] not in excluded_fens][-MAX_STOCKFISH_TRAIN:]
-    X, policies, values, policy_weights = [], [], [], []
-    for item in items:
-        X.append(board_to_features(item["fen"]))
-        policy = dense_policy_from_sparse(
-            item.get("policy"),
-            fen=item["fen"],
-            policy_version=int(item.get("policy_version", POLICY_VERSION)),
-        )
-        policies.append(policy)
-        policy_weights.append(STOCKFISH_POLICY_WEIGHT if float(np.sum(policy)) > 0 else 0.0)
-        values.append(cp_to_value(float(item["cp"])))
+def _print_stockfish_usage(policy_weights) -> None:
     print(f"[train] using {sum(weight > 0 for weight in policy_weights)} Stockfish policy targets")
-    return X, policies, values, policy_weights, novel_count, len(items)
 
 
-def load_dataset(excluded_fens: set[str] | None = None):
-    self_X, self_policy, self_value, self_value_weights = load_self_play_samples(excluded_fens)
-    stock_X, stock_policy, stock_value, stock_policy_weights, fresh_count, stockfish_count = load_stockfish_samples(
-        excluded_fens
+def load_self_play_samples(excluded_fens=None):
+    X, policies, values, _, value_weights, _ = encode_samples(
+        self_play_training_rows(excluded_fens),
+        training_sample_encoder(),
     )
-
-    X = []
-    policy_y = []
-    value_y = []
-    policy_weights = []
-    value_weights = []
-
-    for features, policy, value, value_weight in zip(
-        self_X,
-        self_policy,
-        self_value,
-        self_value_weights,
-    ):
-        X.append(features)
-        policy_y.append(policy)
-        value_y.append(value)
-        policy_weights.append(1.0)
-        value_weights.append(value_weight)
-
-    for features, policy, value, policy_weight in zip(
-        stock_X,
-        stock_policy,
-        stock_value,
-        stock_policy_weights,
-    ):
-        X.append(features)
-        policy_y.append(policy)
-        value_y.append(value)
-        policy_weights.append(policy_weight)
-        value_weights.append(STOCKFISH_VALUE_WEIGHT)
-
-    if not X:
+    _print_self_play_usage(value_weights)
+    return list(X), list(policies), values.tolist(), value_weights.tolist()
+
+
+def load_stockfish_samples(excluded_fens=None):
+    rows, novel_count = stockfish_training_rows(excluded_fens)
+    X, policies, values, policy_weights, _, _ = encode_samples(rows, training_sample_encoder())
+    _print_stockfish_usage(policy_weights)
+    return list(X), list(policies), values.tolist(), policy_weights.tolist(), novel_count, len(rows)
+
+
+@telemetry.traced("load_dataset")
+def load_dataset(excluded_fens=None):
+    self_rows = self_play_training_rows(excluded_fens)
+    stockfish_rows, fresh_count = stockfish_training_rows(excluded_fens)
+    with telemetry.span("featurize", items=len(self_rows) + len(stockfish_rows)):
+        X, policy_y, value_y, policy_weights, value_weights, rows = encode_samples(
+            self_rows + stockfish_rows,
+            training_sample_encoder(),
+            shuffle=random.shuffle,
+        )
+    telemetry.add_items(len(rows))
+    from_self_play = rows < len(self_rows)
+    _print_self_play_usage(value_weights[from_self_play])
+    _print_stockfish_usage(policy_weights[~from_self_play])
+    if not len(X):
         raise ValueError("no training samples found")
 
-    combined = list(zip(X, policy_y, value_y, policy_weights, value_weights))
-    random.shuffle(combined)
-    X, policy_y, value_y, policy_weights, value_weights = zip(*combined)
-
     return (
-        np.stack(X).astype(np.float32),
-        np.stack(policy_y).astype(np.float32),
-        np.array(value_y, dtype=np.float32).reshape(-1, 1),
-        np.array(policy_weights, dtype=np.float32),
-        np.array(value_weights, dtype=np.float32),
-        len(self_X),
+        X,
+        policy_y,
+        value_y.reshape(-1, 1),
+        policy_weights,
+        value_weights,
+        int(np.sum(from_self_play)),
         fresh_count,
-        stockfish_count,
+        len(stockfish_rows),
     )
 
 
@@ -288,6 +222,8 @@ def ensure_4d_board(X: np.ndarray) -> np.ndarray:
 
 
 def compile_model(model: tf.keras.Model, learning_rate: float) -> tf.keras.Model:
+    import tensorflow as tf
+
     model.compile(
         optimizer=tf.keras.optimizers.Adam(learning_rate),
         loss=[
@@ -301,6 +237,8 @@ def compile_model(model: tf.keras.Model, learning_rate: float) -> tf.keras.Model
 
 
 def build_model(input_shape=(BOARD_H, BOARD_W, PLANES), learning_rate=COLD_START_LR):
+    import tensorflow as tf
+
     inputs = tf.keras.Input(shape=input_shape, name="board")
     x = tf.keras.layers.Conv2D(64, kernel_size=3, padding="same", activation="relu", name="trunk_conv_1")(inputs)
     x = tf.keras.layers.Conv2D(64, kernel_size=3, padding="same", activation="relu", name="trunk_conv_2")(x)
@@ -340,13 +278,18 @@ def _find_layer(model, *names):
 
 
 def migrate_legacy_model(model: tf.keras.Model, learning_rate: float) -> tf.keras.Model | None:
-    """Transfer useful v1 weights into the expanded feature/action model."""
+    """Transfer useful v1/v2 weights into the current feature/compact-action model."""
     try:
         old_input_shape = tuple(model.input_shape[1:])
         old_policy_size = int(model.outputs[0].shape[-1])
     except (AttributeError, TypeError, ValueError, IndexError):
         return None
-    if old_input_shape != (8, 8, 13) or old_policy_size != LEGACY_POLICY_SIZE:
+    legacy_layouts = {
+        ((8, 8, 13), LEGACY_POLICY_SIZE): 1,
+        ((BOARD_H, BOARD_W, PLANES), V2_POLICY_SIZE): 2,
+    }
+    source_version = legacy_layouts.get((old_input_shape, old_policy_size))
+    if source_version is None:
         return None
 
     migrated = build_model((BOARD_H, BOARD_W, PLANES), learning_rate)
@@ -367,16 +310,20 @@ def migrate_legacy_model(model: tf.keras.Model, learning_rate: float) -> tf.kera
     migrated.get_layer("value").set_weights(old_value.get_weights())
 
     old_policy_kernel, old_policy_bias = old_policy.get_weights()
-    new_policy_kernel = np.repeat(old_policy_kernel, POLICY_CHANNELS, axis=1)
-    new_policy_bias = np.repeat(old_policy_bias, POLICY_CHANNELS)
-    migrated.get_layer("policy_logits").set_weights([new_policy_kernel, new_policy_bias])
-    print("[train] migrated legacy 13-plane/4096-action checkpoint to the v2 representation")
+    columns = np.asarray(source_policy_indices(source_version), dtype=np.int64)
+    migrated.get_layer("policy_logits").set_weights([old_policy_kernel[:, columns], old_policy_bias[columns]])
+    print(
+        f"[train] migrated {old_input_shape[-1]}-plane/{old_policy_size}-action checkpoint "
+        f"to the v{POLICY_VERSION} {POLICY_SIZE}-action representation"
+    )
     return migrated
 
 
 def load_checkpoint_raw(*, compile_saved: bool, quiet: bool = False):
     if not CHECKPOINT_MODEL.exists():
         return None
+    import tensorflow as tf
+
     try:
         return tf.keras.models.load_model(CHECKPOINT_MODEL, compile=compile_saved)
     except Exception as exc:
@@ -399,6 +346,8 @@ def load_saved_dual_head_model(
         try:
             model.optimizer.learning_rate.assign(learning_rate)
         except (AttributeError, TypeError, ValueError):
+            import tensorflow as tf
+
             tf.keras.backend.set_value(model.optimizer.learning_rate, learning_rate)
         return model
     return compile_model(model, learning_rate)
@@ -541,6 +490,16 @@ def smoke_check_tfjs_json(path: pathlib.Path) -> None:
             assert "batchInputShape" in layer.get("config", {}), "InputLayer missing batchInputShape"
 
 
+def finalize_tfjs_export(out_dir: pathlib.Path) -> pathlib.Path:
+    """Patch and check model.json plus the value-only companion model when present."""
+    model_json = out_dir / "model.json"
+    for path in (model_json, out_dir / VALUE_MODEL_FILENAME):
+        if path.exists():
+            patch_tfjs_model_json(path)
+            smoke_check_tfjs_json(path)
+    return model_json
+
+
 def add_eval_metrics(record: dict, prefix: str, metrics: dict | None) -> None:
     if not metrics:
         return
@@ -599,7 +558,11 @@ def split_arrays(*arrays, train_ratio=0.9):
     return [(array[:split], array[split:]) for array in arrays]
 
 
+@telemetry.traced("train")
 def main():
+    import tensorflow as tf
+
+    seed_everything()
     X, policy_y, value_y, policy_weights, value_weights, self_play_count, fresh_count, stockfish_count = load_dataset()
     X = ensure_4d_board(X)
     (Xtr, Xva), (Ptr, Pva), (Vtr, Vva), (PWtr, PWva), (VWtr, VWva) = split_arrays(
@@ -612,30 +575,31 @@ def main():
     epochs = CONTINUE_EPOCHS if resumed else COLD_START_EPOCHS
     baseline_eval = evaluate_model(baseline_model, Xva, Pva, Vva, PWva, VWva, "previous")
 
-    history = model.fit(
-        Xtr,
-        [Ptr, Vtr],
-        validation_data=(Xva, [Pva, Vva], [PWva, VWva]),
-        sample_weight=[PWtr, VWtr],
-        epochs=epochs,
-        batch_size=256,
-        verbose=2,
-        callbacks=[tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=2, restore_best_weights=True)],
-        shuffle=True,
-    )
+    with telemetry.span("model_fit", items=len(Xtr)):
+        history = model.fit(
+            Xtr,
+            [Ptr, Vtr],
+            validation_data=(Xva, [Pva, Vva], [PWva, VWva]),
+            sample_weight=[PWtr, VWtr],
+            epochs=epochs,
+            batch_size=256,
+            verbose=2,
+            callbacks=[tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=2, restore_best_weights=True)],
+            shuffle=True,
+        )
 
     candidate_eval = evaluate_model(model, Xva, Pva, Vva, PWva, VWva, "candidate")
     accepted, gate_reason = should_accept_candidate(candidate_eval, baseline_eval, resumed)
     print(f"[train] candidate gate: accepted={accepted} reason={gate_reason}")
 
     if accepted:
-        model.save(CHECKPOINT_MODEL)
-        print(f"[train] saved accepted brain to {CHECKPOINT_MODEL}")
-        import tensorflowjs as tfjs
-        tfjs.converters.save_keras_model(model, str(OUT_DIR))
-        model_json = OUT_DIR / "model.json"
-        patch_tfjs_model_json(model_json)
-        smoke_check_tfjs_json(model_json)
+        with telemetry.span("tfjs_export"):
+            CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+            model.save(CHECKPOINT_MODEL)
+            print(f"[train] saved accepted brain to {CHECKPOINT_MODEL}")
+            import tensorflowjs as tfjs
+            tfjs.converters.save_keras_model(model, str(OUT_DIR))
+            model_json = finalize_tfjs_export(OUT_DIR)
         print(f"[train] saved accepted TFJS model to {model_json}")
     else:
         print("[train] rejected candidate; keeping previous checkpoint and browser model")
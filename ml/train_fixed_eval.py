@@ -1,15 +1,28 @@
 # ml/train_fixed_eval.py
 """train with persistent neural and search-quality holdouts"""
+from __future__ import annotations
+
 import hashlib
+import json
 import os
+import pathlib
 import random
+import shutil
+from typing import TYPE_CHECKING
 
 import chess
 import numpy as np
-import tensorflow as tf
 
+import gating
+import mcts_stats
 import train
-from self_play import arena_score, run_search_batch
+from label_store import open_store
+from position_hash import HashIndex
+import telemetry
+from self_play import SELF_PLAY_STATS, arena_score, play_arena_game, run_search_batch
+
+if TYPE_CHECKING:
+    import tensorflow as tf
 
 FIXED_EVAL_SET = train.pathlib.Path("ml/data/fixed_eval_set_v3.json")
 FIXED_EVAL_SELF = int(os.environ.get("AZ_FIXED_EVAL_SELF", "512"))
@@ -24,6 +37,10 @@ MCTS_EVAL_POSITIONS = int(os.environ.get("AZ_MCTS_EVAL_POSITIONS", "48"))
 MCTS_EVAL_SEARCHES = int(os.environ.get("AZ_MCTS_EVAL_SEARCHES", "64"))
 MIN_MCTS_ALIGNMENT_IMPROVEMENT = float(os.environ.get("AZ_MIN_MCTS_ALIGNMENT_IMPROVEMENT", "0.0001"))
 MIN_MCTS_TOP_MOVE_IMPROVEMENT = float(os.environ.get("AZ_MIN_MCTS_TOP_MOVE_IMPROVEMENT", "0.0"))
+FIXED_EVAL_CACHE = pathlib.Path(os.environ.get("AZ_FIXED_EVAL_CACHE", "ml/data/fixed_eval_cache"))
+FIXED_EVAL_BATCH = int(os.environ.get("AZ_FIXED_EVAL_BATCH", "256"))
+FIXED_EVAL_ENCODE_ROWS = int(os.environ.get("AZ_FIXED_EVAL_ENCODE_ROWS", "4096"))
+HOLDOUT_CACHE_VERSION = 1
 _EPS = 1e-7
 
 
@@ -87,8 +104,9 @@ def create_fixed_eval_set() -> list[dict]:
             self_items.append(sample)
 
     stockfish_by_fen = {}
-    source_items = train.read_json_list(train.STOCKFISH_REPLAY_BUFFER) + train.read_json_list(train.LABELS)
-    for item in train.normalize_labels(source_items):
+    with open_store(train.STOCKFISH_REPLAY_BUFFER) as store:
+        source_items = store.labels()
+    for item in source_items + train.normalize_labels(train.read_json_list(train.LABELS)):
         sample = _valid_stockfish_sample(item)
         if sample is not None:
             stockfish_by_fen[sample["fen"]] = sample
@@ -136,67 +154,17 @@ def balanced_arena_fens(samples: list[dict], count: int) -> list[str]:
 
 
 def fixed_eval_arrays(samples: list[dict]):
-    X = []
-    policy_y = []
-    value_y = []
-    policy_weights = []
-    value_weights = []
-    self_count = 0
-    stockfish_count = 0
-    for sample in samples:
-        source = sample.get("source")
-        fen = sample.get("fen")
-        if not fen:
-            continue
-
-        if source == "self_play":
-            policy = train.dense_policy_from_sparse(
-                sample.get("policy"),
-                fen=fen,
-                policy_version=int(sample.get("policy_version", 1)),
-            )
-            if float(np.sum(policy)) <= 0:
-                continue
-            try:
-                value = float(sample.get("z"))
-            except (TypeError, ValueError):
-                continue
-            X.append(train.board_to_features(fen))
-            policy_y.append(policy)
-            value_y.append(np.clip(value, -1.0, 1.0))
-            policy_weights.append(1.0)
-            value_weights.append(1.0 if value != 0.0 or sample.get("termination") else 0.0)
-            self_count += 1
-        elif source == "stockfish":
-            try:
-                cp = float(sample.get("cp", 0.0))
-            except (TypeError, ValueError):
-                continue
-            policy = train.dense_policy_from_sparse(
-                sample.get("policy"),
-                fen=fen,
-                policy_version=int(sample.get("policy_version", train.POLICY_VERSION)),
-            )
-            if float(np.sum(policy)) <= 0:
-                continue
-            X.append(train.board_to_features(fen))
-            policy_y.append(policy)
-            value_y.append(train.cp_to_value(cp))
-            policy_weights.append(1.0)
-            value_weights.append(1.0)
-            stockfish_count += 1
-
-    if not X:
+    X, P_arr, V_arr, PW_arr, VW_arr, rows = train.encode_samples(samples)
+    if not len(X):
         raise ValueError("fixed evaluation set has no usable samples")
 
-    X_arr = train.ensure_4d_board(np.stack(X).astype(np.float32))
-    P_arr = np.stack(policy_y).astype(np.float32)
-    V_arr = np.array(value_y, dtype=np.float32).reshape(-1, 1)
-    PW_arr = np.array(policy_weights, dtype=np.float32)
-    VW_arr = np.array(value_weights, dtype=np.float32)
+    X_arr = train.ensure_4d_board(X)
+    V_arr = V_arr.reshape(-1, 1)
     if not (len(X_arr) == len(P_arr) == len(V_arr) == len(PW_arr) == len(VW_arr)):
         raise ValueError("fixed evaluation arrays have inconsistent lengths")
 
+    self_count = sum(samples[row].get("source") == "self_play" for row in rows)
+    stockfish_count = len(rows) - self_count
     print(
         f"[train] fixed holdout {len(X_arr)} positions "
         f"(self-play {self_count}, Stockfish {stockfish_count})"
@@ -210,46 +178,213 @@ def _softmax_cross_entropy(labels: np.ndarray, logits: np.ndarray) -> np.ndarray
     return -np.sum(labels * log_probs, axis=1)
 
 
-def evaluate_fixed_model(model: tf.keras.Model | None, X, P, V, PW, VW, label: str) -> dict | None:
-    if model is None:
-        return None
-    try:
-        predictions = model.predict(X, batch_size=256, verbose=0)
-    except Exception as exc:
-        print(f"[train] could not predict with {label} model: {exc}")
-        return None
-    if not isinstance(predictions, (list, tuple)) or len(predictions) != 2:
-        print(f"[train] could not evaluate {label} model: expected two outputs")
-        return None
+class FixedHoldout:
+    """Fixed-holdout tensors in compact form: bit-packed board planes and sparse policy targets."""
+
+    FIELDS = (
+        "planes",
+        "policy_offsets",
+        "policy_indices",
+        "policy_values",
+        "values",
+        "policy_weights",
+        "value_weights",
+    )
 
-    policy_logits = np.asarray(predictions[0], dtype=np.float32)
-    value_prediction = np.asarray(predictions[1], dtype=np.float32).reshape(-1, 1)
-    if policy_logits.shape != P.shape or value_prediction.shape != V.shape:
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.arrays = arrays
+
+    def __len__(self) -> int:
+        return len(self.arrays["values"])
+
+    @classmethod
+    def from_arrays(cls, X, P, V, PW, VW) -> FixedHoldout:
+        flat = np.asarray(X).reshape(len(X), -1)
+        if not np.array_equal(flat, flat.astype(bool)):
+            raise ValueError("fixed holdout board planes are not binary")
+        rows, columns = np.nonzero(P)
+        offsets = np.zeros(len(P) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(P)), out=offsets[1:])
+        return cls({
+            "planes": np.packbits(flat.astype(bool), axis=1),
+            "policy_offsets": offsets,
+            "policy_indices": columns.astype(np.int32),
+            "policy_values": np.asarray(P, dtype=np.float32)[rows, columns],
+            "values": np.asarray(V, dtype=np.float32).reshape(-1),
+            "policy_weights": np.asarray(PW, dtype=np.float32).reshape(-1),
+            "value_weights": np.asarray(VW, dtype=np.float32).reshape(-1),
+        })
+
+    @classmethod
+    def concatenate(cls, parts: list[FixedHoldout]) -> FixedHoldout:
+        arrays = {
+            field: np.concatenate([part.arrays[field] for part in parts])
+            for field in cls.FIELDS
+            if field != "policy_offsets"
+        }
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for part in parts:
+            offsets.append(part.arrays["policy_offsets"][1:] + offsets[-1][-1])
+        arrays["policy_offsets"] = np.concatenate(offsets)
+        return cls(arrays)
+
+    @classmethod
+    def encode(cls, samples: list[dict], chunk_rows: int = FIXED_EVAL_ENCODE_ROWS) -> FixedHoldout:
+        """Encode `chunk_rows` samples at a time, so only one chunk is ever held as dense tensors."""
+        parts = []
+        self_count = 0
+        for start in range(0, len(samples), max(1, chunk_rows)):
+            chunk = samples[start:start + max(1, chunk_rows)]
+            X, P, V, PW, VW, rows = train.encode_samples(chunk)
+            if not len(X):
+                continue
+            parts.append(cls.from_arrays(X, P, V, PW, VW))
+            self_count += sum(chunk[row].get("source") == "self_play" for row in rows)
+        if not parts:
+            raise ValueError("fixed evaluation set has no usable samples")
+        holdout = cls.concatenate(parts)
         print(
-            f"[train] could not evaluate {label} model: output shapes "
-            f"{policy_logits.shape}/{value_prediction.shape} do not match {P.shape}/{V.shape}"
+            f"[train] fixed holdout {len(holdout)} positions "
+            f"(self-play {self_count}, Stockfish {len(holdout) - self_count})"
         )
-        return None
+        return holdout
 
-    policy_denominator = max(float(np.sum(PW)), _EPS)
-    value_denominator = max(float(np.sum(VW)), _EPS)
-    policy_loss = float(np.sum(_softmax_cross_entropy(P, policy_logits) * PW) / policy_denominator)
-    value_error = (V - value_prediction).reshape(-1)
-    value_loss = float(np.sum(np.square(value_error) * VW) / value_denominator)
-    value_mae = float(np.sum(np.abs(value_error) * VW) / value_denominator)
-    total_loss = policy_loss + value_loss
+    def save(self, directory: pathlib.Path) -> None:
+        temporary = directory.with_name(f".{directory.name}.{os.getpid()}.tmp")
+        temporary.mkdir(parents=True, exist_ok=True)
+        for field in self.FIELDS:
+            np.save(temporary / f"{field}.npy", self.arrays[field])
+        try:
+            os.replace(temporary, directory)
+        except OSError:
+            # Another run cached the same holdout first.
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: pathlib.Path) -> FixedHoldout:
+        # Memory-mapped, so only the batch being evaluated is ever read in.
+        return cls({field: np.load(directory / f"{field}.npy", mmap_mode="r") for field in cls.FIELDS})
+
+    def batches(self, batch_size: int = FIXED_EVAL_BATCH):
+        """Yield dense (X, P, V, PW, VW) batches."""
+        arrays = self.arrays
+        for start in range(0, len(self), max(1, batch_size)):
+            stop = min(start + max(1, batch_size), len(self))
+            X = np.unpackbits(arrays["planes"][start:stop], axis=1, count=train.FLAT_SIZE)
+            X = X.astype(np.float32).reshape(-1, train.BOARD_H, train.BOARD_W, train.PLANES)
+            offsets = np.asarray(arrays["policy_offsets"][start:stop + 1])
+            P = np.zeros((stop - start, train.POLICY_SIZE), dtype=np.float32)
+            P[np.repeat(np.arange(stop - start), np.diff(offsets)), arrays["policy_indices"][offsets[0]:offsets[-1]]] = (
+                arrays["policy_values"][offsets[0]:offsets[-1]]
+            )
+            yield (
+                X,
+                P,
+                np.asarray(arrays["values"][start:stop]).reshape(-1, 1),
+                np.asarray(arrays["policy_weights"][start:stop]),
+                np.asarray(arrays["value_weights"][start:stop]),
+            )
 
-    metrics = {
-        "loss": total_loss,
-        "policy_logits_loss": policy_loss,
-        "value_loss": value_loss,
-        "value_mae": value_mae,
+
+def holdout_digest(samples: list[dict]) -> str:
+    key = {
+        "version": HOLDOUT_CACHE_VERSION,
+        "planes": train.PLANES,
+        "policy_version": train.POLICY_VERSION,
+        "policy_size": train.POLICY_SIZE,
+        "samples": samples,
     }
-    print(
-        f"[train] {label} validation loss {total_loss:.6f} "
-        f"(policy {policy_loss:.6f}, value {value_loss:.6f}, value_mae {value_mae:.6f})"
-    )
-    return metrics
+    return hashlib.sha256(json.dumps(key, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def load_fixed_holdout(samples: list[dict], cache_dir: pathlib.Path = FIXED_EVAL_CACHE) -> FixedHoldout:
+    """Holdout tensors from the cache entry for this eval set, encoding and caching them on a miss."""
+    directory = cache_dir / holdout_digest(samples)[:24]
+    if directory.is_dir():
+        try:
+            holdout = FixedHoldout.load(directory)
+            print(f"[train] fixed holdout {len(holdout)} positions from cache {directory}")
+            return holdout
+        except (OSError, ValueError) as exc:
+            print(f"[train] ignoring unreadable holdout cache {directory}: {exc}")
+            shutil.rmtree(directory, ignore_errors=True)
+
+    holdout = FixedHoldout.encode(samples)
+    try:
+        for stale in cache_dir.glob("*"):
+            if stale.is_dir() and stale.name != directory.name:
+                shutil.rmtree(stale, ignore_errors=True)
+        holdout.save(directory)
+    except OSError as exc:
+        print(f"[train] could not cache the fixed holdout in {cache_dir}: {exc}")
+    return holdout
+
+
+def evaluate_fixed_models(
+    models: dict[str, tf.keras.Model | None],
+    holdout: FixedHoldout,
+    batch_size: int = FIXED_EVAL_BATCH,
+) -> dict[str, dict | None]:
+    """
+    Weighted policy/value losses and value MAE of every model, in one streamed
+    pass over the holdout. Only one batch of logits exists at a time.
+    """
+    totals = {label: np.zeros(3, dtype=np.float64) for label, model in models.items() if model is not None}
+    policy_denominator = 0.0
+    value_denominator = 0.0
+    for X, P, V, PW, VW in holdout.batches(batch_size):
+        policy_denominator += float(np.sum(PW, dtype=np.float64))
+        value_denominator += float(np.sum(VW, dtype=np.float64))
+        for label in list(totals):
+            try:
+                predictions = models[label](X, training=False)
+            except Exception as exc:
+                print(f"[train] could not predict with {label} model: {exc}")
+                del totals[label]
+                continue
+            if not isinstance(predictions, (list, tuple)) or len(predictions) != 2:
+                print(f"[train] could not evaluate {label} model: expected two outputs")
+                del totals[label]
+                continue
+            policy_logits = np.asarray(predictions[0], dtype=np.float32)
+            value_prediction = np.asarray(predictions[1], dtype=np.float32).reshape(-1, 1)
+            if policy_logits.shape != P.shape or value_prediction.shape != V.shape:
+                print(
+                    f"[train] could not evaluate {label} model: output shapes "
+                    f"{policy_logits.shape}/{value_prediction.shape} do not match {P.shape}/{V.shape}"
+                )
+                del totals[label]
+                continue
+            value_error = (V - value_prediction).reshape(-1)
+            totals[label] += (
+                np.sum(_softmax_cross_entropy(P, policy_logits) * PW, dtype=np.float64),
+                np.sum(np.square(value_error) * VW, dtype=np.float64),
+                np.sum(np.abs(value_error) * VW, dtype=np.float64),
+            )
+
+    results = dict.fromkeys(models)
+    policy_denominator = max(policy_denominator, _EPS)
+    value_denominator = max(value_denominator, _EPS)
+    for label, (policy_sum, squared_sum, absolute_sum) in totals.items():
+        policy_loss = float(policy_sum / policy_denominator)
+        value_loss = float(squared_sum / value_denominator)
+        value_mae = float(absolute_sum / value_denominator)
+        total_loss = policy_loss + value_loss
+        results[label] = {
+            "loss": total_loss,
+            "policy_logits_loss": policy_loss,
+            "value_loss": value_loss,
+            "value_mae": value_mae,
+        }
+        print(
+            f"[train] {label} validation loss {total_loss:.6f} "
+            f"(policy {policy_loss:.6f}, value {value_loss:.6f}, value_mae {value_mae:.6f})"
+        )
+    return results
+
+
+def evaluate_fixed_model(model: tf.keras.Model | None, holdout: FixedHoldout, label: str) -> dict | None:
+    return evaluate_fixed_models({label: model}, holdout)[label]
 
 
 def evaluate_mcts_alignment(model: tf.keras.Model | None, samples: list[dict], label: str) -> dict | None:
@@ -309,6 +444,30 @@ def evaluate_mcts_alignment(model: tf.keras.Model | None, samples: list[dict], l
     return metrics
 
 
+def _side_mcts_alignment(models: dict, side: str, samples: list[dict], label: str) -> dict | None:
+    return evaluate_mcts_alignment(models.get(side), samples, label)
+
+
+def _side_arena_game(models: dict, plan: dict) -> tuple[float, mcts_stats.SearchStats | None]:
+    with mcts_stats.collect("arena_game") as stats:
+        options = dict(plan)
+        score = play_arena_game(models["candidate"], models["baseline"], options.pop("candidate_is_white"), **options)
+    return score, stats
+
+
+def gated_arena_games(executor: gating.GateExecutor):
+    """play_all for arena_score that spreads the games over the executor's workers."""
+    def play_all(plans: list[dict]) -> list[float]:
+        results = executor.map(_side_arena_game, [(plan,) for plan in plans])
+        collector = mcts_stats.active()
+        for _, stats in results:
+            if collector is not None and stats is not None:
+                collector.merge(stats)
+        return [score for score, _ in results]
+
+    return play_all
+
+
 def mcts_candidate_passes(
     baseline_metrics: dict | None,
     candidate_metrics: dict | None,
@@ -335,10 +494,14 @@ def mcts_candidate_passes(
     return True, "mcts_policy_improved"
 
 
+@telemetry.traced("train")
 def main():
+    import tensorflow as tf
+
+    train.seed_everything()
     fixed_samples = load_fixed_eval_set()
-    excluded_fens = {item.get("fen") for item in fixed_samples if item.get("fen")}
-    Xev, Pev, Vev, PWev, VWev = fixed_eval_arrays(fixed_samples)
+    excluded_fens = HashIndex.from_fens(item["fen"] for item in fixed_samples if item.get("fen"))
+    holdout = load_fixed_holdout(fixed_samples)
 
     X, policy_y, value_y, policy_weights, value_weights, self_play_count, fresh_count, stockfish_count = train.load_dataset(
         excluded_fens=excluded_fens
@@ -357,82 +520,93 @@ def main():
     model, resumed = train.load_or_build_model(X.shape[1:])
     epochs = train.CONTINUE_EPOCHS if resumed else train.COLD_START_EPOCHS
 
-    moving_baseline_eval = train.evaluate_model(baseline_model, Xva, Pva, Vva, PWva, VWva, "previous moving")
-    fixed_baseline_eval = evaluate_fixed_model(baseline_model, Xev, Pev, Vev, PWev, VWev, "previous fixed")
-
-    history = model.fit(
-        Xtr,
-        [Ptr, Vtr],
-        validation_data=(Xva, [Pva, Vva], [PWva, VWva]),
-        sample_weight=[PWtr, VWtr],
-        epochs=epochs,
-        batch_size=256,
-        verbose=2,
-        callbacks=[tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=2, restore_best_weights=True)],
-        shuffle=True,
-    )
+    with telemetry.span("holdout_eval", items=len(Xva)):
+        moving_baseline_eval = train.evaluate_model(baseline_model, Xva, Pva, Vva, PWva, VWva, "previous moving")
+
+    with telemetry.span("model_fit", items=len(Xtr)):
+        history = model.fit(
+            Xtr,
+            [Ptr, Vtr],
+            validation_data=(Xva, [Pva, Vva], [PWva, VWva]),
+            sample_weight=[PWtr, VWtr],
+            epochs=epochs,
+            batch_size=256,
+            verbose=2,
+            callbacks=[tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=2, restore_best_weights=True)],
+            shuffle=True,
+        )
 
-    moving_candidate_eval = train.evaluate_model(model, Xva, Pva, Vva, PWva, VWva, "candidate moving")
-    fixed_candidate_eval = evaluate_fixed_model(model, Xev, Pev, Vev, PWev, VWev, "candidate fixed")
+    with telemetry.span("holdout_eval", items=len(Xva) + 2 * len(holdout)):
+        moving_candidate_eval = train.evaluate_model(model, Xva, Pva, Vva, PWva, VWva, "candidate moving")
+        # The baseline is a separately loaded copy, so it is scored alongside the candidate in one pass.
+        fixed_evals = evaluate_fixed_models({"previous fixed": baseline_model, "candidate fixed": model}, holdout)
+        fixed_baseline_eval = fixed_evals["previous fixed"]
+        fixed_candidate_eval = fixed_evals["candidate fixed"]
     accepted, gate_reason = train.should_accept_candidate(fixed_candidate_eval, fixed_baseline_eval, resumed)
 
-    baseline_mcts_eval = None
-    candidate_mcts_eval = None
-    if accepted and resumed:
-        baseline_mcts_eval = evaluate_mcts_alignment(baseline_model, fixed_samples, "previous")
-        candidate_mcts_eval = evaluate_mcts_alignment(model, fixed_samples, "candidate")
-        mcts_accepted, mcts_reason = mcts_candidate_passes(
-            baseline_mcts_eval,
-            candidate_mcts_eval,
-        )
-        if not mcts_accepted:
-            accepted = False
-            gate_reason = mcts_reason
-        else:
-            gate_reason = f"{gate_reason}_and_{mcts_reason}"
-
-    arena_result = None
-    if accepted and resumed and baseline_model is not None and ARENA_GAMES > 0:
-        arena_fens = balanced_arena_fens(fixed_samples, (ARENA_GAMES + 1) // 2)
-        arena_result = arena_score(
-            model,
-            baseline_model,
-            games=ARENA_GAMES,
-            searches=ARENA_SEARCHES,
-            max_plies=ARENA_MAX_PLIES,
-            start_fens=arena_fens,
-        )
-        print(
-            f"[arena] candidate mean score {arena_result['score']:.3f}; "
-            f"record {arena_result['wins']}-{arena_result['draws']}-{arena_result['losses']}; "
-            f"required score {ARENA_MIN_SCORE:.3f} and "
-            f"{ARENA_MIN_DECISIVE_GAMES} decisive games"
-        )
-        if arena_result["decisive_games"] < ARENA_MIN_DECISIVE_GAMES:
-            accepted = False
-            gate_reason = "candidate_arena_not_decisive"
-        elif arena_result["score"] < ARENA_MIN_SCORE:
-            accepted = False
-            gate_reason = "candidate_arena_score_too_low"
-        else:
-            gate_reason = f"{gate_reason}_and_arena_passed"
+    with gating.GateExecutor({"baseline": baseline_model, "candidate": model}) as executor:
+        baseline_mcts_eval = None
+        candidate_mcts_eval = None
+        if accepted and resumed:
+            with telemetry.span("mcts_alignment"):
+                baseline_mcts_eval, candidate_mcts_eval = executor.map(
+                    _side_mcts_alignment,
+                    [("baseline", fixed_samples, "previous"), ("candidate", fixed_samples, "candidate")],
+                )
+            mcts_accepted, mcts_reason = mcts_candidate_passes(
+                baseline_mcts_eval,
+                candidate_mcts_eval,
+            )
+            if not mcts_accepted:
+                accepted = False
+                gate_reason = mcts_reason
+            else:
+                gate_reason = f"{gate_reason}_and_{mcts_reason}"
+
+        arena_result = None
+        if accepted and resumed and baseline_model is not None and ARENA_GAMES > 0:
+            arena_fens = balanced_arena_fens(fixed_samples, (ARENA_GAMES + 1) // 2)
+            with telemetry.span("arena", items=ARENA_GAMES):
+                arena_result = arena_score(
+                    model,
+                    baseline_model,
+                    games=ARENA_GAMES,
+                    searches=ARENA_SEARCHES,
+                    max_plies=ARENA_MAX_PLIES,
+                    start_fens=arena_fens,
+                    play_all=gated_arena_games(executor) if executor.parallel else None,
+                )
+            print(
+                f"[arena] candidate mean score {arena_result['score']:.3f}; "
+                f"record {arena_result['wins']}-{arena_result['draws']}-{arena_result['losses']}; "
+                f"required score {ARENA_MIN_SCORE:.3f} and "
+                f"{ARENA_MIN_DECISIVE_GAMES} decisive games"
+            )
+            if arena_result["decisive_games"] < ARENA_MIN_DECISIVE_GAMES:
+                accepted = False
+                gate_reason = "candidate_arena_not_decisive"
+            elif arena_result["score"] < ARENA_MIN_SCORE:
+                accepted = False
+                gate_reason = "candidate_arena_score_too_low"
+            else:
+                gate_reason = f"{gate_reason}_and_arena_passed"
 
     print(f"[train] candidate gate: accepted={accepted} reason={gate_reason}")
 
     if accepted:
-        model.save(train.CHECKPOINT_MODEL)
-        print(f"[train] saved accepted brain to {train.CHECKPOINT_MODEL}")
-        import tensorflowjs as tfjs
-        tfjs.converters.save_keras_model(model, str(train.OUT_DIR))
-        model_json = train.OUT_DIR / "model.json"
-        train.patch_tfjs_model_json(model_json)
-        train.smoke_check_tfjs_json(model_json)
+        with telemetry.span("tfjs_export"):
+            train.CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+            model.save(train.CHECKPOINT_MODEL)
+            print(f"[train] saved accepted brain to {train.CHECKPOINT_MODEL}")
+            import tensorflowjs as tfjs
+            tfjs.converters.save_keras_model(model, str(train.OUT_DIR))
+            model_json = train.finalize_tfjs_export(train.OUT_DIR)
         print(f"[train] saved accepted TFJS model to {model_json}")
     else:
         print("[train] rejected candidate; keeping previous checkpoint and browser model")
 
     extra_metrics = {
-        "fixed_holdout_positions": len(Xev),
+        "fixed_holdout_positions": len(holdout),
         "fixed_holdout_excluded_from_training": True,
     }
     if arena_result is not None:
@@ -450,6 +624,11 @@ def main():
                 "arena_start_positions": arena_result["start_positions"],
             }
         )
+    if arena_result is not None and arena_result.get("mcts"):
+        extra_metrics["arena_mcts"] = arena_result["mcts"]
+    self_play_stats = train.read_json_list(SELF_PLAY_STATS)
+    if self_play_stats:
+        extra_metrics["self_play_mcts_batches"] = self_play_stats
     if baseline_mcts_eval and candidate_mcts_eval:
         extra_metrics.update(
             {
@@ -477,6 +656,8 @@ def main():
         fixed_candidate_eval,
         extra_metrics=extra_metrics,
     )
+    # The self-play stats are reported once, in the run that follows them.
+    SELF_PLAY_STATS.unlink(missing_ok=True)
 
     if moving_baseline_eval and moving_candidate_eval:
         print(
@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
+"""
+Quantize TFJS Layers weights in place.
+
+Weights are stored as float16 by default or as TFJS uint8 affine
+quantization (value = q * scale + min, with min/scale in the manifest).
+--layer-dtype applies fnmatch patterns to weight names, and the value head
+stays float16 unless a pattern says otherwise. Conversions are vectorized
+with NumPy, and the CLI reports per-layer reconstruction error plus optional
+policy/value drift of a Keras model on holdout inputs.
+"""
 import argparse
+import fnmatch
+import hashlib
 import json
 import math
 import os
 import pathlib
-import struct
 
+import numpy as np
 
-def _scalar_count(weights: list[dict]) -> int:
-    return sum(math.prod(weight["shape"]) for weight in weights)
+# Models exported next to model.json that reuse its weight shards.
+COMPANION_MODEL_FILENAMES = ("value_model.json",)
+SHARD_BYTES = 4 * 1024 * 1024
+DTYPES = ("float32", "float16", "uint8")
+DEFAULT_LAYER_DTYPES = (("value/*", "float16"),)
+_BYTES_PER_SCALAR = {"float32": 4, "float16": 2, "uint8": 1}
 
 
 def _write_atomic(path: pathlib.Path, data: bytes | str) -> None:
@@ -20,7 +36,122 @@ def _write_atomic(path: pathlib.Path, data: bytes | str) -> None:
     os.replace(temporary, path)
 
 
-def quantize_model(model_path: pathlib.Path) -> tuple[int, int]:
+def _write_shards(data: bytes, model_dir: pathlib.Path, shard_bytes: int) -> list[str]:
+    # Mirrors ml/tfjs_layers_export.py: fixed-size shards named by content so
+    # unchanged weights keep their URLs and can be cached immutably.
+    shard_bytes = max(1, int(shard_bytes))
+    paths = []
+    for start in range(0, len(data), shard_bytes):
+        chunk = data[start:start + shard_bytes]
+        filename = f"group-{hashlib.sha256(chunk).hexdigest()[:20]}.bin"
+        shard_path = model_dir / filename
+        if not shard_path.exists() or shard_path.stat().st_size != len(chunk):
+            _write_atomic(shard_path, chunk)
+        paths.append(filename)
+    return paths
+
+
+def _sync_companion_manifests(model_path: pathlib.Path, weights_manifest: list[dict]) -> None:
+    for filename in COMPANION_MODEL_FILENAMES:
+        companion_path = model_path.parent / filename
+        if companion_path == model_path or not companion_path.exists():
+            continue
+        companion = json.loads(companion_path.read_text(encoding="utf-8"))
+        used_names = {
+            weight.get("name")
+            for group in companion.get("weightsManifest", [])
+            for weight in group.get("weights", [])
+        }
+        companion["weightsManifest"] = [
+            group for group in weights_manifest
+            if any(weight.get("name") in used_names for weight in group.get("weights", []))
+        ]
+        _write_atomic(companion_path, json.dumps(companion))
+
+
+def _stored_dtype(weight: dict, shard_label: str) -> str:
+    if weight.get("dtype") != "float32":
+        raise ValueError(f"unsupported weight dtype in {shard_label}")
+    dtype = weight.get("quantization", {}).get("dtype", "float32")
+    if dtype not in _BYTES_PER_SCALAR:
+        raise ValueError(f"unsupported quantization {dtype} in {shard_label}")
+    return dtype
+
+
+def _decode(raw: bytes, weight: dict, dtype: str) -> np.ndarray:
+    if dtype == "uint8":
+        quantization = weight["quantization"]
+        values = np.frombuffer(raw, dtype=np.uint8).astype(np.float32)
+        return values * np.float32(quantization["scale"]) + np.float32(quantization["min"])
+    return np.frombuffer(raw, dtype="<f4" if dtype == "float32" else "<f2").astype(np.float32)
+
+
+def affine_uint8(values: np.ndarray) -> tuple[np.ndarray, float, float]:
+    """Return TFJS uint8 codes plus min/scale, keeping zero exactly representable."""
+    low = min(float(np.min(values)), 0.0) if values.size else 0.0
+    high = max(float(np.max(values)), 0.0) if values.size else 0.0
+    scale = (high - low) / 255.0
+    if scale <= 0:
+        return np.zeros(values.shape, dtype=np.uint8), 0.0, 1.0
+    zero_point = float(np.clip(np.round(-low / scale), 0, 255))
+    minimum = -zero_point * scale
+    codes = np.clip(np.round((values - minimum) / scale), 0, 255).astype(np.uint8)
+    return codes, minimum, scale
+
+
+def _encode(values: np.ndarray, dtype: str) -> tuple[bytes, dict | None]:
+    if dtype == "uint8":
+        codes, minimum, scale = affine_uint8(values)
+        return codes.tobytes(), {"dtype": "uint8", "min": minimum, "scale": scale}
+    if dtype == "float16":
+        return values.astype("<f2").tobytes(), {"dtype": "float16"}
+    return values.astype("<f4").tobytes(), None
+
+
+def target_dtype(name: str, default: str, layer_dtypes=()) -> str:
+    for pattern, dtype in (*layer_dtypes, *DEFAULT_LAYER_DTYPES):
+        if fnmatch.fnmatchcase(name, pattern):
+            return dtype
+    return default
+
+
+def _read_group(model_dir: pathlib.Path, group: dict):
+    paths = group.get("paths", [])
+    weights = group.get("weights", [])
+    if not paths:
+        raise ValueError("weight group has no shard paths")
+
+    shard_label = ", ".join(paths)
+    source = b"".join((model_dir / path).read_bytes() for path in paths)
+    dtypes = [_stored_dtype(weight, shard_label) for weight in weights]
+    sizes = [math.prod(weight["shape"]) * _BYTES_PER_SCALAR[dtype] for weight, dtype in zip(weights, dtypes)]
+    if len(source) != sum(sizes):
+        raise ValueError(f"{shard_label} has {len(source)} bytes, expected {sum(sizes)}")
+
+    offsets = np.cumsum([0, *sizes])
+    raw = [source[offsets[index]:offsets[index + 1]] for index in range(len(weights))]
+    return source, weights, dtypes, raw
+
+
+def read_weights(model_path: pathlib.Path) -> dict[str, np.ndarray]:
+    """Return every manifest weight dequantized to float32 and reshaped."""
+    model = json.loads(model_path.read_text(encoding="utf-8"))
+    arrays = {}
+    for group in model.get("weightsManifest", []):
+        _, weights, dtypes, raw = _read_group(model_path.parent, group)
+        for weight, dtype, chunk in zip(weights, dtypes, raw):
+            arrays[weight["name"]] = _decode(chunk, weight, dtype).reshape(weight["shape"])
+    return arrays
+
+
+def quantize_model(
+    model_path: pathlib.Path,
+    shard_bytes: int = SHARD_BYTES,
+    dtype: str = "float16",
+    layer_dtypes=(),
+) -> tuple[int, int]:
+    if dtype not in DTYPES:
+        raise ValueError(f"unsupported target dtype {dtype}")
     model = json.loads(model_path.read_text(encoding="utf-8"))
     model_dir = model_path.parent
     original_bytes = 0
@@ -28,66 +159,130 @@ def quantize_model(model_path: pathlib.Path) -> tuple[int, int]:
     referenced_paths = set()
 
     for group in model.get("weightsManifest", []):
-        paths = group.get("paths", [])
-        weights = group.get("weights", [])
-        if len(paths) != 1:
-            raise ValueError("float16 optimizer requires one shard per weight group")
-
-        shard_path = model_dir / paths[0]
-        referenced_paths.add(shard_path.resolve())
-        scalar_count = _scalar_count(weights)
-        existing_quantization = {
-            weight.get("quantization", {}).get("dtype") for weight in weights
-        }
-
-        if existing_quantization == {"float16"}:
-            expected_size = scalar_count * 2
-            actual_size = shard_path.stat().st_size
-            if actual_size != expected_size:
-                raise ValueError(
-                    f"{shard_path.name} has {actual_size} bytes, expected {expected_size}"
-                )
-            original_bytes += actual_size
-            quantized_bytes += actual_size
-            continue
+        source, weights, dtypes, raw = _read_group(model_dir, group)
+        chunks = []
+        for weight, stored, chunk in zip(weights, dtypes, raw):
+            target = target_dtype(weight["name"], dtype, layer_dtypes)
+            if target == stored:
+                chunks.append(chunk)
+                continue
+            encoded, quantization = _encode(_decode(chunk, weight, stored), target)
+            chunks.append(encoded)
+            if quantization is None:
+                weight.pop("quantization", None)
+            else:
+                weight["quantization"] = quantization
 
-        if existing_quantization != {None}:
-            raise ValueError(f"unsupported mixed quantization in {shard_path.name}")
-        if any(weight.get("dtype") != "float32" for weight in weights):
-            raise ValueError(f"unsupported weight dtype in {shard_path.name}")
-
-        source = shard_path.read_bytes()
-        expected_size = scalar_count * 4
-        if len(source) != expected_size:
-            raise ValueError(
-                f"{shard_path.name} has {len(source)} bytes, expected {expected_size}"
-            )
-
-        output = bytearray(scalar_count * 2)
-        for index, (value,) in enumerate(struct.iter_unpack("<f", source)):
-            struct.pack_into("<e", output, index * 2, value)
-        _write_atomic(shard_path, bytes(output))
-
-        for weight in weights:
-            weight["quantization"] = {"dtype": "float16"}
+        output = b"".join(chunks)
+        group["paths"] = _write_shards(output, model_dir, shard_bytes)
+        referenced_paths.update(group["paths"])
         original_bytes += len(source)
         quantized_bytes += len(output)
 
     _write_atomic(model_path, json.dumps(model))
+    _sync_companion_manifests(model_path, model.get("weightsManifest", []))
 
     for shard_path in model_dir.glob("group*.bin"):
-        if shard_path.resolve() not in referenced_paths:
+        if shard_path.name not in referenced_paths:
             shard_path.unlink()
 
     return original_bytes, quantized_bytes
 
 
+def layer_errors(reference: dict[str, np.ndarray], quantized: dict[str, np.ndarray]) -> dict[str, dict]:
+    """Summarize absolute reconstruction error per layer (the weight-name prefix)."""
+    by_layer = {}
+    for name, expected in reference.items():
+        error = np.abs(quantized[name].astype(np.float64) - expected.astype(np.float64)).reshape(-1)
+        layer = name.rsplit("/", 1)[0]
+        stats = by_layer.setdefault(layer, {"max_error": 0.0, "error_sum": 0.0, "count": 0})
+        if error.size:
+            stats["max_error"] = max(stats["max_error"], float(np.max(error)))
+        stats["error_sum"] += float(np.sum(error))
+        stats["count"] += int(error.size)
+    return {
+        layer: {"max_error": stats["max_error"], "mean_error": stats["error_sum"] / max(1, stats["count"])}
+        for layer, stats in by_layer.items()
+    }
+
+
+def prediction_drift(keras_model_path: pathlib.Path, weights: dict[str, np.ndarray], inputs: np.ndarray) -> dict:
+    """Compare a Keras policy/value model with a copy using the given TFJS weights."""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_model_path, compile=False)
+    policy_before, value_before = (np.asarray(output, dtype=np.float64) for output in model.predict(inputs, verbose=0))
+    for layer in model.layers:
+        replacements = []
+        for weight in layer.weights:
+            name = (getattr(weight, "path", None) or weight.name).split(":", 1)[0]
+            if "/" not in name:
+                name = f"{layer.name}/{name}"
+            replacements.append(weights.get(name, weight.numpy()))
+        if replacements:
+            layer.set_weights(replacements)
+    policy_after, value_after = (np.asarray(output, dtype=np.float64) for output in model.predict(inputs, verbose=0))
+
+    def softmax(logits):
+        shifted = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        return shifted / np.sum(shifted, axis=1, keepdims=True)
+
+    variation = 0.5 * np.sum(np.abs(softmax(policy_after) - softmax(policy_before)), axis=1)
+    value_error = np.abs(value_after - value_before).reshape(-1)
+    return {
+        "positions": int(len(inputs)),
+        "policy_total_variation_mean": float(np.mean(variation)),
+        "policy_total_variation_max": float(np.max(variation)),
+        "policy_top_move_agreement": float(np.mean(np.argmax(policy_after, 1) == np.argmax(policy_before, 1))),
+        "value_abs_error_mean": float(np.mean(value_error)),
+        "value_abs_error_max": float(np.max(value_error)),
+    }
+
+
+def _layer_dtype(argument: str) -> tuple[str, str]:
+    pattern, separator, dtype = argument.rpartition("=")
+    if not separator or not pattern or dtype not in DTYPES:
+        raise argparse.ArgumentTypeError(f"expected PATTERN=DTYPE with DTYPE in {', '.join(DTYPES)}")
+    return pattern, dtype
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Quantize TFJS float32 weights to float16")
+    parser = argparse.ArgumentParser(description="Quantize TFJS weights to float16 or uint8")
     parser.add_argument("model_json", type=pathlib.Path)
+    parser.add_argument(
+        "--shard-bytes",
+        type=int,
+        default=SHARD_BYTES,
+        help="maximum size of each content-addressed weight shard",
+    )
+    parser.add_argument("--dtype", choices=DTYPES, default="float16", help="default storage dtype")
+    parser.add_argument(
+        "--layer-dtype",
+        type=_layer_dtype,
+        action="append",
+        default=[],
+        metavar="PATTERN=DTYPE",
+        help="override the dtype of weights whose name matches PATTERN (value/* defaults to float16)",
+    )
+    parser.add_argument("--drift-model", type=pathlib.Path, help="Keras checkpoint matching model_json")
+    parser.add_argument("--drift-inputs", type=pathlib.Path, help=".npy board features for drift checks")
     args = parser.parse_args()
-    original_bytes, quantized_bytes = quantize_model(args.model_json)
+
+    reference = read_weights(args.model_json)
+    original_bytes, quantized_bytes = quantize_model(
+        args.model_json,
+        shard_bytes=args.shard_bytes,
+        dtype=args.dtype,
+        layer_dtypes=args.layer_dtype,
+    )
+    quantized = read_weights(args.model_json)
     print(f"optimized TFJS weights: {original_bytes} -> {quantized_bytes} bytes")
+    for layer, stats in layer_errors(reference, quantized).items():
+        print(f"  {layer}: max error {stats['max_error']:.6g}, mean error {stats['mean_error']:.6g}")
+
+    if args.drift_model and args.drift_inputs:
+        drift = prediction_drift(args.drift_model, quantized, np.load(args.drift_inputs))
+        print(f"holdout drift: {json.dumps(drift)}")
 
 
 if __name__ == "__main__":
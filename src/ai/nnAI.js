@@ -7,11 +7,42 @@ import {
 } from './chessHeuristics';
 
 export const POLICY_CHANNELS = 5;
-export const POLICY_SIZE = 64 * 64 * POLICY_CHANNELS;
 const LEGACY_POLICY_SIZE = 64 * 64;
+export const V2_POLICY_SIZE = LEGACY_POLICY_SIZE * POLICY_CHANNELS;
+
+// Mirrors ml/policy_map.py: queen-line and knight moves, then the four
+// promotion pieces for every pawn step onto the last rank, in square order.
+function buildCompactPolicyIndex() {
+  const compact = new Int32Array(V2_POLICY_SIZE).fill(-1);
+  let next = 0;
+  for (let from = 0; from < 64; from++) {
+    for (let to = 0; to < 64; to++) {
+      const fileDelta = Math.abs((to % 8) - (from % 8));
+      const fromRank = Math.floor(from / 8);
+      const toRank = Math.floor(to / 8);
+      const rankDelta = Math.abs(toRank - fromRank);
+      const base = (from * 64 + to) * POLICY_CHANNELS;
+      const queenOrKnight = from !== to && (
+        fileDelta === 0 || rankDelta === 0 || fileDelta === rankDelta || fileDelta * rankDelta === 2
+      );
+      if (queenOrKnight) compact[base] = next++;
+      const promotionStep = fileDelta <= 1 && (
+        (fromRank === 6 && toRank === 7) || (fromRank === 1 && toRank === 0)
+      );
+      if (promotionStep) {
+        for (let channel = 1; channel < POLICY_CHANNELS; channel++) compact[base + channel] = next++;
+      }
+    }
+  }
+  return { compact, size: next };
+}
+
+const COMPACT_POLICY = buildCompactPolicyIndex();
+export const POLICY_SIZE = COMPACT_POLICY.size;
 
 let modelPromise = null;
 let modelWarmPromise = null;
+let valueModelPromise = null;
 
 async function loadModel() {
   if (!modelPromise) {
@@ -23,6 +54,24 @@ async function loadModel() {
   return modelPromise;
 }
 
+// value_model.json shares model.json's content-addressed weight shards but only
+// builds the value head and lists only its groups, so leaf evaluations neither
+// download nor compute the policy logits. Non-strict loading tolerates
+// manifests that still list every weight. Older exports ship only the
+// dual-head model, which still works for value-only predictions.
+async function loadValueModel() {
+  if (!valueModelPromise) {
+    valueModelPromise = tf.loadLayersModel(
+      `${process.env.PUBLIC_URL}/nn/value_model.json`,
+      { strict: false },
+    ).catch(() => loadModel()).catch((error) => {
+      valueModelPromise = null;
+      throw error;
+    });
+  }
+  return valueModelPromise;
+}
+
 export async function warmNNModel() {
   if (!modelWarmPromise) {
     modelWarmPromise = loadModel().then(async (model) => {
@@ -56,7 +105,9 @@ function promotionChannel(move) {
 
 export function moveToPolicyIndex(move, policySize = POLICY_SIZE) {
   const base = boardCoordToSquare(move.from) * 64 + boardCoordToSquare(move.to);
-  return policySize === LEGACY_POLICY_SIZE ? base : base * POLICY_CHANNELS + promotionChannel(move);
+  if (policySize === LEGACY_POLICY_SIZE) return base;
+  const v2Index = base * POLICY_CHANNELS + promotionChannel(move);
+  return policySize === V2_POLICY_SIZE ? v2Index : COMPACT_POLICY.compact[v2Index];
 }
 
 export function moveKey(move) {
@@ -132,7 +183,7 @@ function featuresFromPositions(positions, planeCount = 18) {
   return buf.toTensor();
 }
 
-async function rawPredictions(model, positions) {
+async function rawPredictions(model, positions, { includePolicy = true } = {}) {
   const planeCount = Number(model.inputs?.[0]?.shape?.[3]) || 18;
   const x = featuresFromPositions(positions, planeCount);
   const prediction = model.predict(x);
@@ -140,9 +191,9 @@ async function rawPredictions(model, positions) {
   const [policyTensor, valueTensor] = outputs.length === 2 ? outputs : [null, outputs[0]];
 
   try {
-    const policyData = policyTensor ? await policyTensor.data() : null;
+    const policyData = policyTensor && includePolicy ? await policyTensor.data() : null;
     const valueData = await valueTensor.data();
-    const policySize = policyTensor ? Number(policyTensor.shape[policyTensor.shape.length - 1]) : 0;
+    const policySize = policyData ? Number(policyTensor.shape[policyTensor.shape.length - 1]) : 0;
     return positions.map((_, index) => ({
       policyData: policyData?.subarray(index * policySize, (index + 1) * policySize) || null,
       value: valueData[index],
@@ -168,7 +219,7 @@ function predictionForLegalMoves(legalMoves, raw) {
   return { value: raw.value, priors, legalMoves, neuralAvailable: true };
 }
 
-export async function predictPolicyValueBatchForPositions(positions) {
+async function predictBatchForPositions(positions, { loadPredictionModel, includePolicy, toPrediction }) {
   const results = new Array(positions.length);
   const pending = [];
 
@@ -188,10 +239,10 @@ export async function predictPolicyValueBatchForPositions(positions) {
   if (pending.length === 0) return results;
 
   try {
-    const model = await warmNNModel();
-    const predictions = await rawPredictions(model, pending);
+    const model = await loadPredictionModel();
+    const predictions = await rawPredictions(model, pending, { includePolicy });
     pending.forEach((position, pendingIndex) => {
-      results[position.index] = predictionForLegalMoves(position.legalMoves, predictions[pendingIndex]);
+      results[position.index] = toPrediction(position.legalMoves, predictions[pendingIndex]);
     });
   } catch (error) {
     console.warn('Neural model unavailable; using uniform policy/value fallback.', error);
@@ -203,6 +254,27 @@ export async function predictPolicyValueBatchForPositions(positions) {
   return results;
 }
 
+export async function predictPolicyValueBatchForPositions(positions) {
+  return predictBatchForPositions(positions, {
+    loadPredictionModel: warmNNModel,
+    includePolicy: true,
+    toPrediction: predictionForLegalMoves,
+  });
+}
+
+export async function predictValueBatchForPositions(positions) {
+  return predictBatchForPositions(positions, {
+    loadPredictionModel: loadValueModel,
+    includePolicy: false,
+    toPrediction: (legalMoves, raw) => ({
+      value: raw.value,
+      priors: new Map(),
+      legalMoves,
+      neuralAvailable: true,
+    }),
+  });
+}
+
 export async function predictPolicyValueForMoves(pieces, color, enPassantTarget) {
   const [prediction] = await predictPolicyValueBatchForPositions([{ pieces, color, enPassantTarget }]);
   return prediction;
@@ -224,6 +296,7 @@ export async function pickNNMove(
   depth = 2,
   {
     predictBatch = predictPolicyValueBatchForPositions,
+    predictValueBatch,
     rootMoveLimit = 14,
     replyLimit = 12,
     tacticalCandidates = 6,
@@ -280,7 +353,12 @@ export async function pickNNMove(
   });
 
   if (leaves.length > 0) {
-    const rawLeaves = await predictBatch(leaves);
+    // Leaves only contribute their value, so skip the policy head unless the
+    // caller supplied its own predictor.
+    const predictLeafValues = predictValueBatch || (
+      predictBatch === predictPolicyValueBatchForPositions ? predictValueBatchForPositions : predictBatch
+    );
+    const rawLeaves = await predictLeafValues(leaves);
     leaves.forEach((leaf, leafIndex) => {
       const leafPrediction = stabilizePolicyValue(
         leaf.pieces,
@@ -1,6 +1,6 @@
 import { listLegalMoves, makeMove } from '../rules/chessRules';
 import { scoreMove } from './chessHeuristics';
-import { moveKey, moveToPolicyIndex, pickNNMove, POLICY_SIZE } from './nnAI';
+import { moveKey, moveToPolicyIndex, pickNNMove, POLICY_SIZE, V2_POLICY_SIZE } from './nnAI';
 
 const piece = (color, type, hasMoved = false) => ({ color, type, hasMoved });
 
@@ -42,6 +42,14 @@ describe('neural policy encoding', () => {
       to: { x: 4, y: 4 },
     };
     expect(moveToPolicyIndex(move, 4096)).toBe(12 * 64 + 28);
+    expect(moveToPolicyIndex(move, V2_POLICY_SIZE)).toBe((12 * 64 + 28) * 5);
+  });
+
+  test('compact policy indices match ml/policy_map.py', () => {
+    expect(POLICY_SIZE).toBe(1968);
+    expect(moveToPolicyIndex({ from: { x: 7, y: 1 }, to: { x: 5, y: 2 } })).toBe(36);
+    expect(moveToPolicyIndex({ from: { x: 6, y: 4 }, to: { x: 4, y: 4 } })).toBe(378);
+    expect(moveToPolicyIndex({ from: { x: 1, y: 0 }, to: { x: 0, y: 0 }, promotionType: 'knight' })).toBe(1490);
   });
 
   test('opening guard prefers development over weakening flank pawns', () => {
@@ -100,4 +108,36 @@ describe('neural policy encoding', () => {
     expect(predictBatch).toHaveBeenCalledTimes(3);
     expect(predictBatch.mock.calls.some(([positions]) => positions.length > 1)).toBe(true);
   });
+
+  test('routes leaf evaluations to the value-only predictor', async () => {
+    const pieces = initialPieces();
+    const uniform = (positions) => positions.map((position) => {
+      const legalMoves = listLegalMoves(position.pieces, position.color, position.enPassantTarget);
+      const probability = 1 / Math.max(1, legalMoves.length);
+      return {
+        value: 0,
+        legalMoves,
+        priors: new Map(legalMoves.map((move) => [moveKey(move), probability])),
+        neuralAvailable: true,
+      };
+    });
+    const predictBatch = jest.fn(async (positions) => uniform(positions));
+    const predictValueBatch = jest.fn(async (positions) => positions.map(() => ({
+      value: 0.1,
+      priors: new Map(),
+      neuralAvailable: true,
+    })));
+
+    await pickNNMove(pieces, 'white', null, 2, {
+      predictBatch,
+      predictValueBatch,
+      rootMoveLimit: 3,
+      replyLimit: 2,
+      tacticalTimeMs: 1,
+    });
+
+    expect(predictBatch).toHaveBeenCalledTimes(2);
+    expect(predictValueBatch).toHaveBeenCalledTimes(1);
+    expect(predictValueBatch.mock.calls[0][0]).toHaveLength(6);
+  });
 });